@@ -0,0 +1,262 @@
+# タイマー設定の一括分析（重なり・矛盾・同時ＯＮの上限）
+# 画面の check_hour_minute はリレー１個のタイマー１件しか確認しない。ここでは全ボードの全タイマー設定を
+# 1日（0時～24時）の分単位の区間にして、開始・終了の分ごとに並べた索引を作り、1回の走査で次を調べる。
+#   ・同じリレーのタイマー同士の重なり（同じ時間帯の重複を含む）
+#   ・開始と終了が同じ（ＯＮにならない）タイマー、範囲外の時刻
+#   ・日付をまたぐタイマー（有効だが、確認のため一覧にする）
+#   ・インターロックの規則（relay_interlock）に反する組み合わせがタイマーで同時にＯＮになる時間帯
+#   ・全ボードで同時にＯＮのリレーが max_on 個を超える時間帯
+# 索引は1440分の配列なので、タイマー設定が数万件でも件数に比例する時間で終わる。
+#   python relay_analyzer.py --db relay_registry.db --interlock settings.json --max-on 200
+#   python relay_analyzer.py relay_data.json --interlock settings.json
+#   python relay_analyzer.py --bench 50000
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+from collections import namedtuple
+from relay_schedule import MINUTES_PER_DAY, schedule_from_data, resolve_schedule
+from relay_interlock import Interlock, REJECT
+
+# 分析する1件のタイマー　start, end は 0時0分からの経過分、source は元の設定（表示用）
+Window = namedtuple("Window", ["board", "relay_number", "start", "end", "source"])
+
+class Analysis:
+    # 分析の結果
+    def __init__(self):
+        self.windows     = 0
+        self.invalid     = []   # [Window, ...] 範囲外の時刻・リレー番号
+        self.zero_length = []   # [Window, ...] 開始と終了が同じ
+        self.crossing    = []   # [Window, ...] 日付をまたぐ
+        self.overlaps    = []   # [(Window, Window, 重なる分数), ...] 同じリレーのタイマー同士
+        self.interlock   = []   # [(ボード名, 開始, 終了, マスク, [規則, ...]), ...]
+        self.capacity    = []   # [(開始, 終了, 最大の同時ＯＮ数), ...]
+        self.unresolved  = []   # [(ボード名, リレー番号), ...] 日の出・日の入り基準で場所が無いもの
+        self.elapsed     = 0.0
+
+    # 修正が必要な問題があるか（日付をまたぐタイマーは問題としない）
+    def has_problems(self):
+        return bool(self.invalid or self.zero_length or self.overlaps or self.interlock or self.capacity)
+
+class ScheduleAnalyzer:
+    # rules はインターロックの規則（settings.json の "interlocks" の形式）。ボードごとのリレー個数で組み立てる
+    # max_on は全ボードで同時にＯＮにしてよいリレーの数（Noneで調べない）
+    def __init__(self, rules=None, max_on=None):
+        self.rules      = rules or []
+        self.max_on     = max_on
+        self.windows    = []
+        self.quantities = {}     # {ボード名: リレー個数}
+        self.interlocks = {}     # {リレー個数: Interlock}
+        self.unresolved = []
+
+    def add(self, board, relay_number, start, end, source=None, quantity_relay=8):
+        self.quantities.setdefault(board, quantity_relay)
+        self.windows.append(Window(board, relay_number, start, end, source))
+
+    # 登録簿（relay_registry）の全ボードのタイマーＯＮの設定を追加する
+    def add_registry(self, registry):
+        for row in registry.all_schedules():
+            self.add(row["board_name"], row["relay_number"],
+                     row["start_hour"] * 60 + row["start_minute"], row["end_hour"] * 60 + row["end_minute"],
+                     f"タイマー設定 {row['id']}", row["quantity_relay"])
+
+    # リレーデータのjson（AutoLoadData.load_data() の形式）を追加する
+    # sun は分析する日の (日の出, 日の入り)。日の出・日の入り基準のタイマーは sun が無ければ分析しない
+    def add_data(self, board, loaded_data, sun=None):
+        for i, item in enumerate(loaded_data):
+            schedule = schedule_from_data(i + 1, item)
+            if schedule is None:
+                continue
+            window = resolve_schedule(schedule, sun)
+            if window is None:
+                self.unresolved.append((board, i + 1))
+                continue
+            self.add(board, i + 1, window[0], window[1], f"{board} {i + 1}件目", len(loaded_data))
+
+    def interlock_for(self, board):
+        if not self.rules:
+            return None
+        quantity_relay = self.quantities[board]
+        if quantity_relay not in self.interlocks:
+            self.interlocks[quantity_relay] = Interlock(quantity_relay, self.rules, REJECT)
+        return self.interlocks[quantity_relay]
+
+    def analyze(self):
+        started           = time.perf_counter()
+        result            = Analysis()
+        result.windows    = len(self.windows)
+        result.unresolved = list(self.unresolved)
+        windows           = self.windows
+        # 索引：分ごとに、その分に始まる区間 (番号, 終了) とその分に終わる区間の番号
+        starts = [[] for _ in range(MINUTES_PER_DAY + 1)]
+        ends   = [[] for _ in range(MINUTES_PER_DAY + 1)]
+        for index, window in enumerate(windows):
+            if not (0 <= window.start < MINUTES_PER_DAY and 0 <= window.end < MINUTES_PER_DAY
+                    and 1 <= window.relay_number <= self.quantities[window.board]):
+                result.invalid.append(window)
+                continue
+            if window.start == window.end:
+                result.zero_length.append(window)
+                continue
+            if window.start < window.end:
+                segments = ((window.start, window.end),)
+            else:
+                result.crossing.append(window)
+                segments = ((window.start, MINUTES_PER_DAY), (0, window.end)) if window.end else ((window.start, MINUTES_PER_DAY),)
+            for start, end in segments:
+                starts[start].append((index, end))
+                ends[end].append(index)
+
+        active     = {}   # {(ボード名, リレー番号): {区間の番号: 終了}}
+        masks      = {}   # {ボード名: タイマーでＯＮのリレーのマスク}
+        overlaps   = {}   # {(番号, 番号): 重なる分数}
+        violations = {}   # {ボード名: (開始, マスク)} 規則に反している途中のもの
+        over       = None # [開始, 最大数] 上限を超えている途中のもの
+        on_total   = 0
+        for minute in range(MINUTES_PER_DAY + 1):
+            if not starts[minute] and not ends[minute]:
+                continue
+            changed = set()
+            # 区間は [開始, 終了) なので、同じ分なら終了を先に処理する
+            for index in ends[minute]:
+                window = windows[index]
+                key    = (window.board, window.relay_number)
+                relay_active = active[key]
+                del relay_active[index]
+                if not relay_active:
+                    masks[window.board] &= ~(1 << (window.relay_number - 1))
+                    on_total -= 1
+                    changed.add(window.board)
+            for index, end in starts[minute]:
+                window = windows[index]
+                key    = (window.board, window.relay_number)
+                relay_active = active.setdefault(key, {})
+                for other, other_end in relay_active.items():
+                    pair = (other, index) if other < index else (index, other)
+                    overlaps[pair] = overlaps.get(pair, 0) + min(end, other_end) - minute
+                if not relay_active:
+                    masks[window.board] = masks.get(window.board, 0) | 1 << (window.relay_number - 1)
+                    on_total += 1
+                    changed.add(window.board)
+                relay_active[index] = end
+            # インターロック（マスクが変わったボードだけ、表を1回引く）
+            for board in changed:
+                interlock = self.interlock_for(board)
+                if interlock is None:
+                    continue
+                mask = masks[board]
+                if board in violations and violations[board][1] != mask:
+                    begin, broken = violations.pop(board)
+                    result.interlock.append((board, begin, minute, broken, interlock.violations(broken)))
+                if not interlock.allowed(mask) and board not in violations:
+                    violations[board] = (minute, mask)
+            # 全体の同時ＯＮ数
+            if self.max_on is not None:
+                if on_total > self.max_on:
+                    if over is None:
+                        over = [minute, on_total]
+                    over[1] = max(over[1], on_total)
+                elif over is not None:
+                    result.capacity.append((over[0], minute, over[1]))
+                    over = None
+        result.overlaps = [(windows[a], windows[b], minutes) for (a, b), minutes in sorted(overlaps.items())]
+        result.interlock.sort(key=lambda item: (item[0], item[1]))
+        result.elapsed  = time.perf_counter() - started
+        return result
+
+def hhmm(minute):
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+def describe(window):
+    return f"{window.board} リレー{window.relay_number} {hhmm(window.start % MINUTES_PER_DAY)}～{hhmm(window.end % MINUTES_PER_DAY)}" + \
+           (f"（{window.source}）" if window.source else "")
+
+# 分析結果を表示用の行のリストにする（各項目は limit 件まで）
+def report_lines(result, limit=20):
+    lines = [f"タイマー {result.windows}件を {result.elapsed * 1000:.1f}ms で分析しました"]
+    def section(title, items, format_item):
+        if not items:
+            return
+        lines.append(f"{title} {len(items)}件")
+        for item in items[:limit]:
+            lines.append("  " + format_item(item))
+        if len(items) > limit:
+            lines.append(f"  ...（他 {len(items) - limit}件）")
+    section("範囲外の時刻・リレー番号", result.invalid, describe)
+    section("開始と終了が同じ（ＯＮにならない）", result.zero_length, describe)
+    section("同じリレーのタイマーの重なり", result.overlaps,
+            lambda item: f"{describe(item[0])} と {describe(item[1])}  "
+                         f"{'同じ時間帯' if item[0][2:4] == item[1][2:4] else f'{item[2]}分重なる'}")
+    section("インターロックの規則に反する時間帯", result.interlock,
+            lambda item: f"{item[0]} {hhmm(item[1])}～{hhmm(item[2])}  ＯＮ {item[3]:b}  "
+                         + " / ".join(rule.name for rule in item[4]))
+    section("同時ＯＮの上限を超える時間帯", result.capacity,
+            lambda item: f"{hhmm(item[0])}～{hhmm(item[1])}  最大 {item[2]}個")
+    section("日付をまたぐタイマー（確認用）", result.crossing, describe)
+    section("日の出・日の入り基準で場所が設定されていないため分析しなかったタイマー", result.unresolved,
+            lambda item: f"{item[0]} リレー{item[1]}")
+    if not result.has_problems():
+        lines.append("問題は見つかりませんでした")
+    return lines
+
+#========メイン処理=========#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="タイマー設定の一括分析")
+    parser.add_argument("data_files", nargs="*",  help="リレーデータのjson（ボードごとに1ファイル）")
+    parser.add_argument("--db",        default=None, help="登録簿のデータベースファイル（全ボードを分析する）")
+    parser.add_argument("--interlock", default=None, help="インターロックの規則のファイル（settings.json 等）")
+    parser.add_argument("--max-on",    type=int, default=None, help="全ボードで同時にＯＮにしてよいリレーの数")
+    parser.add_argument("--limit",     type=int, default=20,   help="項目ごとに表示する件数")
+    parser.add_argument("--date",      default=None, help="日の出・日の入り基準のタイマーを分析する日 例: 2026-06-21")
+    parser.add_argument("--latitude",   type=float, default=None, help="日の出・日の入りを計算する場所の緯度")
+    parser.add_argument("--longitude",  type=float, default=None, help="日の出・日の入りを計算する場所の経度")
+    parser.add_argument("--utc-offset", type=float, default=None, help="UTCとの時差（時間）。省略時はこのPCの設定")
+    parser.add_argument("--bench",     type=int, default=0, help="乱数で作ったタイマー設定の件数で処理時間を計る")
+    args = parser.parse_args()
+
+    rules = []
+    if args.interlock:
+        try:
+            with open(args.interlock, "r", encoding="utf-8") as f:
+                data  = json.load(f)
+            rules = data if isinstance(data, list) else data.get("interlocks") or []
+        except (OSError, ValueError) as e:
+            print(f"インターロックの規則を読み込めませんでした: {e}")
+            sys.exit(1)
+    analyzer = ScheduleAnalyzer(rules, args.max_on)
+
+    if args.bench:
+        import random
+        rng = random.Random(1)
+        for n in range(args.bench):
+            board = f"board{n // 16 + 1}"
+            analyzer.add(board, n // 2 % 8 + 1, rng.randrange(MINUTES_PER_DAY), rng.randrange(MINUTES_PER_DAY))
+    if args.db:
+        from relay_registry import RelayRegistry
+        registry = RelayRegistry(args.db)
+        try:
+            analyzer.add_registry(registry)
+        finally:
+            registry.close()
+    sun = None
+    if args.latitude is not None and args.longitude is not None:
+        from relay_solar import SolarCalendar
+        day = datetime.fromisoformat(args.date) if args.date else datetime.now()
+        sun = SolarCalendar(args.latitude, args.longitude, args.utc_offset).day(day)
+    for data_file in args.data_files:
+        try:
+            with open(data_file, "r") as f:
+                analyzer.add_data(data_file, json.load(f), sun)
+        except (OSError, json.JSONDecodeError, KeyError, ValueError) as e:
+            print(f"ファイル '{data_file}' を読み込めませんでした: {e}")
+            sys.exit(1)
+
+    try:
+        result = analyzer.analyze()
+    except (ValueError, KeyError) as e:
+        print(f"エラーが発生しました: {e}")
+        sys.exit(1)
+    for line in report_lines(result, args.limit):
+        print(line)
+    sys.exit(1 if result.has_problems() else 0)
@@ -0,0 +1,117 @@
+# リレー名称・タイマー設定の自動保存
+# 画面で変更があるたびに保存を依頼し、変更が落ち着いてから（delay 秒後）バックグラウンドで
+# デフォルトファイルに保存する。書き込みは一時ファイルに書いてfsyncしてから置き換えるので、
+# 書き込み中に異常終了しても元のファイルが壊れることはない。内容が変わっていなければ保存しない。
+import os
+import json
+import tempfile
+import threading
+from relay_log import logger
+
+# data を json にして path にアトミックに保存する
+def atomic_write_json(path, data):
+    write_text_atomic(path, json.dumps(data, ensure_ascii=False, indent=4))
+
+def write_text_atomic(path, text):
+    write_file_atomic(path, text, "w", "utf-8")
+
+def write_bytes_atomic(path, data):
+    write_file_atomic(path, data, "wb")
+
+def write_file_atomic(path, data, mode, encoding=None):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, mode, encoding=encoding) as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    # 置き換えたことをディレクトリにも反映する（Windowsではディレクトリを開けないので省略）
+    if os.name == "posix":
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+class AutoSaver:
+    # 保存の依頼をまとめてバックグラウンドで保存するクラス
+    def __init__(self, path, delay=2.0):
+        self.path       = path
+        self.delay      = delay
+        self.pending    = None          # 保存待ちのデータ
+        self.saved      = self.read_saved()
+        self.condition  = threading.Condition()
+        self.stopped    = False
+        self.saving     = False
+        self.delay_skip = False         # Trueの場合は待たずにすぐ保存する
+        self.thread     = threading.Thread(target=self.run, name="AutoSaver", daemon=True)
+        self.thread.start()
+
+    # 保存済みの内容（変更がない場合に保存を省くため）
+    def read_saved(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.dumps(json.load(f), ensure_ascii=False, indent=4)
+        except (OSError, ValueError):
+            return None
+
+    # 保存を依頼する（すぐに戻る）　data は json にできるデータ
+    def submit(self, data):
+        with self.condition:
+            self.pending = data
+            self.condition.notify()
+
+    # 保存待ちのデータをすぐに保存し、終わるまで待つ
+    def flush(self, timeout=5.0):
+        with self.condition:
+            if self.pending is not None:
+                self.delay_skip = True
+                self.condition.notify()
+            self.condition.wait_for(lambda: self.pending is None and not self.saving, timeout)
+
+    def stop(self):
+        self.flush()
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending is not None or self.stopped)
+                if self.pending is None:
+                    return
+                # 最後の依頼から delay 秒間、次の依頼がなくなるまで待つ
+                while not self.delay_skip and not self.stopped:
+                    data = self.pending
+                    self.condition.wait(self.delay)
+                    if self.pending is data:
+                        break
+                data         = self.pending
+                self.pending = None
+                self.saving  = True
+            try:
+                self.save(data)
+            finally:
+                with self.condition:
+                    self.saving     = False
+                    self.delay_skip = False
+                    self.condition.notify_all()
+
+    def save(self, data):
+        text = json.dumps(data, ensure_ascii=False, indent=4)
+        if text == self.saved:
+            return
+        try:
+            write_text_atomic(self.path, text)
+            self.saved = text
+            logger.info("データを %s に自動保存しました", self.path)
+        except OSError as e:
+            logger.error("自動保存に失敗しました: %s", e)
@@ -0,0 +1,416 @@
+# リレーボードの仲介（ブローカー）プロセス
+# ひとつのプロセスだけがHIDデバイスを開き、他のプロセス（GUI、スクリプト等）は
+# Unixドメインソケット経由でこのブローカーに命令を送る。
+#
+# 通信は固定長のバイナリ形式で、要求をまとめて送信（パイプライン）できる。
+#   要求 7バイト : シーケンス番号(uint32) 命令(uint8) リレー番号(uint8) 引数(uint8)
+#   応答 6バイト : シーケンス番号(uint32) 結果(uint8) 命令実行後のマスク(uint8)
+# 引数は命令の優先度（relay_priority の INTERACTIVE=0 ～ BULK=3）で、複数のクライアントの命令は
+# 優先度の高いものから実行する（一括処理の後ろで手動操作が待たされない）。
+# 優先度ごとの期限（--deadline 優先度=秒）までに実行できなかった命令はエラーを返す。
+# 応答はクライアントごとに要求の順番どおりに返す。
+import os
+import sys
+import time
+import socket
+import struct
+import selectors
+import tempfile
+import logging
+import argparse
+from functools    import partial
+from collections  import deque
+from relay_device import HidRelayBoard, SimulatedRelayBoard, full_mask, RELAY_ON, RELAY_OFF, ALL_ON, ALL_OFF
+from relay_priority import CommandQueue, execute, STATUS, INTERACTIVE, BULK, PRIORITY_NAMES
+from relay_log    import setup_logging, stop_logging, audit_mask
+
+REQUEST  = struct.Struct(">IBBB")
+RESPONSE = struct.Struct(">IBB")
+
+# 命令
+OP_ON      = 1   # 個別リレーＯＮ
+OP_OFF     = 2   # 個別リレーＯＦＦ
+OP_ALL_ON  = 3   # 全リレーＯＮ
+OP_ALL_OFF = 4   # 全リレーＯＦＦ
+OP_STATUS  = 5   # 全リレーのステータス取得
+
+# 結果
+STATUS_OK    = 0
+STATUS_ERROR = 1
+
+PIPELINE_CHUNK = 1024   # 一度に送信する要求の最大数
+EXECUTE_SLICE  = 4      # 新しい要求を受け付けるまでに続けて実行する命令の数
+# 優先度ごとの命令の期限（キューに入ってからの秒数、None は期限無し）
+# 既定では期限を付けない（長いパイプラインが途中で期限切れにならないように）
+PRIORITY_DEADLINES = (None, None, None, None)
+
+IDLE_WAIT      = 0.5    # 命令が無い時に selector で待つ最大の秒数
+SEND_LIMIT     = 1 << 20   # 送れていない応答がこれを超えたクライアントからは、応答を読むまで要求を受け取らない
+
+# ブローカーの命令 → デバイスの命令コード
+DEVICE_OPCODES = {OP_ON: RELAY_ON, OP_OFF: RELAY_OFF, OP_ALL_ON: ALL_ON, OP_ALL_OFF: ALL_OFF, OP_STATUS: STATUS}
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), "usb_relay_broker.sock")
+
+logger = logging.getLogger("usb_relay.broker")
+
+class RelayBroker:
+    # デバイスを専有し、複数のクライアントからの命令を順番に実行するクラス
+    # status を指定すると、命令を実行するたびに共有メモリのステータスボード（relay_shm）に書き出す
+    # heartbeat（relay_watchdog.Heartbeat）を指定すると、処理のループを回るたびに生存通知を送る
+    # （命令が無くても生存通知の期限の 1/3 以内にループを回す）
+    # selector を渡すと、他の処理（relay_daemon 等）と同じ selector で待つ。登録する data は
+    # 準備ができたイベント（selectors.EVENT_READ/EVENT_WRITE）を引数に呼び出す関数
+    def __init__(self, board, socket_path=DEFAULT_SOCKET, status=None, board_name="board1", heartbeat=None, selector=None,
+                 deadlines=PRIORITY_DEADLINES):
+        self.board       = board
+        self.deadlines   = deadlines
+        self.socket_path = socket_path
+        self.status      = status
+        self.board_name  = board_name
+        self.heartbeat   = heartbeat
+        self.idle_wait   = min(IDLE_WAIT, heartbeat.timeout / 3) if heartbeat else IDLE_WAIT
+        self.queue       = CommandQueue()      # 全クライアントの命令の優先順位付きキュー
+        self.answered    = set()               # 応答が揃った可能性のあるクライアント
+        self.mask        = None                # 最後に分かったボードの状態（操作履歴の変更前の状態）
+        self.clients     = set()
+        self.shared      = selector is not None
+        self.selector    = selector or selectors.DefaultSelector()
+        self.server      = None
+        self.running     = False
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)   # 前回の残骸を削除
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_path)
+        self.server.listen()
+        self.server.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ, self.accept)
+        self.running = True
+
+    def serve_forever(self):
+        if self.server is None:
+            self.start()
+        try:
+            while self.running:
+                if self.heartbeat:
+                    self.heartbeat.beat()
+                # 実行待ちの命令がある間は待たずに新しい要求だけを受け取る
+                for key, events in self.selector.select(timeout=0 if len(self.queue) else self.idle_wait):
+                    key.data(events)
+                self.run_queue(EXECUTE_SLICE)
+        finally:
+            self.close()
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        for client in list(self.clients):
+            self.drop(client)
+        if self.server is not None:
+            self.selector.unregister(self.server)
+            self.server.close()
+            self.server = None
+        if not self.shared:
+            self.selector.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def accept(self, events=selectors.EVENT_READ):
+        try:
+            conn, _ = self.server.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        client = BrokerConnection(conn)
+        client.callback = partial(self.service, conn, client)
+        self.clients.add(client)
+        self.selector.register(conn, selectors.EVENT_READ, client.callback)
+
+    # 送れるようになった応答を送り、受信済みの要求をキューに入れる（実行は run_queue で優先度順に行う）
+    def service(self, conn, client, events=selectors.EVENT_READ):
+        if events & selectors.EVENT_WRITE:
+            self.flush(client)
+            if client.closed:
+                return
+        if not events & selectors.EVENT_READ:
+            return
+        try:
+            data = conn.recv(65536)
+        except ConnectionError:
+            data = b""
+        if not data:
+            self.drop(client)
+            return
+        client.received += data
+        count = len(client.received) // REQUEST.size
+        now   = self.queue.clock()
+        for offset in range(0, count * REQUEST.size, REQUEST.size):
+            seq, opcode, relay_number, arg = REQUEST.unpack_from(client.received, offset)
+            reply = client.expect()
+            if opcode not in DEVICE_OPCODES:
+                client.complete(reply, seq, None, "不明な命令")
+                continue
+            priority = min(arg, BULK)
+            timeout  = self.deadlines[priority]
+            self.queue.put(priority, DEVICE_OPCODES[opcode], relay_number,
+                           deadline=None if timeout is None else now + timeout,
+                           done=lambda command, mask, error, reply=reply, seq=seq: self.complete(client, reply, seq, mask, error))
+        del client.received[:count * REQUEST.size]
+        self.flush(client)
+
+    # 優先度の高い命令から最大 limit 個を実行し、応答できるようになったクライアントに返す
+    # 状態を変える命令は操作履歴に記録する
+    def run_queue(self, limit):
+        mask = None
+        for _ in range(limit):
+            command = self.queue.get()
+            if command is None:
+                break
+            old     = self.mask
+            started = time.perf_counter()
+            try:
+                mask = execute(self.board, command) & 0xFF
+            except Exception as e:
+                logger.error("ブローカーで命令の実行に失敗しました: %s", e)
+                self.mask = None
+                if command.writes():
+                    audit_mask("broker", self.board_name, command.relay_number or "all", old, None,
+                               time.perf_counter() - started, priority=PRIORITY_NAMES[command.priority], error=str(e))
+                command.finish(None, str(e))
+                continue
+            self.mask = mask
+            if command.writes():
+                audit_mask("broker", self.board_name, command.relay_number or "all", old, mask,
+                           time.perf_counter() - started, priority=PRIORITY_NAMES[command.priority])
+            command.finish(mask)
+        if mask is not None and self.status:
+            self.status.publish(self.board_name, current=mask)
+        answered, self.answered = self.answered, set()
+        for client in answered:
+            if client.ready():
+                self.flush(client)
+
+    def complete(self, client, reply, seq, mask, error):
+        client.complete(reply, seq, mask, error)
+        self.answered.add(client)
+
+    # 要求の順番で、先頭から応答が揃っている分を返す
+    # 送り切れない分はクライアントごとに残して EVENT_WRITE で待つ（読まないクライアントで他を止めない）
+    def flush(self, client):
+        if client.closed:
+            return
+        client.outgoing += client.take()
+        if client.outgoing:
+            try:
+                sent = client.conn.send(client.outgoing)
+            except BlockingIOError:
+                sent = 0
+            except ConnectionError:
+                self.drop(client)
+                return
+            del client.outgoing[:sent]
+        events = selectors.EVENT_WRITE if client.outgoing else 0
+        if len(client.outgoing) < SEND_LIMIT:
+            events |= selectors.EVENT_READ
+        if events != client.events:
+            client.events = events
+            self.selector.modify(client.conn, events, client.callback)
+
+    def drop(self, client):
+        if client.closed:
+            return
+        client.closed = True
+        self.clients.discard(client)
+        self.selector.unregister(client.conn)
+        client.conn.close()
+
+class BrokerConnection:
+    # クライアント１つ分の受信データと、要求の順番どおりに返すための応答の待ち行列
+    def __init__(self, conn):
+        self.conn     = conn
+        self.closed   = False
+        self.received = bytearray()
+        self.replies  = deque()     # 要求の順番の [応答 or None]
+        self.outgoing = bytearray() # 送り切れていない応答
+        self.events   = selectors.EVENT_READ
+        self.callback = None
+
+    def expect(self):
+        reply = [None]
+        self.replies.append(reply)
+        return reply
+
+    def complete(self, reply, seq, mask, error):
+        if error:
+            reply[0] = RESPONSE.pack(seq, STATUS_ERROR, 0)
+        else:
+            reply[0] = RESPONSE.pack(seq, STATUS_OK, mask)
+
+    def ready(self):
+        return bool(self.replies) and self.replies[0][0] is not None
+
+    def take(self):
+        data = bytearray()
+        while self.replies and self.replies[0][0] is not None:
+            data += self.replies.popleft()[0]
+        return data
+
+# "interactive=2" 等の指定のリストから優先度ごとの期限を作る
+def parse_deadlines(items):
+    deadlines = list(PRIORITY_DEADLINES)
+    for item in items:
+        name, _, seconds = item.partition("=")
+        if name.strip() not in PRIORITY_NAMES:
+            raise ValueError(f"優先度 '{name}' はありません（{', '.join(PRIORITY_NAMES)}）")
+        try:
+            deadline = float(seconds)
+        except ValueError:
+            raise ValueError(f"期限の秒数が正しくありません: {item}")
+        deadlines[PRIORITY_NAMES.index(name.strip())] = deadline if deadline > 0 else None
+    return tuple(deadlines)
+
+class RelayBrokerError(Exception):
+    pass
+
+class RelayBrokerClient:
+    # ブローカーに接続するクライアント。リレーボードと同じメソッドで操作できる。
+    # priority は命令の優先度（relay_priority の INTERACTIVE ～ BULK）
+    def __init__(self, socket_path=DEFAULT_SOCKET, quantity_relay=8, priority=INTERACTIVE):
+        self.quantity_relay = quantity_relay
+        self.priority       = priority
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.seq  = 0
+
+    def close(self):
+        self.sock.close()
+
+    # 複数の命令 [(命令, リレー番号), ...] をまとめて送信し、各命令実行後のマスクを順番に返す
+    def pipeline(self, commands):
+        if len(commands) > PIPELINE_CHUNK:
+            # 送受信のバッファが溢れて互いに待ち合わないよう、一定数ごとに区切る
+            masks = []
+            for i in range(0, len(commands), PIPELINE_CHUNK):
+                masks += self.pipeline(commands[i:i + PIPELINE_CHUNK])
+            return masks
+        requests = bytearray()
+        first    = self.seq
+        for opcode, relay_number in commands:
+            requests += REQUEST.pack(self.seq, opcode, relay_number, self.priority)
+            self.seq  = (self.seq + 1) & 0xFFFFFFFF
+        self.sock.sendall(requests)
+        replies = self.recv_exact(len(commands) * RESPONSE.size)
+        masks   = []
+        for i in range(len(commands)):
+            seq, status, mask = RESPONSE.unpack_from(replies, i * RESPONSE.size)
+            if seq != (first + i) & 0xFFFFFFFF:
+                raise RelayBrokerError("応答の順番が要求と一致しません")
+            if status != STATUS_OK:
+                raise RelayBrokerError(f"ブローカーが命令を実行できませんでした（命令={commands[i][0]}）")
+            masks.append(mask)
+        return masks
+
+    def recv_exact(self, size):
+        buffer = bytearray()
+        while len(buffer) < size:
+            chunk = self.sock.recv(size - len(buffer))
+            if not chunk:
+                raise RelayBrokerError("ブローカーとの接続が切断されました")
+            buffer += chunk
+        return buffer
+
+    def relay_on(self, relay_number):
+        return self.pipeline([(OP_ON, relay_number)])[0]
+
+    def relay_off(self, relay_number):
+        return self.pipeline([(OP_OFF, relay_number)])[0]
+
+    def on_all(self):
+        return self.pipeline([(OP_ALL_ON, 0)])[0]
+
+    def off_all(self):
+        return self.pipeline([(OP_ALL_OFF, 0)])[0]
+
+    def get_mask(self):
+        return self.pipeline([(OP_STATUS, 0)])[0]
+
+#========メイン処理=========#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="USBリレーボードのブローカー")
+    parser.add_argument("--socket",    default=DEFAULT_SOCKET,  help="Unixドメインソケットのパス")
+    parser.add_argument("--vender-id", default="0x16c0",        help="ベンダーID")
+    parser.add_argument("--device-id", default="0x05DF",        help="デバイスID")
+    parser.add_argument("--quantity",  type=int, default=8,     help="リレー個数")
+    parser.add_argument("--simulate",  action="store_true",     help="シミュレーションボードを使う")
+    parser.add_argument("--status-file", default=None,          help="状態を書き出す共有メモリのファイル")
+    parser.add_argument("--watchdog",  type=float, default=0,   help="処理が止まったとみなす秒数（0:ウォッチドッグ無し）")
+    parser.add_argument("--safe-mask", default="0",             help="処理が止まった時のリレーの状態 例: 0b00000011")
+    parser.add_argument("--trace",     default=None,            help="送受信したレポートを記録するファイル（HIDのみ）")
+    parser.add_argument("--interlock", default=None,            help="インターロックの規則のファイル（settings.json 等）")
+    parser.add_argument("--interlock-policy", choices=("reject", "resolve"), default=None, help="規則に反する命令の扱い")
+    parser.add_argument("--deadline",  action="append", default=[], help="優先度ごとの命令の期限（秒、0:期限無し） 例: bulk=30（複数指定可）")
+    args = parser.parse_args()
+    try:
+        deadlines = parse_deadlines(args.deadline)
+    except ValueError as e:
+        parser.error(str(e))
+
+    trace = None
+    if args.simulate:
+        board = SimulatedRelayBoard(args.quantity)
+    else:
+        if args.trace:
+            from relay_trace import TraceWriter
+            trace = TraceWriter(args.trace)
+        board = HidRelayBoard(int(args.vender_id, 0), int(args.device_id, 0), args.quantity, trace)
+    if not board.open():
+        print("デバイスをＯＰＥＮできないためブローカーを起動できません")
+        sys.exit(1)
+
+    setup_logging()
+    status = None
+    if args.status_file:
+        from relay_shm import StatusBoardWriter
+        status = StatusBoardWriter(args.status_file, [("board1", args.quantity)])
+        status.publish("board1", current=board.get_mask())
+    watchdog  = None
+    heartbeat = None
+    if args.watchdog > 0:
+        from relay_watchdog import Watchdog, parse_mask
+        # 安全な状態への送信は、止まった送信に巻き込まれないよう別に開いたデバイスで行う
+        safe_board = board if args.simulate else HidRelayBoard(int(args.vender_id, 0), int(args.device_id, 0), args.quantity)
+        if safe_board is board or safe_board.open():
+            watchdog  = Watchdog({"board1": safe_board}, {"board1": parse_mask(args.safe_mask)})
+            heartbeat = watchdog.register("broker", args.watchdog)
+            watchdog.start()
+        else:
+            print("ウォッチドッグ用にデバイスをＯＰＥＮできないため、ウォッチドッグ無しで起動します")
+    if args.interlock:
+        from relay_interlock import InterlockedBoard, load_interlock
+        try:
+            interlock = load_interlock(args.interlock, args.quantity, args.interlock_policy)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"インターロックの規則を読み込めません: {e}")
+            board.close()
+            sys.exit(1)
+        if interlock:
+            # クライアントからのすべての書き込みを規則で確認する（拒否した命令はエラーを返す）
+            if watchdog and not interlock.allowed(watchdog.safe_masks["board1"] & full_mask(args.quantity)):
+                print("安全な状態のマスクがインターロックの規則に反しています")
+            board = InterlockedBoard(board, interlock, "broker")
+    broker = RelayBroker(board, args.socket, status, heartbeat=heartbeat, deadlines=deadlines)
+    print(f"ブローカーを起動しました: {args.socket}")
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if watchdog:
+            watchdog.stop()
+        board.close()
+        if trace:
+            trace.close()
+        stop_logging()
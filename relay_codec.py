@@ -0,0 +1,64 @@
+# リレーボードの通信データ（レポート・フレーム・ステータス）の変換表
+# 命令のたびに [0, 0xFF, n, 0, 0, 0, 0, 0, 1] のようなリストを作らず、起動時に作った変更不可の
+# レポートを使い回す。ステータスのバイトから各リレーのＯＮ/ＯＦＦへの変換も256通りの表を引くだけにする。
+# HIDリレーボード・シリアルリレーボード・各画面のプログラムで共通に使う。
+from functools import lru_cache
+
+# HIDリレーボードの命令コード
+RELAY_ON  = 0xFF   # 個別リレーＯＮ
+RELAY_OFF = 0xFD   # 個別リレーＯＦＦ
+ALL_ON    = 0xFE   # 全リレーＯＮ
+ALL_OFF   = 0xFC   # 全リレーＯＦＦ
+
+REPORT_LENGTH = 9      # レポートID(0) 命令 リレー番号 予約(5バイト) 1
+STATUS_INDEX  = 8      # get() の応答でリレーの状態が入っている位置
+MAX_RELAY     = 8
+
+# 命令ごと・リレー番号（0～8、全ＯＮ/全ＯＦＦは0）ごとのレポート
+def make_report(opcode, relay_number=0):
+    return (0, opcode, relay_number, 0, 0, 0, 0, 0, 1)
+
+ON_REPORTS  = tuple(make_report(RELAY_ON,  n) for n in range(MAX_RELAY + 1))
+OFF_REPORTS = tuple(make_report(RELAY_OFF, n) for n in range(MAX_RELAY + 1))
+ALL_ON_REPORT  = make_report(ALL_ON)
+ALL_OFF_REPORT = make_report(ALL_OFF)
+REPORTS = {RELAY_ON: ON_REPORTS, RELAY_OFF: OFF_REPORTS,
+           ALL_ON: (ALL_ON_REPORT,) * (MAX_RELAY + 1), ALL_OFF: (ALL_OFF_REPORT,) * (MAX_RELAY + 1)}
+
+# 命令とリレー番号のレポートを返す
+def report(opcode, relay_number=0):
+    return REPORTS[opcode][relay_number]
+
+# ステータスのバイト → リレー1～8のＯＮ/ＯＦＦ（1/0）
+STATUS_BITS = tuple(tuple((value >> i) & 1 for i in range(MAX_RELAY)) for value in range(256))
+
+def decode_status(value):
+    return STATUS_BITS[value & 0xFF]
+
+# 状態（マスク）をまとめて書き込むボード（ChatGPT版の _send_state）用に、レポート長ごとの256通りのレポートを作る
+@lru_cache(maxsize=4)
+def mask_reports(report_length):
+    return tuple((0, mask) + (0,) * (report_length - 2) for mask in range(256))
+
+def mask_report(report_length, mask):
+    return mask_reports(report_length)[mask & 0xFF]
+
+# シリアルリレーボードのフレーム「A0 チャンネル 状態 チェックサム」
+FRAME_HEAD = 0xA0
+FRAMES = {(channel, state): bytes((FRAME_HEAD, channel, state, (FRAME_HEAD + channel + state) & 0xFF))
+          for channel in range(256) for state in (0, 1)}
+
+def encode_frame(channel, state):
+    return FRAMES[channel, state]
+
+class ResponseBuffer:
+    # 応答を受け取るための使い回しのバッファ（受信のたびにバッファを作らない）
+    def __init__(self, size=4096):
+        self.buffer = bytearray(size)
+        self.view   = memoryview(self.buffer)
+
+    # ファイル記述子から読み、読んだ部分の memoryview を返す（0バイトなら接続終了）
+    def read_fd(self, fd):
+        import os
+        count = os.readv(fd, [self.buffer])
+        return self.view[:count]
@@ -0,0 +1,390 @@
+# ヘッドレスのデーモン（画面無しでタイマーを動かす）
+# RelayControll.run() の画面は、何も起きない時間も1秒ごとに時刻を表示し、1分ごとにタイマーを判定する。
+# このデーモンは画面を使わずにスケジュールエンジン（relay_schedule）でタイマーを動かし、
+# 次の開始・終了の時刻、ブローカーへの命令、シグナルのどれかが来るまで select で眠る。
+# 何も起きない間は起きないので、小さな常設の機器でもCPUをほとんど使わない。
+#   SIGHUP          : 設定（タイマー・インターロック・場所）を読み直す
+#   SIGTERM, SIGINT : 停止する
+# --socket を指定すると、同じ select でブローカー（relay_broker）の命令も受け付ける。
+# systemd の Type=notify と WatchdogSec に対応する（NOTIFY_SOCKET が無ければ通知しない）。
+#   [Service]
+#   Type=notify
+#   ExecStart=/usr/bin/python3 /opt/usb_relay/relay_daemon.py /opt/usb_relay/settings.json --socket /run/usb_relay.sock
+#   ExecReload=/bin/kill -HUP $MAINPID
+#   WatchdogSec=60
+#   python relay_daemon.py settings.json --simulate --socket /tmp/usb_relay.sock
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import sqlite3
+import logging
+import argparse
+import selectors
+from collections    import namedtuple
+from datetime       import datetime
+from relay_device   import HidRelayBoard, SimulatedRelayBoard
+from relay_schedule import ScheduleEngine, schedules_from_data
+from relay_solar    import calendar_from_settings
+from relay_stagger  import StaggeredSequencer, tick_all
+from relay_broker   import RelayBroker, EXECUTE_SLICE
+from relay_interlock import InterlockedBoard, interlock_from_settings
+from relay_registry import RelayRegistry, parse_id
+from relay_log      import setup_logging, stop_logging, audit
+
+logger = logging.getLogger("usb_relay.daemon")
+
+WAKE_SLACK = 0.05   # 切り替えの分に確実に入ってから判定するための遅れ（秒）
+MAX_SLEEP  = 300    # 時計の変更（NTP・夏時間）に追従するため、この秒数ごとに判定し直す
+
+# ボード１枚分の設定　loaded_data は AutoLoadData.load_data() の形式
+BoardConfig = namedtuple("BoardConfig", "name vender_id device_id quantity_relay loaded_data")
+
+class SystemdNotifier:
+    # systemd への状態通知（sd_notify と同じ形式）。NOTIFY_SOCKET が無い（systemd 以外で起動した）場合は何もしない
+    # WatchdogSec を設定すると WATCHDOG_USEC が渡されるので、その半分の間隔で生存通知を送る
+    def __init__(self, environ=os.environ, clock=time.monotonic):
+        self.clock     = clock
+        self.address   = environ.get("NOTIFY_SOCKET") or None
+        self.sock      = None
+        self.interval  = None
+        self.next_ping = 0.0
+        if self.address:
+            if self.address[0] == "@":
+                self.address = "\0" + self.address[1:]     # 抽象名前空間のソケット
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            usec = environ.get("WATCHDOG_USEC")
+            pid  = environ.get("WATCHDOG_PID")
+            if usec and (not pid or int(pid) == os.getpid()):
+                self.interval = int(usec) / 1000000 / 2
+
+    def send(self, *fields):
+        if self.sock is None:
+            return False
+        try:
+            self.sock.sendto("\n".join(fields).encode("utf-8"), self.address)
+        except OSError as e:
+            logger.warning("systemd への通知に失敗しました: %s", e)
+            return False
+        return True
+
+    def ready(self, status=""):
+        self.send("READY=1", f"STATUS={status}")
+
+    def reloading(self):
+        self.send("RELOADING=1", f"MONOTONIC_USEC={time.monotonic_ns() // 1000}")
+
+    def stopping(self):
+        self.send("STOPPING=1")
+
+    def status(self, text):
+        self.send(f"STATUS={text}")
+
+    # 生存通知の時刻になっていれば送り、次に送るまでの秒数を返す（ウォッチドッグが無ければNone）
+    def ping(self):
+        if self.interval is None:
+            return None
+        now = self.clock()
+        if now >= self.next_ping:
+            self.send("WATCHDOG=1")
+            self.next_ping = now + self.interval
+        return self.next_ping - now
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+class HistoryRecorder:
+    # ブローカーの status の代わりに渡し、クライアントの命令で変わった状態を履歴（relay_history）に記録する
+    def __init__(self, history, quantity_relay):
+        self.history        = history
+        self.quantity_relay = quantity_relay
+
+    def publish(self, board_name, current=None, **fields):
+        if current is not None:
+            self.history.record_mask(board_name, self.quantity_relay, current)
+
+def read_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+# settings.json のボード（リレーデータは auto_load のファイル）
+# ボード名は画面のプログラムの操作履歴と同じ「ベンダーID:デバイスID」
+def load_settings_boards(setting_file, settings):
+    vender_id   = parse_id(settings.get("vender_id", ""))
+    device_id   = parse_id(settings.get("device_id", ""))
+    loaded_data = []
+    if settings.get("auto_load"):
+        loaded_data = read_json(os.path.join(os.path.dirname(os.path.abspath(setting_file)), settings["auto_load"]))
+    return [BoardConfig(f"{vender_id}:{device_id}", vender_id, device_id, int(settings["quantity_relay"]), loaded_data)]
+
+# 登録簿（relay_registry）の全ボード
+def load_registry_boards(db):
+    registry = RelayRegistry(db)
+    try:
+        return [BoardConfig(row["name"], row["vender_id"], row["device_id"], row["quantity_relay"],
+                            registry.load_board_data(row["id"])) for row in registry.list_boards()]
+    finally:
+        registry.close()
+
+class RelayDaemon:
+    # 画面無しでタイマーを動かすクラス
+    # setting_file の settings.json から場所・インターロック・履歴のファイルを読む。
+    # db を指定するとボードとタイマー設定は登録簿の全ボード、指定しなければ settings.json のボードを使う。
+    # stagger（秒）を指定すると、同じ分に重なったＯＮを relay_stagger でずらす（その間はループが止まる）。
+    def __init__(self, setting_file, db=None, simulate=False, socket_path=None, stagger=0.0, deadline=2.0,
+                 max_sleep=MAX_SLEEP, notifier=None, clock=datetime.now):
+        self.setting_file = setting_file
+        self.db           = db
+        self.simulate     = simulate
+        self.socket_path  = socket_path
+        self.stagger      = stagger
+        self.deadline     = deadline
+        self.max_sleep    = max_sleep
+        self.notifier     = notifier or SystemdNotifier()
+        self.clock        = clock
+        self.selector     = selectors.DefaultSelector()
+        self.devices      = {}       # {ボード名: 開いたボード}
+        self.boards       = {}       # {ボード名: 書き込みに使うボード（規則があれば InterlockedBoard）}
+        self.engines      = {}       # {ボード名: ScheduleEngine}
+        self.brokers      = {}       # {ボード名: RelayBroker}
+        self.sequencer    = None
+        self.history      = None
+        self.due          = None     # 次に判定する時刻（タイマー設定が無ければNone）
+        self.stale        = True     # 起動・設定の読み直しの後は、時刻に関係なく判定する
+        self.recheck      = 0.0      # 次に時計の変更を確認する時刻（time.monotonic）
+        self.running      = False
+        self.wakeups      = 0        # select から戻った回数（確認用）
+        self.signal_pair  = None
+
+    def load(self):
+        settings = read_json(self.setting_file)
+        if self.db:
+            return settings, load_registry_boards(self.db)
+        return settings, load_settings_boards(self.setting_file, settings)
+
+    def start(self):
+        try:
+            self.open()
+        except BaseException:
+            self.close()
+            raise
+        self.running = True
+        self.notifier.ready(self.describe())
+
+    def open(self):
+        settings, configs = self.load()
+        for config in configs:
+            if self.simulate:
+                device = SimulatedRelayBoard(config.quantity_relay)
+            else:
+                device = HidRelayBoard(config.vender_id, config.device_id, config.quantity_relay)
+            if not device.open():
+                raise OSError(f"{config.name} のデバイスをＯＰＥＮできません")
+            self.devices[config.name] = device
+            self.engines[config.name] = ScheduleEngine(device, [], clock=self.clock)
+        self.configure(settings, configs)
+
+        # 設定ファイルに "history_file" があれば、リレーの状態の履歴を記録する（画面のプログラムと同じ）
+        if settings.get("history_file"):
+            from relay_history import HistoryStore
+            self.history = HistoryStore(os.path.join(os.path.dirname(os.path.abspath(self.setting_file)),
+                                                     settings["history_file"]))
+            self.history.start()
+            for name, device in self.devices.items():
+                self.history.record_mask(name, device.quantity_relay, device.get_mask())
+        if self.socket_path:
+            for name, board in self.boards.items():
+                path   = self.socket_path if len(self.boards) == 1 else f"{self.socket_path}.{name}"
+                status = HistoryRecorder(self.history, board.quantity_relay) if self.history else None
+                self.brokers[name] = RelayBroker(board, path, status, board_name=name, selector=self.selector)
+                self.brokers[name].start()
+                logger.info("ブローカーを起動しました: %s", path)
+        self.install_signals()
+
+    # タイマー設定・場所・インターロックを各ボードに反映する（起動時と SIGHUP で呼ぶ）
+    # 読み込みや規則に誤りがあれば例外を出し、どのボードも前の設定のままにする
+    def configure(self, settings, configs):
+        configs = [config for config in configs if config.name in self.devices]
+        if len(configs) != len(self.devices):
+            logger.warning("ボードの追加・削除は再起動するまで反映されません")
+        solar   = calendar_from_settings(settings)
+        changes = []
+        for config in configs:
+            device    = self.devices[config.name]
+            interlock = interlock_from_settings(settings, device.quantity_relay)
+            board     = InterlockedBoard(device, interlock, "daemon") if interlock else device
+            changes.append((config.name, board, schedules_from_data(config.loaded_data)))
+        for name, board, schedules in changes:
+            engine       = self.engines[name]
+            engine.board = board
+            engine.solar = solar
+            engine.set_schedules(schedules)
+            engine.invalidate()
+            self.boards[name] = board
+            if name in self.brokers:
+                self.brokers[name].board = board
+        self.sequencer = StaggeredSequencer(self.boards, self.stagger, self.deadline) if self.stagger > 0 else None
+        self.stale     = True
+        self.schedule_next(self.clock())
+
+    # シグナルはハンドラでは何もせず、set_wakeup_fd でソケットに書かれたシグナル番号を select で受け取って処理する
+    def install_signals(self):
+        self.signal_pair = socket.socketpair()
+        for sock in self.signal_pair:
+            sock.setblocking(False)
+        signal.set_wakeup_fd(self.signal_pair[1].fileno(), warn_on_full_buffer=False)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self.on_signal)
+        self.selector.register(self.signal_pair[0], selectors.EVENT_READ, self.handle_signals)
+
+    def on_signal(self, signum, frame):
+        pass
+
+    def handle_signals(self, events=selectors.EVENT_READ):
+        try:
+            received = set(self.signal_pair[0].recv(64))
+        except BlockingIOError:
+            return
+        if signal.SIGTERM in received or signal.SIGINT in received:
+            logger.info("停止します")
+            self.running = False
+        elif signal.SIGHUP in received:
+            self.reload()
+
+    def reload(self):
+        self.notifier.reloading()
+        try:
+            self.configure(*self.load())
+        except (OSError, ValueError, KeyError, TypeError, sqlite3.Error) as e:
+            logger.error("設定を読み直せませんでした（前の設定のまま動かします）: %s", e)
+        else:
+            logger.info("設定を読み直しました")
+        self.notifier.ready(self.describe())
+
+    # タイマーを判定してボードに反映する
+    def tick(self):
+        started  = time.perf_counter()
+        timeline = []
+        if self.sequencer:
+            try:
+                timeline = tick_all(self.engines, self.sequencer)
+            except Exception as e:
+                logger.error("タイマーの反映に失敗しました: %s", e)
+                for engine in self.engines.values():
+                    engine.invalidate()
+        else:
+            for name, engine in self.engines.items():
+                try:
+                    timeline.extend((when, name, relay_number, on) for when, relay_number, on in engine.tick())
+                except Exception as e:
+                    logger.error("タイマーの反映に失敗しました（%s）: %s", name, e)
+                    engine.invalidate()
+        latency = time.perf_counter() - started
+        for when, name, relay_number, on in timeline:
+            logger.info("タイマー: %s リレー%d %s", name, relay_number, "ＯＮ" if on else "ＯＦＦ")
+            audit("timer", name, relay_number, not on, on, latency)
+            if self.history:
+                self.history.record(name, relay_number, on, when.timestamp())
+        if self.history:
+            # インターロックの規則で他のリレーも切り替わっている場合があるので、ボードの状態も記録する
+            for name in {name for _, name, _, _ in timeline}:
+                device = self.devices[name]
+                self.history.record_mask(name, device.quantity_relay, device.get_mask(), timeline[0][0].timestamp())
+        return timeline
+
+    # 全ボードの次の開始・終了の時刻
+    def schedule_next(self, now):
+        events   = [event for event in (engine.next_event(now) for engine in self.engines.values()) if event]
+        self.due = min(events) if events else None
+
+    # select で待つ秒数　次の切り替え・時計の確認・systemd の生存通知のうち最も早いものまで
+    # 生存通知（WATCHDOG=1）は命令が溜まり続けている間も送る
+    def timeout(self, now):
+        ping = self.notifier.ping()
+        if any(len(broker.queue) for broker in self.brokers.values()):
+            return 0            # 実行待ちの命令がある間は待たずに新しい要求だけを受け取る
+        timeout = self.recheck - time.monotonic()
+        if self.due is not None:
+            timeout = min(timeout, (self.due - now).total_seconds() + WAKE_SLACK)
+        if ping is not None:
+            timeout = min(timeout, ping)
+        return max(timeout, 0)
+
+    def describe(self):
+        due = f"次の切り替え {self.due:%m/%d %H:%M}" if self.due else "タイマー設定無し"
+        return f"ボード {len(self.devices)}枚  {due}"
+
+    def run(self):
+        try:
+            while self.running:
+                now = self.clock()
+                if self.stale or (self.due is not None and now >= self.due) or time.monotonic() >= self.recheck:
+                    self.stale = False
+                    self.tick()
+                    now = self.clock()
+                    self.schedule_next(now)
+                    self.recheck = time.monotonic() + self.max_sleep
+                    self.notifier.status(self.describe())
+                for key, events in self.selector.select(self.timeout(now)):
+                    key.data(events)
+                self.wakeups += 1
+                for broker in self.brokers.values():
+                    broker.run_queue(EXECUTE_SLICE)
+        finally:
+            self.close()
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        self.notifier.stopping()
+        for broker in self.brokers.values():
+            broker.close()
+        self.brokers = {}
+        if self.signal_pair:
+            signal.set_wakeup_fd(-1)
+            for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, signal.SIG_DFL if signum != signal.SIGINT else signal.default_int_handler)
+            self.selector.unregister(self.signal_pair[0])
+            for sock in self.signal_pair:
+                sock.close()
+            self.signal_pair = None
+        for device in self.devices.values():
+            device.close()
+        self.devices = {}
+        if self.history:
+            self.history.stop()         # 状態の履歴を保存する
+            self.history = None
+        self.selector.close()
+        self.notifier.close()
+
+#========メイン処理=========#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="画面無しでタイマーを動かすデーモン")
+    parser.add_argument("setting_file", help="設定ファイル（settings.json）")
+    parser.add_argument("--db",        default=None, help="登録簿のデータベースファイル（全ボードのタイマーを動かす）")
+    parser.add_argument("--simulate",  action="store_true", help="シミュレーションボードを使う")
+    parser.add_argument("--socket",    default=None, help="ブローカーのUnixドメインソケットのパス（ボードが複数なら .ボード名 を付ける）")
+    parser.add_argument("--stagger",   type=float, default=0.0, help="同じ分に重なったＯＮの間隔（秒、0:ずらさない）")
+    parser.add_argument("--deadline",  type=float, default=2.0, help="ずらしたＯＮを終えるまでの上限（秒）")
+    parser.add_argument("--max-sleep", type=float, default=MAX_SLEEP, help="時計の変更を確認する間隔（秒）")
+    args = parser.parse_args()
+
+    setup_logging()
+    daemon = RelayDaemon(args.setting_file, args.db, args.simulate, args.socket,
+                         args.stagger, args.deadline, args.max_sleep)
+    try:
+        daemon.start()
+    except (OSError, ValueError, KeyError, TypeError, sqlite3.Error) as e:
+        logger.error("デーモンを起動できません: %s", e)
+        stop_logging()
+        sys.exit(1)
+    logger.info("デーモンを起動しました  %s", daemon.describe())
+    try:
+        daemon.run()
+    finally:
+        stop_logging()
@@ -0,0 +1,151 @@
+# リレーボードのデバイス層
+# HIDリレーボード（ベンダーID：0x16c0 デバイスID：0x05DF）と、ハードウェア無しで
+# 試験するためのシミュレーションボードを同じメソッドで操作できるようにする。
+import time
+import threading
+from relay_codec import RELAY_ON, RELAY_OFF, ALL_ON, ALL_OFF, REPORTS, ON_REPORTS, OFF_REPORTS, \
+                        ALL_ON_REPORT, ALL_OFF_REPORT, STATUS_INDEX
+
+# ボードの全リレーのマスク（リレー1がビット0）
+def full_mask(quantity_relay):
+    return (1 << quantity_relay) - 1
+
+# actual（現在のマスク）から desired（あるべきマスク）への差分の操作を、送信せずに作る
+# care のビットが立っているリレーだけを対象とし、切り替え後のマスクと [(ボードのメソッド, 引数), ...] を返す
+# order はＯＮにするリレーの順番（0始まりのリレー番号の並び、省略時は番号順）
+# インターロック付きのボード（relay_interlock.InterlockedBoard）は、切り替え後のマスク全体を plan() で１回だけ
+# 確認し（規則で直すこともある）、操作は確認済みとして元のボードに直接送る
+def difference_steps(board, actual, desired, care=None, order=None):
+    full   = full_mask(board.quantity_relay)
+    care   = full if care is None else care & full
+    target = (actual & ~care | desired & care) & full
+    diff   = (actual ^ target) & full
+    if not diff:
+        return target, []
+    plan = getattr(board, "plan", None)
+    if plan:
+        target, board, order = plan(actual, target, diff)
+        diff = (actual ^ target) & full
+        if not diff:
+            return target, []
+    # 複数のリレーを切り替えて全ＯＮ/全ＯＦＦになる場合は１レポートで済ませる
+    if bin(diff).count("1") > 1 and target in (0, full):
+        return target, [(board.on_all if target else board.off_all, ())]
+    # ＯＦＦを先に送る（正転・逆転のようなリレーが一瞬でも同時にＯＮにならないように）
+    steps = [(board.relay_off, (n + 1,)) for n in range(board.quantity_relay) if diff & ~target & (1 << n)]
+    steps += [(board.relay_on, (n + 1,)) for n in order or range(board.quantity_relay) if diff & target & (1 << n)]
+    return target, steps
+
+# actual（現在のマスク）から desired（あるべきマスク）への差分だけをボードに送信する
+# care のビットが立っているリレーだけを対象とし、送信後のマスクと送信したレポート数を返す
+def apply_difference(board, actual, desired, care=None, order=None):
+    target, steps = difference_steps(board, actual, desired, care, order)
+    for method, args in steps:
+        method(*args)
+    return target, len(steps)
+
+class HidRelayBoard:
+    # pywinusbでHIDリレーボードを操作するクラス
+    # trace（relay_trace.TraceWriter）を指定すると、送受信したレポートをトレースファイルに記録する
+    def __init__(self, vender_id, device_id, quantity_relay=8, trace=None):
+        self.vender_id      = vender_id
+        self.device_id      = device_id
+        self.quantity_relay = quantity_relay
+        self.trace          = trace
+        self.USB_device     = None
+        self.report         = None
+
+    # デバイスを取得してオープンする
+    def open(self):
+        import pywinusb.hid as hid   # Windows以外でもこのモジュールを読み込めるようにここでインポートする
+        hid_device = hid.HidDeviceFilter(vendor_id=self.vender_id, product_id=self.device_id).get_devices()
+        if not hid_device:
+            print("エラー: デバイスが見つかりません")
+            return False
+        self.USB_device = hid_device[0]
+        self.USB_device.open()
+        for dev in self.USB_device.find_output_reports() + self.USB_device.find_feature_reports():
+            self.report = dev
+        if self.report is None:
+            print("エラー: デバイスのレポートが見つかりません")
+            self.close()
+            return False
+        if self.trace:
+            from relay_trace import TracingReport
+            self.report = TracingReport(self.report, self.trace)
+        return True
+
+    # デバイスを閉じる
+    def close(self):
+        if self.USB_device is not None and self.USB_device.is_opened():
+            self.USB_device.close()
+        self.USB_device = None
+        self.report     = None
+
+    # レポートは relay_codec で作っておいたものを使う（送信のたびにリストを作らない）
+    def send(self, opcode, relay_number=0):
+        self.report.send(raw_data=REPORTS[opcode][relay_number])
+
+    def relay_on(self, relay_number):
+        self.report.send(raw_data=ON_REPORTS[relay_number])
+
+    def relay_off(self, relay_number):
+        self.report.send(raw_data=OFF_REPORTS[relay_number])
+
+    def on_all(self):
+        self.report.send(raw_data=ALL_ON_REPORT)
+
+    def off_all(self):
+        self.report.send(raw_data=ALL_OFF_REPORT)
+
+    # 全リレーのＯＮＯＦＦをビットマスクで返す（8番目がリレーの状態ステータス）
+    def get_mask(self):
+        return self.report.get()[STATUS_INDEX]
+
+class SimulatedRelayBoard:
+    # ハードウェアを使わずにHIDリレーボードの動作を再現するクラス
+    # latency を指定すると、レポートの送受信ごとにその秒数だけ待つ（負荷試験用）
+    def __init__(self, quantity_relay=8, mask=0, latency=0.0):
+        self.quantity_relay = quantity_relay
+        self.mask           = mask
+        self.latency        = latency
+        self.reports_sent   = 0     # 送信したレポート数（試験・ベンチマーク用）
+        self.lock           = threading.Lock()
+
+    def open(self):
+        return True
+
+    def close(self):
+        pass
+
+    def send(self, opcode, relay_number=0):
+        with self.lock:
+            if self.latency:
+                time.sleep(self.latency)
+            self.reports_sent += 1
+            if opcode == RELAY_ON and 1 <= relay_number <= self.quantity_relay:
+                self.mask |= 1 << (relay_number - 1)
+            elif opcode == RELAY_OFF and 1 <= relay_number <= self.quantity_relay:
+                self.mask &= ~(1 << (relay_number - 1))
+            elif opcode == ALL_ON:
+                self.mask = full_mask(self.quantity_relay)
+            elif opcode == ALL_OFF:
+                self.mask = 0
+
+    def relay_on(self, relay_number):
+        self.send(RELAY_ON, relay_number)
+
+    def relay_off(self, relay_number):
+        self.send(RELAY_OFF, relay_number)
+
+    def on_all(self):
+        self.send(ALL_ON)
+
+    def off_all(self):
+        self.send(ALL_OFF)
+
+    def get_mask(self):
+        if self.latency:
+            with self.lock:
+                time.sleep(self.latency)
+        return self.mask
@@ -0,0 +1,139 @@
+# リレーの状態変化の通知
+# ボードごとに１つのポーラーがステータスを読み込み、前回との差分だけを変化イベントとして
+# 購読者（画面、サーバー、ログ等）に配信する。購読者が個別にデバイスを読む必要はない。
+import time
+import logging
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger("usb_relay.events")
+
+# 状態変化イベント　old, new は True:ＯＮ False:ＯＦＦ（不明の場合はNone）
+ChangeEvent = namedtuple("ChangeEvent", ["board", "relay", "old", "new", "source", "timestamp"])
+
+class EventBus:
+    # 変化イベントの購読と配信を行うクラス
+    def __init__(self):
+        self.subscribers = {}
+        self.next_token  = 0
+        self.lock        = threading.Lock()
+
+    # callback(event) を登録し、購読解除用の番号を返す。board を指定するとそのボードのイベントだけを受け取る
+    def subscribe(self, callback, board=None):
+        with self.lock:
+            token = self.next_token
+            self.next_token += 1
+            self.subscribers[token] = (callback, board)
+        return token
+
+    def unsubscribe(self, token):
+        with self.lock:
+            self.subscribers.pop(token, None)
+
+    def publish(self, event):
+        with self.lock:
+            subscribers = list(self.subscribers.values())
+        for callback, board in subscribers:
+            if board is not None and board != event.board:
+                continue
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error("イベントの配信でエラーが発生しました: %s", e)
+
+# 前回のマスクと今回のマスクの差分から変化イベントのリストを作る
+def diff_events(board_name, quantity_relay, old_mask, new_mask, source, timestamp):
+    events  = []
+    changed = new_mask if old_mask is None else old_mask ^ new_mask
+    for n in range(quantity_relay):
+        bit = 1 << n
+        if changed & bit:
+            old = None if old_mask is None else bool(old_mask & bit)
+            events.append(ChangeEvent(board_name, n + 1, old, bool(new_mask & bit), source, timestamp))
+    return events
+
+class StatusPoller:
+    # ボード１枚のステータスを定期的に読み込み、変化があればイベントを配信するクラス
+    # 変化があった直後は min_interval 秒ごとに読み、変化がなければ max_interval 秒まで間隔を倍々に延ばす
+    def __init__(self, board_name, board, bus, min_interval=0.2, max_interval=5.0):
+        self.board_name   = board_name
+        self.board        = board
+        self.bus          = bus
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval     = min_interval
+        self.mask         = None       # 前回のスナップショット（未取得の場合はNone）
+        self.updated      = None       # スナップショットの時刻
+        self.lock         = threading.Lock()
+        self.wakeup       = threading.Event()
+        self.stopped      = threading.Event()
+        self.thread       = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=f"StatusPoller-{self.board_name}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join()
+
+    # すぐに読み込ませる（命令を送った直後等）
+    def poke(self):
+        self.interval = self.min_interval
+        self.wakeup.set()
+
+    def snapshot(self):
+        with self.lock:
+            return self.mask, self.updated
+
+    # 新しいマスクを反映し、差分をイベントとして配信する。変化があればTrueを返す
+    # コントローラー自身が命令を送った場合は source にその送信元を指定して呼ぶ
+    def report(self, mask, source):
+        now = time.time()
+        with self.lock:
+            old          = self.mask
+            self.mask    = mask
+            self.updated = now
+        if old is None or old == mask:
+            return False       # 初回の読み込みは基準とし、イベントにはしない
+        for event in diff_events(self.board_name, self.board.quantity_relay, old, mask, source, now):
+            self.bus.publish(event)
+        return True
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                changed = self.report(self.board.get_mask(), "poll")
+            except Exception as e:
+                logger.error("ボード %s のステータスを読み込めませんでした: %s", self.board_name, e)
+                changed = False
+            if changed:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * 2, self.max_interval)
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+class StatusHub:
+    # 複数ボードのポーラーをまとめるクラス（ボードごとにポーラーは１つだけ）
+    def __init__(self, bus=None, **poller_options):
+        self.bus            = bus or EventBus()
+        self.poller_options = poller_options
+        self.pollers        = {}
+
+    def add_board(self, board_name, board):
+        if board_name not in self.pollers:
+            poller = StatusPoller(board_name, board, self.bus, **self.poller_options)
+            self.pollers[board_name] = poller
+            poller.start()
+        return self.pollers[board_name]
+
+    def stop(self):
+        for poller in self.pollers.values():
+            poller.stop()
+
+    # 全ボードの現在のマスクを {ボード名: (マスク, 時刻)} で返す
+    def snapshot(self):
+        return {name: poller.snapshot() for name, poller in self.pollers.items()}
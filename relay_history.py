@@ -0,0 +1,471 @@
+# リレーの状態の履歴
+# 「昨日リレー5は何時間ＯＮだったか」「今月リレー2は何回ＯＮになったか（接点の寿命）」
+# 「リレー7が最後に切り替わったのはいつか」に答えるため、リレーごとに状態の変化だけを記録する。
+#   ・記録は日（UTC）ごとの区間に分け、区間の開始時の状態と、その日の0時からの切り替え時刻（ミリ秒）を array に持つ
+#     切り替えのたびに状態は反転するので、時刻だけを並べればよい（同じ状態の通知は記録しない）
+#   ・区間ごとにＯＮの時間とＯＮになった回数をまとめて（ロールアップ）おき、丸１日を含む期間は集計値だけで計算する
+#     何か月分の問い合わせでも、区間の数（切り替えのあった日数）に比例する時間で答えられる
+#   ・keep_days より古い区間は切り替え時刻を捨てて集計値だけを残す（その日の一部の期間の問い合わせは按分になる）
+#   ・定期的にバイナリファイルにアトミックに保存し、起動時に読み込む
+#   python relay_history.py bench --boards 50 --days 90
+#   python relay_history.py show relay_history.bin --days 1
+import sys
+import time
+import struct
+import logging
+import argparse
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from relay_autosave import write_bytes_atomic
+
+logger = logging.getLogger("usb_relay.history")
+
+DAY    = 86400             # 1日の秒数
+DAY_MS = DAY * 1000
+
+MAGIC   = b"RLYH"
+VERSION = 1
+HEADER  = struct.Struct("<4sHI2x")     # "RLYH" バージョン リレー数
+RELAY   = struct.Struct("<HBBddI")     # ボード名の長さ リレー番号 状態 記録開始 最後の切り替え 区間数
+SEGMENT = struct.Struct("<IBIII")      # 日 フラグ（1:開始時ＯＮ 2:終了時ＯＮ 4:集計値のみ） ＯＮのミリ秒 ＯＮの回数 切り替え数
+
+def day_of(timestamp):
+    return int(timestamp // DAY)
+
+# range(start, stop) のうち parity（0:偶数 1:奇数）の番号の数
+def count_parity(start, stop, parity):
+    return len(range(start + (parity - start) % 2, stop, 2))
+
+class Segment:
+    # １日分の記録（times はその日の0時からの切り替え時刻（ミリ秒）。集計値のみの場合はNone）
+    __slots__ = ("day", "initial", "times", "final", "on_ms", "cycles", "summed")
+
+    def __init__(self, day, initial, times=None, final=None, on_ms=0, cycles=0):
+        self.day     = day
+        self.initial = initial
+        self.times   = array("I") if times is None and final is None else times
+        self.final   = final
+        self.on_ms   = on_ms
+        self.cycles  = cycles
+        self.summed  = -1          # 集計値を計算した時の切り替え数（違っていれば計算し直す）
+
+    def end_state(self):
+        if self.times is None:
+            return self.final
+        return self.initial ^ bool(len(self.times) & 1)
+
+    # その日のＯＮの時間（ミリ秒）とＯＮになった回数
+    def summary(self):
+        if self.times is not None and self.summed != len(self.times):
+            self.on_ms  = self.on_between(0, DAY_MS, False)
+            self.cycles = self.cycles_between(0, DAY_MS, False)
+            self.summed = len(self.times)
+        return self.on_ms, self.cycles
+
+    # [a, b)（その日の0時からのミリ秒）のＯＮの時間（ミリ秒）
+    def on_between(self, a, b, use_summary=True):
+        if use_summary and a <= 0 and b >= DAY_MS:
+            return self.summary()[0]
+        if self.times is None:
+            return self.on_ms * (b - a) // DAY_MS
+        times = self.times
+        index = bisect_right(times, a)
+        state = self.initial ^ bool(index & 1)
+        total = 0
+        last  = a
+        for index in range(index, len(times)):
+            at = times[index]
+            if at >= b:
+                break
+            if state:
+                total += at - last
+            last  = at
+            state = not state
+        if state:
+            total += b - last
+        return total
+
+    # [a, b) にＯＮになった回数
+    def cycles_between(self, a, b, use_summary=True):
+        if use_summary and a <= 0 and b >= DAY_MS:
+            return self.summary()[1]
+        if self.times is None:
+            return round(self.cycles * (b - a) / DAY_MS)
+        # 開始時ＯＦＦなら偶数番目、開始時ＯＮなら奇数番目の切り替えがＯＮになる切り替え
+        return count_parity(bisect_left(self.times, a), bisect_left(self.times, b), 1 if self.initial else 0)
+
+    # 切り替え時刻を捨てて集計値だけを残す
+    def compact(self):
+        if self.times is not None:
+            self.summary()
+            self.final = self.end_state()
+            self.times = None
+
+class RelayHistory:
+    # リレー１個の履歴
+    def __init__(self):
+        self.days        = array("I")   # 区間の日（昇順）
+        self.segments    = []
+        self.state       = None         # 現在の状態（まだ記録がなければNone）
+        self.since       = None         # 記録を始めた時刻
+        self.last_change = None         # 最後に切り替わった時刻
+
+    # 状態を記録する。切り替わった場合はTrueを返す
+    def record(self, on, timestamp):
+        on = bool(on)
+        if self.state is None:
+            self.state       = on
+            self.since       = timestamp
+            self.last_change = timestamp
+            self.open_segment(day_of(timestamp), on)
+            return True
+        if on == self.state:
+            return False
+        timestamp = max(timestamp, self.last_change)     # 時刻が前後した場合は前の記録に合わせる
+        day       = day_of(timestamp)
+        if day != self.days[-1]:
+            self.open_segment(day, self.state)
+        self.segments[-1].times.append(min(int((timestamp - day * DAY) * 1000), DAY_MS - 1))
+        self.state       = on
+        self.last_change = timestamp
+        return True
+
+    def open_segment(self, day, initial):
+        self.days.append(day)
+        self.segments.append(Segment(day, initial))
+
+    # 問い合わせの期間を記録のある期間（記録開始～now）に切り詰める
+    def clip(self, start, end, now):
+        if self.since is None:
+            return 0, 0
+        return max(start, self.since), min(end, now)
+
+    # 区間ごとに (区間, その日の0時, 次の区間の0時) を返す（期間 [start, end) に掛かるものだけ）
+    def spans(self, start, end):
+        index = max(bisect_right(self.days, day_of(start)) - 1, 0)
+        for index in range(index, len(self.segments)):
+            segment = self.segments[index]
+            begin   = segment.day * DAY
+            if begin >= end:
+                return
+            until   = self.days[index + 1] * DAY if index + 1 < len(self.days) else float("inf")
+            yield segment, begin, until
+
+    # [start, end) のＯＮの時間（秒）
+    def on_time(self, start, end, now):
+        start, end = self.clip(start, end, now)
+        total_ms   = 0
+        for segment, begin, until in self.spans(start, end):
+            a, b = max(start, begin), min(end, begin + DAY)
+            if a < b:
+                total_ms += segment.on_between(int((a - begin) * 1000), int((b - begin) * 1000))
+            # 区間の日より後で次の区間までは、区間の終了時の状態のまま
+            a, b = max(start, begin + DAY), min(end, until)
+            if a < b and segment.end_state():
+                total_ms += (b - a) * 1000
+        return total_ms / 1000
+
+    # [start, end) にＯＮになった回数
+    def cycles(self, start, end, now):
+        start, end = self.clip(start, end, now)
+        total      = 0
+        for segment, begin, _ in self.spans(start, end):
+            a, b = max(start, begin), min(end, begin + DAY)
+            if a < b:
+                total += segment.cycles_between(int((a - begin) * 1000), int((b - begin) * 1000))
+        return total
+
+    # 時刻 timestamp の状態
+    def state_at(self, timestamp):
+        if self.since is None or timestamp < self.since:
+            return None
+        index   = bisect_right(self.days, day_of(timestamp)) - 1
+        segment = self.segments[index]
+        if segment.day < day_of(timestamp) or segment.times is None:
+            return segment.end_state()
+        offset  = int((timestamp - segment.day * DAY) * 1000)
+        return segment.initial ^ bool(bisect_right(segment.times, offset) & 1)
+
+    # [start, end) の状態の推移を [(開始, 終了, ＯＮ/ＯＦＦ), ...] で返す
+    def timeline(self, start, end, now):
+        start, end = self.clip(start, end, now)
+        if start >= end:
+            return []
+        result = []
+        last   = start
+        state  = self.state_at(start)
+        for segment, begin, _ in self.spans(start, end):
+            # 区間の開始時の状態に合わせ直す（集計値だけの区間は途中の切り替えが分からないため）
+            if segment.times is None or begin > last:
+                if begin > last and segment.initial != state:
+                    result.append((last, begin, state))
+                    last = begin
+                state = segment.initial
+            if segment.times is None:
+                # 集計値だけの日は切り替え時刻が分からないので、その日の終わりに終了時の状態になったとみなす
+                at = begin + DAY
+                if at < end and segment.end_state() != state:
+                    result.append((last, at, state))
+                    last  = at
+                    state = segment.end_state()
+                continue
+            for at in segment.times[bisect_right(segment.times, int((start - begin) * 1000)):]:
+                at = begin + at / 1000
+                if at >= end:
+                    break
+                result.append((last, at, state))
+                last  = at
+                state = not state
+        result.append((last, end, state))
+        return result
+
+    def compact(self, before_day):
+        for index in range(bisect_left(self.days, before_day)):
+            self.segments[index].compact()
+
+class HistoryStore:
+    # 全ボード・全リレーの履歴
+    # path を指定すると起動時に読み込み、start() で save_interval 秒ごとに保存する
+    def __init__(self, path=None, keep_days=400, save_interval=300, clock=time.time):
+        self.path          = path
+        self.keep_days     = keep_days
+        self.save_interval = save_interval
+        self.clock         = clock
+        self.relays        = {}          # {(ボード名, リレー番号): RelayHistory}
+        self.lock          = threading.Lock()
+        self.dirty         = False
+        self.stopped       = threading.Event()
+        self.thread        = None
+        if path:
+            try:
+                self.load(path)
+            except FileNotFoundError:
+                pass
+
+    def record(self, board, relay, on, timestamp=None):
+        timestamp = self.clock() if timestamp is None else timestamp
+        with self.lock:
+            history = self.relays.get((board, relay))
+            if history is None:
+                history = self.relays[(board, relay)] = RelayHistory()
+            if history.record(on, timestamp):
+                self.dirty = True
+
+    # ボード全体のマスクを記録する（リレー1がビット0）
+    def record_mask(self, board, quantity_relay, mask, timestamp=None):
+        timestamp = self.clock() if timestamp is None else timestamp
+        for n in range(quantity_relay):
+            self.record(board, n + 1, mask & (1 << n), timestamp)
+
+    # 状態変化イベント（relay_events.EventBus）を記録する
+    def subscribe(self, bus, board=None):
+        def on_event(event):
+            if event.new is not None:
+                self.record(event.board, event.relay, event.new, event.timestamp)
+        return bus.subscribe(on_event, board)
+
+    def query(self, name, board, relay, *args):
+        with self.lock:
+            history = self.relays.get((board, relay))
+            if history is None:
+                return None
+            return getattr(history, name)(*args)
+
+    # [start, end) のＯＮの時間（秒）。記録の無い期間は含めない
+    def on_time(self, board, relay, start, end):
+        return self.query("on_time", board, relay, start, end, self.clock()) or 0.0
+
+    # [start, end) のＯＮの割合（0～1）
+    def duty(self, board, relay, start, end):
+        end = min(end, self.clock())
+        return self.on_time(board, relay, start, end) / (end - start) if end > start else 0.0
+
+    # [start, end) にＯＮになった回数
+    def cycles(self, board, relay, start, end):
+        return self.query("cycles", board, relay, start, end, self.clock()) or 0
+
+    # [start, end) の状態の推移 [(開始, 終了, ＯＮ/ＯＦＦ), ...]
+    def timeline(self, board, relay, start, end):
+        return self.query("timeline", board, relay, start, end, self.clock()) or []
+
+    # 最後に切り替わった時刻（記録が無ければNone）
+    def last_change(self, board, relay):
+        with self.lock:
+            history = self.relays.get((board, relay))
+            return history.last_change if history else None
+
+    def keys(self):
+        with self.lock:
+            return sorted(self.relays)
+
+    # 全リレーの [start, end) の集計 [(ボード名, リレー番号, ＯＮの秒数, ＯＮの回数, 最後の切り替え), ...]
+    def summary(self, start, end):
+        now = self.clock()
+        with self.lock:
+            return [(board, relay, history.on_time(start, end, now), history.cycles(start, end, now), history.last_change)
+                    for (board, relay), history in sorted(self.relays.items())]
+
+    #---- 保存・読み込み ----#
+    def encode(self):
+        parts = [HEADER.pack(MAGIC, VERSION, len(self.relays))]
+        for (board, relay), history in self.relays.items():
+            name = board.encode("utf-8")
+            parts.append(RELAY.pack(len(name), relay, int(bool(history.state)), history.since or 0.0,
+                                    history.last_change or 0.0, len(history.segments)))
+            parts.append(name)
+            for segment in history.segments:
+                on_ms, cycles = segment.summary()
+                flags = segment.initial | segment.end_state() << 1 | (segment.times is None) << 2
+                count = 0 if segment.times is None else len(segment.times)
+                parts.append(SEGMENT.pack(segment.day, flags, on_ms, cycles, count))
+                if count:
+                    times = segment.times
+                    if sys.byteorder != "little":
+                        times = array("I", times)
+                        times.byteswap()
+                    parts.append(times.tobytes())
+        return b"".join(parts)
+
+    def decode(self, data):
+        magic, version, count = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("履歴ファイルではありません")
+        offset = HEADER.size
+        relays = {}
+        for _ in range(count):
+            name_length, relay, state, since, last_change, segments = RELAY.unpack_from(data, offset)
+            offset += RELAY.size
+            board   = data[offset:offset + name_length].decode("utf-8")
+            offset += name_length
+            history = RelayHistory()
+            if segments:
+                history.state, history.since, history.last_change = bool(state), since, last_change
+            for _ in range(segments):
+                day, flags, on_ms, cycles, length = SEGMENT.unpack_from(data, offset)
+                offset += SEGMENT.size
+                if flags & 4:
+                    segment = Segment(day, bool(flags & 1), None, bool(flags & 2), on_ms, cycles)
+                else:
+                    times = array("I")
+                    times.frombytes(data[offset:offset + length * 4])
+                    if sys.byteorder != "little":
+                        times.byteswap()
+                    offset += length * 4
+                    segment = Segment(day, bool(flags & 1), times)
+                history.days.append(day)
+                history.segments.append(segment)
+            relays[(board, relay)] = history
+        return relays
+
+    def load(self, path):
+        with open(path, "rb") as f:
+            relays = self.decode(f.read())
+        with self.lock:
+            self.relays = relays
+            self.dirty  = False
+
+    # 古い区間を集計値だけにしてから、変更があればアトミックに保存する
+    def save(self, path=None):
+        path = path or self.path
+        with self.lock:
+            if not self.dirty and path == self.path:
+                return False
+            before_day = day_of(self.clock()) - self.keep_days
+            for history in self.relays.values():
+                history.compact(before_day)
+            data       = self.encode()
+            self.dirty = False
+        try:
+            write_bytes_atomic(path, data)
+        except OSError as e:
+            with self.lock:
+                self.dirty = True
+            logger.error("履歴を %s に保存できませんでした: %s", path, e)
+            return False
+        return True
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="HistoryStore", daemon=True)
+        self.thread.start()
+
+    # 保存のスレッドを止め、最後に保存する
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        if self.path:
+            self.save()
+
+    def run(self):
+        while not self.stopped.wait(self.save_interval):
+            self.save()
+
+#========メイン処理=========#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="リレーの状態の履歴")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_show = sub.add_parser("show", help="履歴ファイルの集計を表示する")
+    p_show.add_argument("history_file")
+    p_show.add_argument("--days",  type=float, default=1, help="集計する日数（現在から遡る）")
+    p_show.add_argument("--board", default=None, help="ボード名")
+    p_show.add_argument("--relay", type=int, default=None, help="リレー番号（指定すると推移を表示する）")
+    p_bench = sub.add_parser("bench", help="ボード群の数か月分の履歴を作って問い合わせの時間を計る")
+    p_bench.add_argument("--boards",   type=int, default=50, help="ボードの枚数")
+    p_bench.add_argument("--quantity", type=int, default=8,  help="ボードごとのリレー個数")
+    p_bench.add_argument("--days",     type=int, default=90, help="日数")
+    p_bench.add_argument("--cycles",   type=int, default=20, help="1リレー1日のＯＮの回数")
+    p_bench.add_argument("--save",     default=None, help="作った履歴を保存するファイル")
+    args = parser.parse_args()
+
+    def local(timestamp):
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)) if timestamp else "-"
+
+    try:
+        if args.command == "show":
+            store = HistoryStore()
+            store.load(args.history_file)
+            end   = time.time()
+            start = end - args.days * DAY
+            if args.relay is not None:
+                for begin, until, on in store.timeline(args.board, args.relay, start, end):
+                    print(f"{local(begin)} ～ {local(until)}  {'ＯＮ ' if on else 'ＯＦＦ'}  {until - begin:10.0f}秒")
+            for board, relay, on_time, cycles, last_change in store.summary(start, end):
+                if args.board is None or board == args.board:
+                    print(f"{board}  リレー{relay}  ＯＮ {on_time / 3600:8.2f}時間  {cycles:6d}回  最後の切り替え {local(last_change)}")
+        else:
+            import random
+            clock  = [0.0]
+            store  = HistoryStore(clock=lambda: clock[0])
+            rng    = random.Random(1)
+            origin = (day_of(time.time()) - args.days) * DAY
+            events = 0
+            started = time.perf_counter()
+            for b in range(args.boards):
+                for relay in range(1, args.quantity + 1):
+                    at = origin
+                    store.record(f"board{b + 1}", relay, False, at)
+                    gap = DAY / (args.cycles * 2)
+                    while at < origin + args.days * DAY:
+                        at += rng.uniform(0.5, 1.5) * gap
+                        store.record(f"board{b + 1}", relay, events % 2 == 0, at)
+                        events += 1
+            recorded = time.perf_counter() - started
+            clock[0] = origin + args.days * DAY
+            data     = store.encode()
+            print(f"記録 {events:,}件  {recorded:.2f}秒  保存サイズ {len(data) / 1024:,.0f}KB（{len(data) / events:.1f}バイト/件）")
+            # 全リレーの月初～月末（日の途中から途中まで）のＯＮ時間と回数
+            start, end = origin + 10.5 * DAY, origin + 40.25 * DAY
+            started = time.perf_counter()
+            rows    = store.summary(start, end)
+            elapsed = time.perf_counter() - started
+            print(f"全{len(rows)}リレーの30日間の集計 {elapsed * 1000:.1f}ms  "
+                  f"（例 {rows[0][0]} リレー{rows[0][1]}  ＯＮ {rows[0][2] / 3600:.1f}時間  {rows[0][3]}回）")
+            if args.save:
+                store.path = args.save
+                store.save()
+    except (OSError, ValueError, struct.error) as e:
+        print(f"エラーが発生しました: {e}")
+        sys.exit(1)
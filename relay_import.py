@@ -0,0 +1,271 @@
+# タイマー設定の一括取り込み（CSV・iCalendar）
+# ファイルを1行ずつ読みながら登録簿（relay_registry）に取り込む。ファイル全体を読み込まないので
+# 大きなファイルでもメモリを使わない。各行は画面の入力と同じ規則（check_hour_minute）でチェックし、
+# エラーの行は行番号とメッセージを記録して読み飛ばす。登録は batch_size 件ごとにまとめて行う。
+# ファイルに出てきたリレーのタイマー設定は、登録済みのものを削除して置き換える（同じファイルを
+# 取り込み直しても設定は増えない）。
+#
+# CSV（1行目は見出し）
+#   board,relay,start,end[,timer_onoff][,name]
+#   board1,3,08:00,17:30,1,照明
+# iCalendar（VEVENTごとに1件。RRULEは毎日（FREQ=DAILY のみ。COUNT・UNTIL・INTERVAL等の指定は不可）が必要）
+#   X-RELAY-BOARD:board1   X-RELAY:3   SUMMARY:照明（名称）
+#   DTSTART:20260101T080000   DTEND:20260101T173000（または DURATION:PT9H30M）
+#   UTC（DTSTART:20260101T080000Z）と TZID 付き（DTSTART;TZID=Asia/Tokyo:20260101T080000）の時刻は、
+#   DTSTART の日付での時差でこの計算機の現地時刻に直す。長さは 24時間未満に限る。
+#   python relay_import.py schedules.csv --db relay_registry.db
+import re
+import csv
+import sys
+import argparse
+from datetime       import datetime, timedelta, timezone
+from zoneinfo       import ZoneInfo, ZoneInfoNotFoundError
+from relay_registry import RelayRegistry, DEFAULT_DB
+from relay_schedule import check_hour_minute
+
+BATCH_SIZE = 1000
+
+class ImportResult:
+    # 取り込みの結果
+    def __init__(self):
+        self.imported = 0
+        self.errors   = []     # [(行番号, メッセージ), ...]
+
+    def error(self, line_number, message):
+        self.errors.append((line_number, message))
+
+class ScheduleImporter:
+    # 1件ずつ受け取ったタイマー設定をチェックし、まとめて登録簿に書き込むクラス
+    def __init__(self, registry, batch_size=BATCH_SIZE):
+        self.registry   = registry
+        self.batch_size = batch_size
+        self.boards     = {}       # ボード名 → {リレー番号: リレーのID}
+        self.replaced   = set()    # 登録済みのタイマー設定を削除したリレーのID
+        self.clear      = []       # 次の書き込みで登録済みのタイマー設定を削除するリレーのID
+        self.schedules  = []
+        self.names      = []
+        self.result     = ImportResult()
+
+    def relay_id(self, board_name, relay_number):
+        if board_name not in self.boards:
+            board = self.registry.find_board(board_name)
+            if board is None:
+                raise KeyError(f"ボード '{board_name}' は登録されていません")
+            self.boards[board_name] = self.registry.relay_ids(board["id"])
+        relay_ids = self.boards[board_name]
+        if relay_number not in relay_ids:
+            raise KeyError(f"ボード '{board_name}' にリレー{relay_number}はありません")
+        return relay_ids[relay_number]
+
+    def add(self, line_number, board_name, relay_number, start_hour, start_minute, end_hour, end_minute,
+            timer_onoff=True, name=None):
+        try:
+            relay_id = self.relay_id(board_name, int(relay_number))
+        except (KeyError, ValueError) as e:
+            self.result.error(line_number, str(e).strip("'\""))
+            return
+        err_message = check_hour_minute(start_hour, start_minute, end_hour, end_minute)
+        if err_message:
+            self.result.error(line_number, err_message)
+            return
+        if relay_id not in self.replaced:
+            self.replaced.add(relay_id)
+            self.clear.append(relay_id)
+        self.schedules.append((relay_id, int(bool(timer_onoff)),
+                               int(start_hour), int(start_minute), int(end_hour), int(end_minute)))
+        if name:
+            self.names.append((name, relay_id))
+        if len(self.schedules) >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        if self.schedules:
+            self.registry.replace_schedules(self.clear, self.schedules)
+            self.result.imported += len(self.schedules)
+            self.schedules = []
+            self.clear     = []
+        if self.names:
+            self.registry.set_relay_names(self.names)
+            self.names = []
+
+    def finish(self):
+        self.commit()
+        return self.result
+
+# "08:00" → (8, 0)
+def parse_time(text):
+    hour, _, minute = text.strip().partition(":")
+    return hour, minute or "0"
+
+def parse_bool(text):
+    return text.strip().lower() not in ("0", "false", "off", "no", "")
+
+# 省略できる列の値（列が無い行は default）
+def optional(row, index, column, default):
+    i = index.get(column)
+    return row[i] if i is not None and i < len(row) else default
+
+def import_csv(registry, path, batch_size=BATCH_SIZE):
+    importer = ScheduleImporter(registry, batch_size)
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f)
+        header = [column.strip() for column in next(reader, [])]
+        for column in ("board", "relay", "start", "end"):
+            if column not in header:
+                importer.result.error(1, f"見出しに '{column}' がありません")
+                return importer.finish()
+        index = {column: i for i, column in enumerate(header)}
+        for row in reader:
+            line_number = reader.line_num
+            if not row or not "".join(row).strip():
+                continue
+            try:
+                start_hour, start_minute = parse_time(row[index["start"]])
+                end_hour, end_minute     = parse_time(row[index["end"]])
+                timer_onoff = parse_bool(optional(row, index, "timer_onoff", "1"))
+                name        = optional(row, index, "name", "").strip() or None
+                board_name  = row[index["board"]].strip()
+                relay       = row[index["relay"]]
+            except IndexError:
+                importer.result.error(line_number, "列が不足しています")
+                continue
+            importer.add(line_number, board_name, relay, start_hour, start_minute, end_hour, end_minute,
+                         timer_onoff, name)
+    return importer.finish()
+
+# 折り返された行（先頭が空白）をつなげて、(行番号, 行) を1行ずつ返す
+def unfold_lines(f):
+    current, start = None, 0
+    for line_number, line in enumerate(f, start=1):
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield start, current
+        current, start = line, line_number
+    if current is not None:
+        yield start, current
+
+DURATION = re.compile(r"^P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:\d+S)?)?$")
+TEXT_ESCAPE = re.compile(r"\\([\\;,nN])")
+
+# SUMMARY 等のテキストのエスケープ（\\ \; \, \n）を元に戻す
+def ical_text(value):
+    return TEXT_ESCAPE.sub(lambda match: "\n" if match.group(1) in "nN" else match.group(1), value)
+
+# RRULE を {"FREQ": "DAILY", ...} にする
+def ical_rrule(value):
+    parts = {}
+    for part in value.upper().split(";"):
+        key, _, item = part.partition("=")
+        parts[key.strip()] = item.strip()
+    return parts
+
+# "name;TZID=...;VALUE=..." のパラメーターを {"TZID": ...} にする
+def ical_params(params):
+    parsed = {}
+    for param in params:
+        key, _, item = param.partition("=")
+        parsed[key.strip().upper()] = item.strip().strip('"')
+    return parsed
+
+# "20260101T080000"（現地時刻）、"20260101T080000Z"（UTC）、TZID 付きの日時を、この計算機の現地時刻にする
+def ical_datetime(value, tzid=None):
+    try:
+        moment = datetime.strptime(value[:-1] if value.endswith("Z") else value, "%Y%m%dT%H%M%S")
+    except ValueError:
+        raise ValueError(f"日時の形式が正しくありません（時刻の無い終日の予定は取り込めません）: {value}")
+    if value.endswith("Z"):
+        moment = moment.replace(tzinfo=timezone.utc)
+    elif tzid:
+        try:
+            moment = moment.replace(tzinfo=ZoneInfo(tzid))
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"タイムゾーン '{tzid}' が分かりません")
+    else:
+        return moment
+    return moment.astimezone().replace(tzinfo=None)
+
+def import_ical(registry, path, batch_size=BATCH_SIZE):
+    importer = ScheduleImporter(registry, batch_size)
+    with open(path, "r", encoding="utf-8-sig") as f:
+        event = None
+        for line_number, line in unfold_lines(f):
+            name, _, value = line.partition(":")
+            name, *params  = name.split(";")
+            name = name.upper()
+            if name == "BEGIN" and value.upper() == "VEVENT":
+                event = {"line": line_number, "tzid": {}}
+            elif name == "END" and value.upper() == "VEVENT" and event is not None:
+                add_ical_event(importer, event)
+                event = None
+            elif event is not None:
+                event[name] = value.strip()
+                tzid = ical_params(params).get("TZID")
+                if tzid:
+                    event["tzid"][name] = tzid
+    return importer.finish()
+
+def add_ical_event(importer, event):
+    line_number = event["line"]
+    rrule = event.get("RRULE")
+    if not rrule:
+        importer.result.error(line_number, "繰り返し（RRULE:FREQ=DAILY）の無い予定は取り込めません")
+        return
+    if ical_rrule(rrule) != {"FREQ": "DAILY"}:
+        importer.result.error(line_number, f"毎日（FREQ=DAILY のみ）以外の繰り返しには対応していません: {rrule}")
+        return
+    if "X-RELAY-BOARD" not in event or "X-RELAY" not in event or "DTSTART" not in event:
+        importer.result.error(line_number, "X-RELAY-BOARD、X-RELAY、DTSTART のいずれかがありません")
+        return
+    try:
+        start = ical_datetime(event["DTSTART"], event["tzid"].get("DTSTART"))
+        if "DTEND" in event:
+            end = ical_datetime(event["DTEND"], event["tzid"].get("DTEND"))
+        else:
+            match = DURATION.match(event.get("DURATION", ""))
+            if not match:
+                raise ValueError("DTEND または DURATION がありません")
+            end = start + timedelta(days=int(match.group(1) or 0), hours=int(match.group(2) or 0),
+                                    minutes=int(match.group(3) or 0))
+        # DTEND と DURATION のどちらで指定しても同じ範囲に限る
+        if not timedelta(0) < end - start < timedelta(days=1):
+            raise ValueError(f"長さは 0より長く 24時間未満にしてください: {event.get('DTEND') or event.get('DURATION')}")
+    except ValueError as e:
+        importer.result.error(line_number, str(e))
+        return
+    importer.add(line_number, event["X-RELAY-BOARD"], event["X-RELAY"],
+                 start.hour, start.minute, end.hour, end.minute, True, ical_text(event.get("SUMMARY", "")) or None)
+
+# 拡張子でCSVかiCalendarかを判定して取り込む
+def import_file(registry, path, batch_size=BATCH_SIZE):
+    if path.lower().endswith((".ics", ".ical", ".ifb")):
+        return import_ical(registry, path, batch_size)
+    return import_csv(registry, path, batch_size)
+
+#========メイン処理=========#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="タイマー設定の一括取り込み")
+    parser.add_argument("files", nargs="+", help="CSVまたはiCalendar（.ics）ファイル")
+    parser.add_argument("--db", default=DEFAULT_DB, help="登録簿のデータベースファイル")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="まとめて登録する件数")
+    args = parser.parse_args()
+
+    registry = RelayRegistry(args.db)
+    failed   = False
+    try:
+        for path in args.files:
+            try:
+                result = import_file(registry, path, args.batch_size)
+            except (OSError, csv.Error, UnicodeDecodeError) as e:
+                print(f"ファイル '{path}' を読み込めませんでした: {e}")
+                failed = True
+                continue
+            for line_number, message in result.errors:
+                print(f"{path}:{line_number}: {message}")
+            print(f"{path}: {result.imported}件を取り込みました（エラー {len(result.errors)}件）")
+            failed = failed or bool(result.errors)
+    finally:
+        registry.close()
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,262 @@
+# リレーのインターロック（同時ＯＮの禁止等）
+# モーターの正転・逆転のように同時にＯＮにしてはいけないリレーの組み合わせを規則として設定し、書き込みの前に確認する。
+# 規則を確認するのは次の入口だけで、それ以外（relay_simulator・relay_network・relay_serial 等）は確認しない。
+#   画面（usb_relay_V1_0.py）   : settings.json の "interlocks" で、画面・タイマーの操作
+#   ブローカー（relay_broker）  : --interlock を指定した場合、クライアントからの命令
+#   デーモン（relay_daemon）    : settings.json の "interlocks" で、タイマー・ブローカーの命令
+# 他の処理で確認する場合は、ボードを InterlockedBoard で包んで渡す（relay_schedule・relay_stagger・relay_sync は
+# 包んだボードの切り替え後のマスク全体を１回だけ確認する）。
+# 規則は起動時にビットマスクにまとめ、リレー個数が16以下なら全マスクの可否の表を作っておくので、
+# 書き込み１回の確認は表を１回引くだけで済む。
+#   {"exclusive": [1, 2]}                 リレー1と2は同時にＯＮにしない
+#   {"relay": 3, "requires": [4]}         リレー3はリレー4がＯＮの時だけＯＮにできる
+#   {"max_on": 2, "relays": [5, 6, 7, 8]} リレー5～8は同時に2個までＯＮにできる
+# 規則に反する書き込みは、policy が "reject" なら拒否（InterlockError）し、"resolve" なら
+# 今回操作したリレーを優先して他のリレーを切り替えて（正転をＯＮにしたら逆転をＯＦＦにする等）から書き込む。
+# どちらの場合もログに記録する。
+#   python relay_interlock.py settings.json
+import sys
+import json
+import logging
+import argparse
+import threading
+from relay_device import apply_difference, full_mask
+
+logger = logging.getLogger("usb_relay.interlock")
+
+REJECT  = "reject"
+RESOLVE = "resolve"
+TABLE_LIMIT = 16     # 可否の表を作るリレー個数の上限（2**16 バイト）
+
+class InterlockError(Exception):
+    pass
+
+def relay_bits(relays, quantity_relay):
+    mask = 0
+    for relay_number in relays:
+        relay_number = int(relay_number)
+        if not 1 <= relay_number <= quantity_relay:
+            raise ValueError(f"インターロックのリレー番号 {relay_number} が範囲外です")
+        mask |= 1 << (relay_number - 1)
+    return mask
+
+def relay_names(mask):
+    return ",".join(str(n + 1) for n in range(mask.bit_length()) if mask & (1 << n))
+
+class Rule:
+    # ビットマスクにした規則１つ
+    #   exclusive : group のうちＯＮは1個まで
+    #   requires  : bit がＯＮなら required がすべてＯＮ
+    #   max_on    : group のうちＯＮは limit 個まで
+    def __init__(self, kind, group=0, bit=0, required=0, limit=0, name=None):
+        self.kind     = kind
+        self.group    = group
+        self.bit      = bit
+        self.required = required
+        self.limit    = limit
+        self.name     = name or self.describe()
+
+    def describe(self):
+        if self.kind == "exclusive":
+            return f"リレー{relay_names(self.group)}は同時にＯＮにできません"
+        if self.kind == "requires":
+            return f"リレー{relay_names(self.bit)}はリレー{relay_names(self.required)}がＯＮの時だけＯＮにできます"
+        return f"リレー{relay_names(self.group)}は同時に{self.limit}個までしかＯＮにできません"
+
+    def violated(self, mask):
+        if self.kind == "requires":
+            return bool(mask & self.bit) and mask & self.required != self.required
+        return bin(mask & self.group).count("1") > self.limit
+
+    # 規則を満たすようにマスクを直す。keep（今回操作したリレー）の状態はできるだけ変えない
+    def fix(self, mask, keep):
+        if self.kind == "requires":
+            if keep & self.bit and mask & self.bit:
+                return mask | self.required        # ＯＮにしたリレーが必要とするリレーもＯＮにする
+            return mask & ~self.bit                # 必要なリレーがＯＦＦにされたので、こちらもＯＦＦにする
+        on      = mask & self.group
+        ordered = [1 << n for n in range(on.bit_length()) if on & keep & (1 << n)] + \
+                  [1 << n for n in range(on.bit_length()) if on & ~keep & (1 << n)]
+        allowed = 0
+        for bit in ordered[:self.limit]:
+            allowed |= bit
+        return mask & ~self.group | allowed
+
+# 設定の規則（dictのリスト）をビットマスクの規則にする
+def compile_rules(rules, quantity_relay):
+    compiled = []
+    for rule in rules:
+        name = rule.get("name")
+        if "exclusive" in rule:
+            compiled.append(Rule("exclusive", group=relay_bits(rule["exclusive"], quantity_relay), limit=1, name=name))
+        elif "requires" in rule:
+            if not rule["requires"]:
+                raise ValueError(f"インターロックの規則の requires にリレーがありません: {rule}")
+            compiled.append(Rule("requires", bit=relay_bits([rule["relay"]], quantity_relay),
+                                 required=relay_bits(rule["requires"], quantity_relay), name=name))
+        elif "max_on" in rule:
+            compiled.append(Rule("max_on", group=relay_bits(rule["relays"], quantity_relay),
+                                 limit=int(rule["max_on"]), name=name))
+        else:
+            raise ValueError(f"インターロックの規則が不明です: {rule}")
+    return compiled
+
+class Interlock:
+    # ボード１枚分のインターロック
+    def __init__(self, quantity_relay, rules, policy=REJECT):
+        if policy not in (REJECT, RESOLVE):
+            raise ValueError(f"インターロックの policy が不明です: {policy}")
+        self.quantity_relay = quantity_relay
+        self.rules          = compile_rules(rules, quantity_relay)
+        self.policy         = policy
+        self.rejected       = 0
+        self.resolved       = 0
+        self.table          = None
+        if quantity_relay <= TABLE_LIMIT:
+            # 全マスクの可否の表（1:書き込んでよい）
+            self.table = bytes(not self.violations(mask) for mask in range(1 << quantity_relay))
+        self.on_order       = self.required_first()
+
+    # ＯＮにする順番（0始まりのリレー番号の並び）。requires の規則で必要とされるリレーを先にＯＮにする
+    def required_first(self):
+        depth = [0] * self.quantity_relay
+        for _ in range(self.quantity_relay):
+            for rule in self.rules:
+                if rule.kind != "requires":
+                    continue
+                needed = 1 + max(depth[n] for n in range(self.quantity_relay) if rule.required & (1 << n))
+                for n in range(self.quantity_relay):
+                    if rule.bit & (1 << n):
+                        depth[n] = min(max(depth[n], needed), self.quantity_relay)
+        return tuple(sorted(range(self.quantity_relay), key=depth.__getitem__))
+
+    def allowed(self, mask):
+        if self.table is not None:
+            return self.table[mask]
+        return not self.violations(mask)
+
+    def violations(self, mask):
+        return [rule for rule in self.rules if rule.violated(mask)]
+
+    # current（現在のマスク）から proposed にする書き込みを確認し、書き込んでよいマスクを返す
+    # changed は今回操作したリレー。規則に反する場合は policy に従って拒否（InterlockError）するか直す
+    # 既に規則に反している状態からは、リレーをＯＦＦにするだけで新しい違反の無い書き込みを認める
+    # （違反している状態から１個ずつＯＦＦにして戻せるように）
+    def check(self, current, proposed, changed, source=""):
+        if self.allowed(proposed):
+            return proposed
+        broken = self.violations(proposed)
+        if not proposed & ~current and set(broken) <= set(self.violations(current)):
+            return proposed
+        if self.policy == RESOLVE:
+            target = proposed
+            keep   = changed
+            for _ in range(len(self.rules) + 1):
+                rules = self.violations(target)
+                if not rules:
+                    break
+                for rule in rules:
+                    fixed  = rule.fix(target, keep)
+                    keep  |= fixed & ~target      # 規則でＯＮにしたリレー（必要とされるリレー）も残す
+                    target = fixed
+            if self.allowed(target):
+                self.resolved += 1
+                logger.warning("インターロック（%s）: %s のため %s を %s にしました", source,
+                               " / ".join(rule.name for rule in broken),
+                               format(proposed, f"0{self.quantity_relay}b"), format(target, f"0{self.quantity_relay}b"))
+                return target
+        self.rejected += 1
+        message = " / ".join(rule.name for rule in broken)
+        logger.warning("インターロック（%s）: %s のため %s への書き込みを拒否しました", source, message,
+                       format(proposed, f"0{self.quantity_relay}b"))
+        raise InterlockError(message)
+
+# 設定（settings.json 等の dict）の "interlocks" と "interlock_policy" からインターロックを作る（規則が無ければNone）
+def interlock_from_settings(settings, quantity_relay):
+    rules = settings.get("interlocks") or []
+    if not rules:
+        return None
+    return Interlock(quantity_relay, rules, settings.get("interlock_policy", REJECT))
+
+# 規則のファイル（settings.json と同じ形式、または規則のリストだけのjson）を読み込む
+def load_interlock(path, quantity_relay, policy=None):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = {"interlocks": data}
+    if policy:
+        data = dict(data, interlock_policy=policy)
+    return interlock_from_settings(data, quantity_relay)
+
+class InterlockedBoard:
+    # ボードへのすべての書き込みをインターロックで確認するクラス（ボードと同じメソッドで使える）
+    # 書き込みの確認に使う現在のマスクは、get_mask() と書き込みのたびに更新して持っておく
+    def __init__(self, board, interlock, source="board"):
+        self.board          = board
+        self.interlock      = interlock
+        self.source         = source
+        self.quantity_relay = board.quantity_relay
+        self.mask           = None
+        self.lock           = threading.Lock()
+
+    def open(self):
+        return self.board.open()
+
+    def close(self):
+        return self.board.close()
+
+    def get_mask(self):
+        mask = self.board.get_mask()
+        with self.lock:
+            self.mask = mask
+        return mask
+
+    # set_bits をＯＮ、clear_bits をＯＦＦにする。規則で直した場合は他のリレーも切り替わる（ＯＦＦを先に送る）
+    def write(self, set_bits, clear_bits):
+        with self.lock:
+            current   = self.board.get_mask() if self.mask is None else self.mask
+            proposed  = (current | set_bits) & ~clear_bits & full_mask(self.quantity_relay)
+            target    = self.interlock.check(current, proposed, set_bits | clear_bits, self.source)
+            self.mask = apply_difference(self.board, current, target, order=self.interlock.on_order)[0]
+
+    # 差分の切り替え（relay_device.difference_steps）から呼ばれる。切り替え後のマスク全体を１回だけ確認し、
+    # (書き込んでよいマスク, 確認済みの操作を送るボード, ＯＮの順番) を返す
+    # 操作は呼び出し元が後で送る（送れなかった場合もある）ので、持っているマスクは次の書き込みで読み直す
+    def plan(self, current, target, changed):
+        target = self.interlock.check(current, target, changed, self.source)
+        with self.lock:
+            self.mask = None
+        return target, self.board, self.interlock.on_order
+
+    def relay_on(self, relay_number):
+        self.write(1 << (relay_number - 1), 0)
+
+    def relay_off(self, relay_number):
+        self.write(0, 1 << (relay_number - 1))
+
+    def on_all(self):
+        self.write(full_mask(self.quantity_relay), 0)
+
+    def off_all(self):
+        self.write(0, full_mask(self.quantity_relay))
+
+#========メイン処理=========#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="インターロックの規則の確認")
+    parser.add_argument("rules_file", help="規則のファイル（settings.json 等）")
+    parser.add_argument("--quantity", type=int, default=8, help="リレー個数")
+    parser.add_argument("--policy",   choices=(REJECT, RESOLVE), default=None, help="規則に反する書き込みの扱い")
+    args = parser.parse_args()
+
+    try:
+        interlock = load_interlock(args.rules_file, args.quantity, args.policy)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"エラーが発生しました: {e}")
+        sys.exit(1)
+    if interlock is None:
+        print("インターロックの規則がありません")
+        sys.exit(0)
+    for rule in interlock.rules:
+        print(f"  {rule.name}")
+    allowed = sum(interlock.allowed(mask) for mask in range(1 << args.quantity))
+    print(f"規則 {len(interlock.rules)}件  policy {interlock.policy}  書き込みできる状態 {allowed}/{1 << args.quantity}")
@@ -0,0 +1,178 @@
+# 制御系全体の負荷試験ツール
+# 個別ＯＮ/ＯＦＦ（set）、マスク指定（mask）、ステータス取得（status）、複数ボードの一括設定（scene）を
+# 指定した割合で混ぜ、目標の処理数（--rate）または同時実行数（--concurrency）で実行する。
+# 一定間隔ごとに処理数、遅延のパーセンタイル（p50/p95/p99/p999）、エラー率を表示する。
+#   python relay_loadgen.py --boards 4 --concurrency 8 --duration 10
+#   python relay_loadgen.py --rate 2000 --mix set=50,status=40,mask=8,scene=2 --latency 0.0002
+#   python relay_loadgen.py --broker /tmp/usb_relay_broker.sock --concurrency 4
+import sys
+import time
+import random
+import argparse
+import threading
+from relay_device import SimulatedRelayBoard, apply_difference, full_mask
+
+OPERATIONS = ("set", "mask", "status", "scene")
+
+# "set=50,status=40,..." を {操作: 割合} にする
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name not in OPERATIONS:
+            raise ValueError(f"不明な操作です: {name}")
+        mix[name] = float(weight)
+    return mix
+
+# ソート済みの遅延のリストから p（0～100）パーセンタイルを返す
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))
+    return sorted_values[index]
+
+class Stats:
+    # 処理ごとの遅延とエラーを集計するクラス（間隔ごとに取り出してリセットする）
+    def __init__(self):
+        self.lock         = threading.Lock()
+        self.latencies    = []      # 今回の間隔の遅延
+        self.errors       = 0
+        self.total        = []      # 全体の遅延
+        self.total_errors = 0
+
+    def record(self, latency, error=False):
+        with self.lock:
+            self.latencies.append(latency)
+            if error:
+                self.errors += 1
+
+    def take(self):
+        with self.lock:
+            latencies, errors = self.latencies, self.errors
+            self.latencies, self.errors = [], 0
+        self.total += latencies
+        self.total_errors += errors
+        return sorted(latencies), errors
+
+def report_line(label, latencies, errors, seconds):
+    count = len(latencies)
+    return (f"{label:>8}  {count / seconds:10,.0f} 件/秒  "
+            f"p50 {percentile(latencies, 50) * 1000:7.3f}  p95 {percentile(latencies, 95) * 1000:7.3f}  "
+            f"p99 {percentile(latencies, 99) * 1000:7.3f}  p999 {percentile(latencies, 99.9) * 1000:7.3f} ms  "
+            f"エラー {errors / count * 100 if count else 0:5.2f}%")
+
+class LoadGenerator:
+    # boards_for_worker(番号) がワーカーごとに操作するボードのリストを返す
+    def __init__(self, boards_for_worker, mix, seed=None):
+        self.boards_for_worker = boards_for_worker
+        self.operations = list(mix)
+        self.weights    = [mix[name] for name in self.operations]
+        self.stats      = Stats()
+        self.stopped    = threading.Event()
+        self.seed       = seed
+
+    def run_operation(self, rng, boards, operation):
+        board = rng.choice(boards)
+        if operation == "set":
+            relay_number = rng.randint(1, board.quantity_relay)
+            if rng.random() < 0.5:
+                board.relay_on(relay_number)
+            else:
+                board.relay_off(relay_number)
+        elif operation == "mask":
+            apply_difference(board, board.get_mask(), rng.getrandbits(board.quantity_relay))
+        elif operation == "status":
+            board.get_mask()
+        else:
+            # 全ボードを同じパターンにする
+            scene = rng.getrandbits(8)
+            for board in boards:
+                apply_difference(board, board.get_mask(), scene & full_mask(board.quantity_relay))
+
+    # 操作を１つ選んで実行し、started からの経過時間を記録する
+    def timed(self, rng, boards, started):
+        operation = rng.choices(self.operations, self.weights)[0]
+        try:
+            self.run_operation(rng, boards, operation)
+            error = False
+        except Exception:
+            error = True
+        self.stats.record(time.perf_counter() - started, error)
+
+    # 同時実行数を固定して、できるだけ速く実行する
+    def closed_loop(self, worker):
+        rng    = random.Random(None if self.seed is None else self.seed + worker)
+        boards = self.boards_for_worker(worker)
+        while not self.stopped.is_set():
+            self.timed(rng, boards, time.perf_counter())
+
+    # 目標の処理数になるよう、決まった時刻に処理を開始する（遅れた分は遅延に含める）
+    def open_loop(self, worker, interval):
+        rng      = random.Random(None if self.seed is None else self.seed + worker)
+        boards   = self.boards_for_worker(worker)
+        next_due = time.perf_counter()
+        while not self.stopped.is_set():
+            wait = next_due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            self.timed(rng, boards, next_due)
+            next_due += interval
+
+    def run(self, duration, concurrency=4, rate=None, report_interval=1.0, out=print):
+        if rate:
+            interval = concurrency / rate
+            targets  = [(self.open_loop, (worker, interval)) for worker in range(concurrency)]
+        else:
+            targets  = [(self.closed_loop, (worker,)) for worker in range(concurrency)]
+        threads = [threading.Thread(target=target, args=args, daemon=True) for target, args in targets]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        last = started
+        while last - started < duration:
+            time.sleep(min(report_interval, duration - (last - started)))
+            now = time.perf_counter()
+            latencies, errors = self.stats.take()
+            out(report_line(f"{now - started:6.1f}s", latencies, errors, now - last))
+            last = now
+        self.stopped.set()
+        for thread in threads:
+            thread.join()
+        self.stats.take()
+        total = sorted(self.stats.total)
+        out(report_line("合計", total, self.stats.total_errors, last - started))
+        return total, self.stats.total_errors
+
+#========メイン処理=========#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="制御系の負荷試験")
+    parser.add_argument("--boards",      type=int,   default=4,    help="シミュレーションボードの枚数")
+    parser.add_argument("--quantity",    type=int,   default=8,    help="ボードごとのリレー個数")
+    parser.add_argument("--latency",     type=float, default=0.0,  help="シミュレーションボードの応答時間（秒）")
+    parser.add_argument("--broker",      default=None,             help="シミュレーションの代わりにブローカーに接続する")
+    parser.add_argument("--mix",         default="set=50,status=40,mask=8,scene=2", help="操作の割合")
+    parser.add_argument("--concurrency", type=int,   default=4,    help="同時実行数（ワーカー数）")
+    parser.add_argument("--rate",        type=float, default=None, help="目標の処理数（件/秒）。省略時は最大速度")
+    parser.add_argument("--duration",    type=float, default=10,   help="試験時間（秒）")
+    parser.add_argument("--interval",    type=float, default=1.0,  help="表示間隔（秒）")
+    parser.add_argument("--seed",        type=int,   default=None, help="乱数の種")
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    if args.broker:
+        from relay_broker import RelayBrokerClient
+        # ブローカーのクライアントはスレッド間で共有しない
+        def boards_for_worker(worker):
+            return [RelayBrokerClient(args.broker, args.quantity)]
+    else:
+        boards = [SimulatedRelayBoard(args.quantity, latency=args.latency) for _ in range(args.boards)]
+        def boards_for_worker(worker):
+            return boards
+
+    generator = LoadGenerator(boards_for_worker, mix, args.seed)
+    generator.run(args.duration, args.concurrency, args.rate, args.interval)
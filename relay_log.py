@@ -0,0 +1,164 @@
+# ログと操作履歴（監査ログ）
+# ログの出力はキューに積むだけにして、ファイルや画面への書き込みはバックグラウンドのスレッドで
+# まとめて行う。コンソールやパイプへの出力が遅くてもリレーの切り替えは待たされない。
+#   usb_relay.log       : 動作ログ（1行1件のjson）
+#   usb_relay_audit.log : 命令の操作履歴（送信元、ボード、リレー、変更前後の状態、所要時間）
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import threading
+from logging.handlers import RotatingFileHandler
+
+LOGGER_NAME = "usb_relay"
+AUDIT_NAME  = "usb_relay.audit"
+BATCH_SIZE  = 256    # 一度にまとめて書き込む最大件数
+
+logger       = logging.getLogger(LOGGER_NAME)
+audit_logger = logging.getLogger(AUDIT_NAME)
+
+class JsonFormatter(logging.Formatter):
+    # 1行1件のjsonにする。extra={"fields": {...}} で渡された項目も出力する
+    # 整形した文字列はレコードに残し、ローテーションの判定と書き込みで２回整形しない
+    def format(self, record):
+        text = getattr(record, "json", None)
+        if text is not None:
+            return text
+        data = {
+            "time":   time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level":  record.levelname,
+            "name":   record.name,
+            "thread": record.threadName,
+            "msg":    record.getMessage(),
+        }
+        data.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        record.json = json.dumps(data, ensure_ascii=False, default=str)
+        return record.json
+
+class BatchRotatingFileHandler(RotatingFileHandler):
+    # 1件ごとにはフラッシュせず、まとめて書き込んだ後に flush_batch() でフラッシュする
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+    def close(self):
+        self.flush_batch()
+        super().close()
+
+class NonBlockingHandler(logging.Handler):
+    # レコードをキューに積むだけのハンドラー（文字列への整形は書き込みスレッドで行う）
+    def __init__(self, record_queue):
+        super().__init__()
+        self.record_queue = record_queue
+
+    def emit(self, record):
+        try:
+            self.record_queue.put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+class LogWriter:
+    # キューのレコードをまとめて各ハンドラーに書き込むスレッド
+    def __init__(self, record_queue, handlers):
+        self.record_queue = record_queue
+        self.handlers     = handlers
+        self.thread       = threading.Thread(target=self.run, name="LogWriter", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.record_queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            record = self.record_queue.get()
+            batch  = [record]
+            while record is not None and len(batch) < BATCH_SIZE:
+                try:
+                    record = self.record_queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(record)
+            for record in batch:
+                if record is None:
+                    continue
+                for handler in self.handlers:
+                    if record.levelno >= handler.level and handler.filter(record):
+                        handler.handle(record)
+            for handler in self.handlers:
+                if isinstance(handler, BatchRotatingFileHandler):
+                    handler.flush_batch()
+                else:
+                    handler.flush()
+            if batch[-1] is None:
+                return
+
+log_writer = None
+
+# ログの出力先を設定し、書き込みスレッドを開始する
+def setup_logging(log_dir=None, level=logging.INFO, console=True, max_bytes=1024 * 1024, backup_count=5):
+    global log_writer
+    if log_writer is not None:
+        return log_writer
+    log_dir = log_dir or os.path.dirname(os.path.abspath(__file__))
+    os.makedirs(log_dir, exist_ok=True)
+
+    # 動作ログ（監査ログは除く）
+    app_handler = BatchRotatingFileHandler(os.path.join(log_dir, "usb_relay.log"), maxBytes=max_bytes,
+                                           backupCount=backup_count, encoding="utf-8", delay=True)
+    app_handler.setFormatter(JsonFormatter())
+    app_handler.addFilter(lambda record: not record.name.startswith(AUDIT_NAME))
+    # 監査ログ
+    audit_handler = BatchRotatingFileHandler(os.path.join(log_dir, "usb_relay_audit.log"), maxBytes=max_bytes,
+                                             backupCount=backup_count, encoding="utf-8", delay=True)
+    audit_handler.setFormatter(JsonFormatter())
+    audit_handler.addFilter(lambda record: record.name.startswith(AUDIT_NAME))
+    handlers = [app_handler, audit_handler]
+    # 画面には従来のprint()と同じくメッセージだけを表示する
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter("%(message)s"))
+        console_handler.addFilter(lambda record: not record.name.startswith(AUDIT_NAME))
+        handlers.append(console_handler)
+
+    record_queue = queue.SimpleQueue()
+    logger.addHandler(NonBlockingHandler(record_queue))
+    logger.setLevel(level)
+    logger.propagate = False
+    log_writer = LogWriter(record_queue, handlers)
+    log_writer.start()
+    return log_writer
+
+# 書き込みスレッドを止め、残っているログをすべて書き出す
+def stop_logging():
+    global log_writer
+    if log_writer is None:
+        return
+    log_writer.stop()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    for handler in log_writer.handlers:
+        handler.close()
+    log_writer = None
+
+# 命令の操作履歴を記録する　old, new は変更前後の状態、latency は命令の所要時間（秒）
+def audit(source, board, relay, old, new, latency, **fields):
+    fields.update(source=source, board=board, relay=relay, old=old, new=new, latency_ms=round(latency * 1000, 3))
+    audit_logger.info("command", extra={"fields": fields})
+
+# 実行前後のマスクから操作履歴を記録する（relay が番号ならそのリレーのＯＮ/ＯＦＦ、"all" ならマスクのまま）
+# 状態が分からない場合は None を渡す
+def audit_mask(source, board, relay, old_mask, new_mask, latency, **fields):
+    if relay != "all":
+        bit      = 1 << (relay - 1)
+        old_mask = None if old_mask is None else bool(old_mask & bit)
+        new_mask = None if new_mask is None else bool(new_mask & bit)
+    audit(source, board, relay, old_mask, new_mask, latency, **fields)
@@ -0,0 +1,229 @@
+# ネットワーク（TCP）接続のリレーモジュール
+# ESP8266等のテキスト命令で操作するリレーモジュールを、HIDリレーボードと同じメソッドで操作する。
+# 接続は使い回し（コネクションプール）、複数の命令は応答を待たずにまとめて送信（パイプライン）する。
+#   命令（1行ずつ）: ON <n> / OFF <n> / ALLON / ALLOFF / STATUS
+#   応答（1行ずつ）: OK <マスク> / ERR <メッセージ>
+# 試験用に同じ命令を受け付けるTCPサーバー（TcpRelayStandIn）を用意している。
+#   python relay_network.py --bench 10000
+import sys
+import time
+import socket
+import logging
+import argparse
+import threading
+import socketserver
+from relay_device import full_mask
+from relay_log    import audit_mask
+
+logger = logging.getLogger("usb_relay.network")
+
+class NetworkRelayError(Exception):
+    pass
+
+class ConnectionPool:
+    # ひとつのリレーモジュールへの接続を使い回すクラス
+    def __init__(self, host, port, size=4, timeout=2.0):
+        self.host      = host
+        self.port      = port
+        self.size      = size
+        self.timeout   = timeout
+        self.idle      = []      # 空いている接続
+        self.created   = 0
+        self.condition = threading.Condition()
+
+    # 空いている接続を返す。無ければ size 個まで新しく接続し、それ以上は空くまで待つ
+    def acquire(self):
+        with self.condition:
+            while not self.idle and self.created >= self.size:
+                if not self.condition.wait(self.timeout):
+                    raise NetworkRelayError(f"{self.host}:{self.port} の接続が空きません")
+            if self.idle:
+                return self.idle.pop()
+            self.created += 1
+        try:
+            conn = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except OSError:
+            with self.condition:
+                self.created -= 1
+                self.condition.notify()
+            raise
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn.makefile("rwb")
+
+    # 使い終わった接続を返す。broken=True の場合は閉じて捨てる
+    def release(self, conn, broken=False):
+        with self.condition:
+            if broken:
+                self.created -= 1
+                conn.close()
+            else:
+                self.idle.append(conn)
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            for conn in self.idle:
+                conn.close()
+            self.created -= len(self.idle)
+            self.idle = []
+
+class NetworkRelayBoard:
+    # TCPのリレーモジュールを操作するクラス
+    def __init__(self, host, port, quantity_relay=8, pool_size=4, timeout=2.0):
+        self.host           = host
+        self.port           = port
+        self.quantity_relay = quantity_relay
+        self.pool           = ConnectionPool(host, port, pool_size, timeout)
+        self.mask           = None      # 最後の応答の状態（操作履歴の変更前の状態）
+
+    def open(self):
+        try:
+            self.get_mask()
+        except (OSError, NetworkRelayError) as e:
+            logger.error("リレーモジュール %s:%s に接続できません: %s", self.host, self.port, e)
+            return False
+        return True
+
+    def close(self):
+        self.pool.close()
+
+    # 複数の命令をまとめて送信し、各命令の応答のマスクを順番に返す
+    # 使い回した接続が切れていた場合は、新しい接続で１回だけやり直す
+    def pipeline(self, commands):
+        request = "".join(f"{command}\n" for command in commands).encode("ascii")
+        for attempt in range(2):
+            conn = self.pool.acquire()
+            try:
+                conn.write(request)
+                conn.flush()
+                replies = [conn.readline() for _ in commands]
+            except OSError as e:
+                self.pool.release(conn, broken=True)
+                if attempt == 0 and not isinstance(e, socket.timeout):
+                    continue
+                raise NetworkRelayError(f"{self.host}:{self.port} との通信に失敗しました: {e}")
+            if not replies or not replies[-1]:
+                self.pool.release(conn, broken=True)
+                if attempt == 0:
+                    continue
+                raise NetworkRelayError(f"{self.host}:{self.port} との接続が切断されました")
+            self.pool.release(conn)
+            return [self.parse_reply(reply) for reply in replies]
+
+    def parse_reply(self, reply):
+        fields = reply.decode("ascii", "replace").split()
+        if len(fields) == 2 and fields[0] == "OK":
+            return int(fields[1])
+        raise NetworkRelayError(f"{self.host}:{self.port} がエラーを返しました: {reply.strip()!r}")
+
+    # 状態を変える命令を１つ送信し、操作履歴に記録する
+    def command(self, relay, command):
+        old     = self.mask
+        started = time.perf_counter()
+        try:
+            self.mask = self.pipeline([command])[0]
+        except NetworkRelayError as e:
+            self.mask = None
+            audit_mask("network", f"{self.host}:{self.port}", relay, old, None, time.perf_counter() - started, error=str(e))
+            raise
+        audit_mask("network", f"{self.host}:{self.port}", relay, old, self.mask, time.perf_counter() - started)
+        return self.mask
+
+    def relay_on(self, relay_number):
+        return self.command(relay_number, f"ON {relay_number}")
+
+    def relay_off(self, relay_number):
+        return self.command(relay_number, f"OFF {relay_number}")
+
+    def on_all(self):
+        return self.command("all", "ALLON")
+
+    def off_all(self):
+        return self.command("all", "ALLOFF")
+
+    def get_mask(self):
+        self.mask = self.pipeline(["STATUS"])[0]
+        return self.mask
+
+class StandInHandler(socketserver.StreamRequestHandler):
+    # 接続１つ分の命令を処理する
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        server = self.server
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            fields = line.decode("ascii", "replace").split()
+            with server.lock:
+                reply = server.execute(fields)
+            self.wfile.write(reply.encode("ascii"))
+
+class TcpRelayStandIn(socketserver.ThreadingTCPServer):
+    # ネットワークリレーモジュールの代わりに命令を受け付ける試験用のTCPサーバー
+    daemon_threads      = True
+    allow_reuse_address = True
+
+    def __init__(self, address=("127.0.0.1", 0), quantity_relay=8, delay=0.0):
+        super().__init__(address, StandInHandler)
+        self.quantity_relay = quantity_relay
+        self.delay          = delay      # 命令ごとの処理時間（秒）
+        self.mask           = 0
+        self.commands       = 0
+        self.lock           = threading.Lock()
+
+    def execute(self, fields):
+        if self.delay:
+            time.sleep(self.delay)
+        self.commands += 1
+        try:
+            if fields[0] in ("ON", "OFF"):
+                relay_number = int(fields[1])
+                if not 1 <= relay_number <= self.quantity_relay:
+                    return "ERR relay\n"
+                if fields[0] == "ON":
+                    self.mask |= 1 << (relay_number - 1)
+                else:
+                    self.mask &= ~(1 << (relay_number - 1))
+            elif fields[0] == "ALLON":
+                self.mask = full_mask(self.quantity_relay)
+            elif fields[0] == "ALLOFF":
+                self.mask = 0
+            elif fields[0] != "STATUS":
+                return "ERR command\n"
+        except (IndexError, ValueError):
+            return "ERR syntax\n"
+        return f"OK {self.mask}\n"
+
+#========メイン処理=========#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ネットワークリレーモジュール")
+    parser.add_argument("--host",     default=None, help="リレーモジュールのアドレス（省略時は試験用サーバー）")
+    parser.add_argument("--port",     type=int, default=6722)
+    parser.add_argument("--quantity", type=int, default=8, help="リレー個数")
+    parser.add_argument("--bench",    type=int, default=1000, help="ＯＮ/ＯＦＦを切り替える回数")
+    parser.add_argument("--batch",    type=int, default=1, help="まとめて送信する命令数")
+    args = parser.parse_args()
+
+    standin = None
+    host, port = args.host, args.port
+    if host is None:
+        standin = TcpRelayStandIn(quantity_relay=args.quantity)
+        threading.Thread(target=standin.serve_forever, daemon=True).start()
+        host, port = standin.server_address
+    board = NetworkRelayBoard(host, port, args.quantity)
+    if not board.open():
+        sys.exit(1)
+
+    commands = [f"{'ON' if (i // args.quantity) % 2 == 0 else 'OFF'} {i % args.quantity + 1}" for i in range(args.bench)]
+    started  = time.perf_counter()
+    for i in range(0, len(commands), args.batch):
+        board.pipeline(commands[i:i + args.batch])
+    elapsed  = time.perf_counter() - started
+    print(f"命令 {args.bench}回  まとめて送信 {args.batch}件  処理時間 {elapsed:.3f}秒  "
+          f"({args.bench / elapsed:,.0f} 命令/秒)  状態 {board.get_mask():08b}")
+    board.close()
+    if standin:
+        standin.shutdown()
+        standin.server_close()
@@ -0,0 +1,304 @@
+# リレーボードへの命令の優先順位付きキュー
+# 命令を種類（優先度）ごとのキューに入れ、手動操作 → 安全 → タイマー → 一括 の順に実行する。
+# 全ＯＮや大量のタイマーの追い付き処理の後ろで、画面の「入/切」が待たされないようにする。
+#   ・同じ優先度で同じリレーへの命令が続けて溜まった場合は、最後の命令だけを実行する（統合）
+#     間に他の命令（別のリレーへの書き込み・状態の読み出し）をはさんだ命令は、
+#     入った順番のとおりに実行されるよう統合しない
+#   ・優先度の高い命令は、それより前に入った優先度の低い同じリレーへの命令を打ち消す
+#     （後から実行されて手動操作が上書きされないようにする）
+#   ・期限（deadline）を過ぎた命令は実行せずに捨てる
+#   ・優先度ごとに待ち時間（キューに入ってから実行されるまで）を記録する
+#   python relay_priority.py --bulk-threads 4 --latency 0.001
+import time
+import logging
+import argparse
+import threading
+from collections import deque
+from relay_device import SimulatedRelayBoard, RELAY_ON, RELAY_OFF, ALL_ON, ALL_OFF
+
+logger = logging.getLogger("usb_relay.priority")
+
+# 優先度（小さいほど先に実行）
+INTERACTIVE = 0    # 画面等の手動操作
+SAFETY      = 1    # ウォッチドッグ・インターロック等
+SCHEDULED   = 2    # タイマー
+BULK        = 3    # 全ＯＮ/全ＯＦＦ・シーン・一括処理
+PRIORITY_NAMES = ("interactive", "safety", "scheduled", "bulk")
+
+STATUS = 0         # 状態の読み出し（統合しない）
+
+class Command:
+    # キューに入れた１つの命令
+    __slots__ = ("priority", "opcode", "relay_number", "deadline", "enqueued", "done", "merged", "except_mask", "epoch")
+
+    def __init__(self, priority, opcode, relay_number, deadline, enqueued, done, epoch=0):
+        self.priority     = priority
+        self.opcode       = opcode
+        self.relay_number = relay_number
+        self.deadline     = deadline    # この時刻（time.monotonic）までに実行できなければ捨てる
+        self.enqueued     = enqueued
+        self.done         = done        # done(命令, 実行後のマスク, エラー)
+        self.merged       = []          # この命令に統合された（打ち消された）命令
+        self.except_mask  = 0           # 全ＯＮ/全ＯＦＦで、優先度の高い命令が後から操作したリレー
+        self.epoch        = epoch       # 同じ優先度で何回目の状態の読み出しの後に入ったか
+
+    # 統合に使うキー（同じキーの命令が続いた場合は後の命令だけを実行する）
+    def key(self):
+        if self.opcode in (RELAY_ON, RELAY_OFF):
+            return (self.relay_number, self.epoch)
+        if self.opcode in (ALL_ON, ALL_OFF):
+            return ("all", self.epoch)
+        return self
+
+    def writes(self):
+        return self.opcode in (RELAY_ON, RELAY_OFF, ALL_ON, ALL_OFF)
+
+    def finish(self, mask, error=None):
+        for command in self.merged:
+            command.finish(mask, error)
+        if self.done:
+            self.done(self, mask, error)
+
+class QueueStats:
+    # 優先度ごとの待ち時間の記録
+    def __init__(self, window=1000):
+        self.delays   = deque(maxlen=window)
+        self.executed = 0
+        self.merged   = 0
+        self.expired  = 0
+        self.worst    = 0.0
+
+    def record(self, delay):
+        self.executed += 1
+        self.worst     = max(self.worst, delay)
+        self.delays.append(delay)
+
+    def metrics(self):
+        recent = sorted(self.delays)
+        def pick(p):
+            return recent[min(len(recent) - 1, int(len(recent) * p / 100))] if recent else 0.0
+        return {"executed": self.executed, "merged": self.merged, "expired": self.expired,
+                "p50": pick(50), "p99": pick(99), "worst": self.worst}
+
+class CommandQueue:
+    # ボード１枚分の優先順位付きキュー（スレッドの扱いは呼び出し側で行う）
+    def __init__(self, clock=time.monotonic):
+        self.clock   = clock
+        self.pending = [dict() for _ in PRIORITY_NAMES]   # 優先度ごとの {命令: 命令}（dictの順番が実行順）
+        self.epochs  = [0 for _ in PRIORITY_NAMES]        # 優先度ごとの状態の読み出しの回数
+        self.stats   = [QueueStats() for _ in PRIORITY_NAMES]
+
+    def __len__(self):
+        return sum(len(pending) for pending in self.pending)
+
+    def put(self, priority, opcode, relay_number=0, deadline=None, done=None):
+        command = Command(priority, opcode, relay_number, deadline, self.clock(), done, self.epochs[priority])
+        key     = command.key()
+        pending = self.pending[priority]
+        is_all  = opcode in (ALL_ON, ALL_OFF)
+        last    = next(reversed(pending), None)
+        if is_all:
+            # 全ＯＮ/全ＯＦＦはそれまでの同じ優先度の命令（最後の読み出しより後）をすべて打ち消す
+            for old in [c for c in pending if c.writes() and c.epoch == command.epoch]:
+                self.supersede(command, pending.pop(old))
+        elif last is not None and last.key() == key:
+            # 最後に入った命令と同じリレーへの命令だけを統合する（他の命令との順番は変えない）
+            self.supersede(command, pending.pop(last))
+        if command.writes():
+            # 優先度の低いキューに残っている同じリレーへの命令は、この命令で打ち消す
+            bit = 0 if is_all else 1 << (relay_number - 1)
+            for lower_pending in self.pending[priority + 1:]:
+                for old in [c for c in lower_pending if c.writes()]:
+                    if is_all or old.opcode in (RELAY_ON, RELAY_OFF) and old.relay_number == relay_number:
+                        self.supersede(command, lower_pending.pop(old))
+                    elif old.opcode in (ALL_ON, ALL_OFF):
+                        old.except_mask |= bit
+        else:
+            self.epochs[priority] += 1
+        pending[command] = command
+        return command
+
+    def supersede(self, command, old):
+        command.merged.append(old)
+        self.stats[old.priority].merged += 1
+
+    # 次に実行する命令を返す（無ければNone）。期限切れの命令は捨てて done にエラーを渡す
+    def get(self):
+        now = self.clock()
+        for priority, pending in enumerate(self.pending):
+            while pending:
+                key     = next(iter(pending))
+                command = pending.pop(key)
+                if command.deadline is not None and now > command.deadline:
+                    self.stats[priority].expired += 1
+                    command.finish(None, "期限切れ")
+                    continue
+                self.stats[priority].record(now - command.enqueued)
+                return command
+        return None
+
+    def metrics(self):
+        return {name: stats.metrics() for name, stats in zip(PRIORITY_NAMES, self.stats)}
+
+# 命令をボードで実行し、実行後のマスクを返す
+def execute(board, command):
+    opcode = command.opcode
+    if opcode == RELAY_ON:
+        board.relay_on(command.relay_number)
+    elif opcode == RELAY_OFF:
+        board.relay_off(command.relay_number)
+    elif opcode in (ALL_ON, ALL_OFF) and command.except_mask:
+        # 優先度の高い命令で操作されたリレーを除いて、全ＯＮ/全ＯＦＦにする
+        for n in range(board.quantity_relay):
+            if not command.except_mask & (1 << n):
+                if opcode == ALL_ON:
+                    board.relay_on(n + 1)
+                else:
+                    board.relay_off(n + 1)
+    elif opcode == ALL_ON:
+        board.on_all()
+    elif opcode == ALL_OFF:
+        board.off_all()
+    return board.get_mask()
+
+class Ticket:
+    # キューに入れた命令の結果を待つためのもの
+    def __init__(self):
+        self.event = threading.Event()
+        self.mask  = None
+        self.error = None
+
+    def set(self, command, mask, error):
+        self.mask  = mask
+        self.error = error
+        self.event.set()
+
+    def wait(self, timeout=None):
+        self.event.wait(timeout)
+        return self.mask
+
+class PriorityRelayBoard:
+    # ボードを専有するスレッドが、優先順位付きキューの命令を順番に実行するクラス
+    def __init__(self, board):
+        self.board          = board
+        self.quantity_relay = board.quantity_relay
+        self.queue          = CommandQueue()
+        self.condition      = threading.Condition()
+        self.stopped        = False
+        self.thread         = threading.Thread(target=self.run, name="PriorityRelayBoard", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+
+    def submit(self, priority, opcode, relay_number=0, deadline=None):
+        ticket = Ticket()
+        with self.condition:
+            self.queue.put(priority, opcode, relay_number, deadline, ticket.set)
+            self.condition.notify()
+        return ticket
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.queue) or self.stopped)
+                if self.stopped and not len(self.queue):
+                    return
+                command = self.queue.get()
+            if command is None:
+                continue
+            try:
+                command.finish(execute(self.board, command))
+            except Exception as e:
+                logger.error("命令の実行に失敗しました: %s", e)
+                command.finish(None, str(e))
+
+    # 優先度を決めてボードと同じメソッドで操作するためのもの
+    def view(self, priority, timeout=None):
+        return PriorityView(self, priority, timeout)
+
+class PriorityView:
+    # PriorityRelayBoard を指定した優先度で操作する（relay_on 等は実行されるまで待つ）
+    # timeout（秒）を指定すると、その時間内に実行できない命令は捨てる
+    def __init__(self, device, priority, timeout=None):
+        self.device         = device
+        self.priority       = priority
+        self.timeout        = timeout
+        self.quantity_relay = device.quantity_relay
+
+    def call(self, opcode, relay_number=0):
+        deadline = time.monotonic() + self.timeout if self.timeout is not None else None
+        ticket   = self.device.submit(self.priority, opcode, relay_number, deadline)
+        mask     = ticket.wait()
+        if ticket.error:
+            raise RuntimeError(ticket.error)
+        return mask
+
+    def open(self):
+        return True
+
+    def close(self):
+        pass
+
+    def relay_on(self, relay_number):
+        return self.call(RELAY_ON, relay_number)
+
+    def relay_off(self, relay_number):
+        return self.call(RELAY_OFF, relay_number)
+
+    def on_all(self):
+        return self.call(ALL_ON)
+
+    def off_all(self):
+        return self.call(ALL_OFF)
+
+    def get_mask(self):
+        return self.call(STATUS)
+
+#========メイン処理=========#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="優先順位付きキューの試験（一括処理の負荷中の手動操作の待ち時間）")
+    parser.add_argument("--quantity",     type=int,   default=8,     help="リレー個数")
+    parser.add_argument("--latency",      type=float, default=0.001, help="シミュレーションボードの応答時間（秒）")
+    parser.add_argument("--bulk-threads", type=int,   default=4,     help="一括処理のスレッド数")
+    parser.add_argument("--toggles",      type=int,   default=200,   help="手動操作の回数")
+    args = parser.parse_args()
+
+    def measure(use_priority):
+        board   = SimulatedRelayBoard(args.quantity, latency=args.latency)
+        device  = PriorityRelayBoard(board)
+        stopped = threading.Event()
+        manual  = device.view(INTERACTIVE if use_priority else BULK)
+        def bulk_load():
+            bulk = device.view(BULK)
+            n    = 0
+            while not stopped.is_set():
+                # 応答を待たずに大量に積む（タイマーの追い付き等）
+                for _ in range(args.quantity * 4):
+                    device.submit(BULK, RELAY_ON if n % 2 else RELAY_OFF, n % args.quantity + 1)
+                    n += 1
+                bulk.get_mask()
+        threads = [threading.Thread(target=bulk_load, daemon=True) for _ in range(args.bulk_threads)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        delays = []
+        for i in range(args.toggles):
+            started = time.perf_counter()
+            manual.relay_on(1) if i % 2 else manual.relay_off(1)
+            delays.append(time.perf_counter() - started)
+        stopped.set()
+        for thread in threads:
+            thread.join()
+        device.close()
+        delays.sort()
+        return delays[len(delays) // 2], delays[int(len(delays) * 0.99)], device.queue.metrics()
+
+    for use_priority in (False, True):
+        p50, p99, metrics = measure(use_priority)
+        label = "優先順位あり" if use_priority else "優先順位なし"
+        print(f"{label}  手動操作の応答 p50 {p50 * 1000:7.2f}ms  p99 {p99 * 1000:7.2f}ms  "
+              f"一括の統合 {metrics['bulk']['merged']}件  実行 {metrics['bulk']['executed']}件")
@@ -0,0 +1,270 @@
+# 複数ボードの登録簿（SQLite）
+# ボード、リレー（名称・グループ）、タイマー設定をひとつのデータベースで管理する。
+# settings.json はボード１枚分、リレーデータのjsonはボード１枚分のリストなので、
+# 多数のボードを扱う場合はこちらに取り込んで使う。
+# 変更は該当する行だけを更新するので、ファイル全体を書き直すことはない。
+import os
+import sys
+import json
+import sqlite3
+import argparse
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS boards (
+    id             INTEGER PRIMARY KEY,
+    name           TEXT    NOT NULL UNIQUE,
+    vender_id      INTEGER,
+    device_id      INTEGER,
+    quantity_relay INTEGER NOT NULL,
+    auto_load      TEXT    NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS relays (
+    id           INTEGER PRIMARY KEY,
+    board_id     INTEGER NOT NULL REFERENCES boards(id) ON DELETE CASCADE,
+    relay_number INTEGER NOT NULL,
+    classifying  TEXT    NOT NULL DEFAULT '',
+    group_name   TEXT    NOT NULL DEFAULT '',
+    UNIQUE (board_id, relay_number)
+);
+CREATE TABLE IF NOT EXISTS schedules (
+    id           INTEGER PRIMARY KEY,
+    relay_id     INTEGER NOT NULL REFERENCES relays(id) ON DELETE CASCADE,
+    timer_onoff  INTEGER NOT NULL DEFAULT 0,
+    start_hour   INTEGER NOT NULL DEFAULT 0,
+    start_minute INTEGER NOT NULL DEFAULT 0,
+    end_hour     INTEGER NOT NULL DEFAULT 0,
+    end_minute   INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_relays_group     ON relays(group_name);
+CREATE INDEX IF NOT EXISTS idx_relays_name      ON relays(classifying);
+CREATE INDEX IF NOT EXISTS idx_schedules_relay  ON schedules(relay_id);
+"""
+
+SCHEDULE_FIELDS = ("timer_onoff", "start_hour", "start_minute", "end_hour", "end_minute")
+
+DEFAULT_DB = os.path.join(os.path.dirname(__file__), "relay_registry.db")
+
+# settings.json と同じ規則でIDの文字列を数値にする（"0x"で始まれば16進数）
+def parse_id(value):
+    if isinstance(value, int):
+        return value
+    if value == "":
+        return None
+    return int(value, 16) if value[:2] == "0x" else int(value)
+
+class RelayRegistry:
+    # ボード・リレー・タイマー設定の登録簿
+    def __init__(self, path=DEFAULT_DB):
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    #========ボード=========#
+    # ボードを登録し、リレー個数分のリレー行を作成する
+    def add_board(self, name, vender_id, device_id, quantity_relay, auto_load=""):
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO boards (name, vender_id, device_id, quantity_relay, auto_load) VALUES (?, ?, ?, ?, ?)",
+                (name, vender_id, device_id, quantity_relay, auto_load))
+            board_id = cur.lastrowid
+            self.conn.executemany(
+                "INSERT INTO relays (board_id, relay_number) VALUES (?, ?)",
+                [(board_id, n) for n in range(1, quantity_relay + 1)])
+        return board_id
+
+    def get_board(self, board_id):
+        return self.conn.execute("SELECT * FROM boards WHERE id = ?", (board_id,)).fetchone()
+
+    def find_board(self, name):
+        return self.conn.execute("SELECT * FROM boards WHERE name = ?", (name,)).fetchone()
+
+    def list_boards(self):
+        return self.conn.execute("SELECT * FROM boards ORDER BY id").fetchall()
+
+    def delete_board(self, board_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM boards WHERE id = ?", (board_id,))
+
+    #========リレー=========#
+    def relay_id(self, board_id, relay_number):
+        row = self.conn.execute("SELECT id FROM relays WHERE board_id = ? AND relay_number = ?",
+                                (board_id, relay_number)).fetchone()
+        if row is None:
+            raise KeyError(f"ボード{board_id}にリレー{relay_number}は登録されていません")
+        return row["id"]
+
+    # ボードの {リレー番号: リレーのID} を返す（一括取り込み用）
+    def relay_ids(self, board_id):
+        rows = self.conn.execute("SELECT relay_number, id FROM relays WHERE board_id = ?", (board_id,))
+        return {row["relay_number"]: row["id"] for row in rows}
+
+    def set_relay_name(self, board_id, relay_number, classifying):
+        with self.conn:
+            self.conn.execute("UPDATE relays SET classifying = ? WHERE board_id = ? AND relay_number = ?",
+                              (classifying, board_id, relay_number))
+
+    # 複数のリレーの名称を１つのトランザクションで更新する　rows は (名称, リレーのID) のリスト
+    def set_relay_names(self, rows):
+        with self.conn:
+            self.conn.executemany("UPDATE relays SET classifying = ? WHERE id = ?", rows)
+
+    def set_relay_group(self, board_id, relay_number, group_name):
+        with self.conn:
+            self.conn.execute("UPDATE relays SET group_name = ? WHERE board_id = ? AND relay_number = ?",
+                              (group_name, board_id, relay_number))
+
+    def find_relays_by_group(self, group_name):
+        return self.conn.execute("SELECT * FROM relays WHERE group_name = ? ORDER BY board_id, relay_number",
+                                 (group_name,)).fetchall()
+
+    def find_relays_by_name(self, classifying):
+        return self.conn.execute("SELECT * FROM relays WHERE classifying = ? ORDER BY board_id, relay_number",
+                                 (classifying,)).fetchall()
+
+    #========タイマー設定=========#
+    def add_schedule(self, board_id, relay_number, timer_onoff, start_hour, start_minute, end_hour, end_minute):
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO schedules (relay_id, timer_onoff, start_hour, start_minute, end_hour, end_minute) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self.relay_id(board_id, relay_number), int(bool(timer_onoff)),
+                 start_hour, start_minute, end_hour, end_minute))
+        return cur.lastrowid
+
+    # 複数のタイマー設定を１つのトランザクションで追加する
+    # rows は (リレーのID, タイマーON/OFF, 開始時, 開始分, 終了時, 終了分) のリスト
+    def add_schedules(self, rows):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO schedules (relay_id, timer_onoff, start_hour, start_minute, end_hour, end_minute) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    # 指定したリレーのタイマー設定をすべて削除してから rows を追加する（一括取り込みでの置き換え用）
+    # relay_ids は削除するリレーのIDのリスト、rows は add_schedules と同じ
+    def replace_schedules(self, relay_ids, rows):
+        with self.conn:
+            self.conn.executemany("DELETE FROM schedules WHERE relay_id = ?", [(relay_id,) for relay_id in relay_ids])
+            self.conn.executemany(
+                "INSERT INTO schedules (relay_id, timer_onoff, start_hour, start_minute, end_hour, end_minute) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    # 指定した項目だけを更新する 例: update_schedule(5, timer_onoff=True)
+    def update_schedule(self, schedule_id, **fields):
+        unknown = set(fields) - set(SCHEDULE_FIELDS)
+        if unknown:
+            raise ValueError(f"タイマー設定に存在しない項目です: {', '.join(sorted(unknown))}")
+        if not fields:
+            return
+        if "timer_onoff" in fields:
+            fields["timer_onoff"] = int(bool(fields["timer_onoff"]))
+        columns = ", ".join(f"{key} = ?" for key in fields)
+        with self.conn:
+            self.conn.execute(f"UPDATE schedules SET {columns} WHERE id = ?", (*fields.values(), schedule_id))
+
+    def delete_schedule(self, schedule_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM schedules WHERE id = ?", (schedule_id,))
+
+    # ボードの全タイマー設定をリレー番号順に返す
+    def schedules_for_board(self, board_id):
+        return self.conn.execute(
+            "SELECT s.*, r.relay_number FROM schedules s JOIN relays r ON r.id = s.relay_id "
+            "WHERE r.board_id = ? ORDER BY r.relay_number, s.id", (board_id,)).fetchall()
+
+    # 全ボードのタイマーＯＮの設定を、ボード名・リレー個数・リレー番号・グループ名と共に返す（一括分析用）
+    def all_schedules(self):
+        return self.conn.execute(
+            "SELECT s.*, r.relay_number, r.group_name, b.name AS board_name, b.quantity_relay "
+            "FROM schedules s JOIN relays r ON r.id = s.relay_id JOIN boards b ON b.id = r.board_id "
+            "WHERE s.timer_onoff = 1 ORDER BY b.id, r.relay_number, s.id").fetchall()
+
+    # AutoLoadData.load_data() と同じ形式（リレーごとの辞書のリスト）でボードの設定を返す
+    # リレーに複数のタイマー設定がある場合は、タイマーＯＮのもののうち最後に登録したものを使う
+    def load_board_data(self, board_id):
+        rows = self.conn.execute(
+            "SELECT r.relay_number, r.classifying, s.timer_onoff, s.start_hour, s.start_minute, s.end_hour, s.end_minute "
+            "FROM relays r LEFT JOIN schedules s ON s.id = "
+            "(SELECT id FROM schedules WHERE relay_id = r.id ORDER BY timer_onoff DESC, id DESC LIMIT 1) "
+            "WHERE r.board_id = ? ORDER BY r.relay_number", (board_id,)).fetchall()
+        loaded_data = []
+        for row in rows:
+            loaded_data.append({
+                "classifying":  row["classifying"],
+                "timer_onoff":  bool(row["timer_onoff"]),
+                "start_hour":   f"{row['start_hour'] or 0:2d}",
+                "start_minute": f"{row['start_minute'] or 0:2d}",
+                "end_hour":     f"{row['end_hour'] or 0:2d}",
+                "end_minute":   f"{row['end_minute'] or 0:2d}",
+            })
+        return loaded_data
+
+    #========jsonファイルの取り込み=========#
+    # settings.json をボードとして取り込む。auto_load のファイルがあればそれも取り込む。
+    def import_settings(self, setting_file, name=None):
+        with open(setting_file, "r") as file:
+            settings = json.load(file)
+        quantity_relay = int(settings.get("quantity_relay") or 8)
+        auto_load      = settings.get("auto_load", "")
+        board_id = self.add_board(name or os.path.splitext(os.path.basename(setting_file))[0],
+                                  parse_id(settings.get("vender_id", "")),
+                                  parse_id(settings.get("device_id", "")),
+                                  quantity_relay, auto_load)
+        data_file = os.path.join(os.path.dirname(os.path.abspath(setting_file)), auto_load) if auto_load else ""
+        if data_file and os.path.exists(data_file):
+            self.import_relay_data(board_id, data_file)
+        return board_id
+
+    # 「保存」メニューで保存したリレーデータのjsonをボードに取り込む
+    def import_relay_data(self, board_id, data_file):
+        with open(data_file, "r") as f:
+            loaded_data = json.load(f)
+        with self.conn:
+            for relay_number, item in enumerate(loaded_data, start=1):
+                relay_id = self.relay_id(board_id, relay_number)
+                self.conn.execute("UPDATE relays SET classifying = ? WHERE id = ?",
+                                  (item.get("classifying", ""), relay_id))
+                self.conn.execute("DELETE FROM schedules WHERE relay_id = ?", (relay_id,))
+                self.conn.execute(
+                    "INSERT INTO schedules (relay_id, timer_onoff, start_hour, start_minute, end_hour, end_minute) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (relay_id, int(bool(item.get("timer_onoff", False))),
+                     int(item.get("start_hour", 0)), int(item.get("start_minute", 0)),
+                     int(item.get("end_hour", 0)),   int(item.get("end_minute", 0))))
+
+#========メイン処理=========#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="リレーボード登録簿")
+    parser.add_argument("--db", default=DEFAULT_DB, help="データベースファイル")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_import = sub.add_parser("import", help="settings.json を取り込む")
+    p_import.add_argument("setting_file")
+    p_import.add_argument("--name", default=None, help="ボード名")
+    p_data = sub.add_parser("import-data", help="リレーデータのjsonを既存のボードに取り込む")
+    p_data.add_argument("board_id", type=int)
+    p_data.add_argument("data_file")
+    sub.add_parser("list", help="登録済みのボードを表示する")
+    args = parser.parse_args()
+
+    registry = RelayRegistry(args.db)
+    try:
+        if args.command == "import":
+            board_id = registry.import_settings(args.setting_file, args.name)
+            print(f"ボード{board_id}として取り込みました")
+        elif args.command == "import-data":
+            registry.import_relay_data(args.board_id, args.data_file)
+            print(f"ボード{args.board_id}にリレーデータを取り込みました")
+        else:
+            for board in registry.list_boards():
+                print(f"{board['id']}: {board['name']}  ベンダーID：{board['vender_id']}  "
+                      f"デバイスID：{board['device_id']}  リレー個数：{board['quantity_relay']}")
+    except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+        print(f"エラーが発生しました: {e}")
+        sys.exit(1)
+    finally:
+        registry.close()
@@ -0,0 +1,199 @@
+# タイマー処理（スケジュールエンジン）
+# 毎日定時にＯＮとＯＦＦを繰り返すタイマーの判定を、画面（tkinter）から切り離して行う。
+# 時計は関数で差し替えられるので、シミュレーションでは仮想の時計を渡す。
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime, timedelta
+from relay_device import apply_difference
+from relay_solar import ANCHORS
+
+MINUTES_PER_DAY = 24 * 60
+
+# 1件のタイマー設定　start, end は 0時0分からの経過分
+# start_anchor, end_anchor に "sunrise"/"sunset" を指定した場合、start, end は日の出・日の入りからのずらし（分）
+Schedule = namedtuple("Schedule", ["relay_number", "start", "end", "start_anchor", "end_anchor"],
+                      defaults=(None, None))
+
+# リレーデータのjsonで日の出・日の入り基準のタイマーに使う項目
+ANCHOR_KEYS = ("start_anchor", "start_offset", "end_anchor", "end_offset")
+
+def anchors_from_data(item):
+    return {key: item[key] for key in ANCHOR_KEYS if key in item}
+
+# リレーデータのjson（AutoLoadData.load_data() の形式）の1件からタイマー設定を作る
+# "start_anchor"/"end_anchor" がある場合は "start_offset"/"end_offset"（分、省略時は0）を使う
+# タイマーが設定されていなければNoneを返す。基準が "sunrise"/"sunset" 以外なら ValueError
+def schedule_from_data(relay_number, item):
+    if not item["timer_onoff"]:
+        return None
+    start_anchor = item.get("start_anchor") or None
+    end_anchor   = item.get("end_anchor")   or None
+    for anchor in (start_anchor, end_anchor):
+        if anchor is not None and anchor not in ANCHORS:
+            raise ValueError(f"リレー{relay_number}のタイマーの基準 '{anchor}' は不明です（{', '.join(ANCHORS)} のどちらか）")
+    if start_anchor:
+        start = int(item.get("start_offset", 0))
+    else:
+        start = int(item["start_hour"]) * 60 + int(item["start_minute"])
+    if end_anchor:
+        end   = int(item.get("end_offset", 0))
+    else:
+        end   = int(item["end_hour"])   * 60 + int(item["end_minute"])
+    return Schedule(relay_number, start, end, start_anchor, end_anchor)
+
+# 日の出・日の入り基準の時刻を、その日の0時0分からの経過分にする
+# sun はその日の (日の出, 日の入り)。場所が設定されていない（sun がNone）場合はNoneを返す
+# 終了（end=True）がちょうど24時（白夜の日の入り等）の場合は、0時に戻さず24時のままにする
+def anchored_minute(anchor, offset, sun, end=False):
+    if anchor is None:
+        return offset
+    if sun is None:
+        return None
+    base   = sun[ANCHORS.index(anchor)]    # sun は ANCHORS と同じ (日の出, 日の入り) の順
+    minute = base + offset
+    if end and minute == MINUTES_PER_DAY:
+        return minute
+    return minute % MINUTES_PER_DAY
+
+# タイマー設定の開始・終了をその日の (開始, 終了) の分にする。決められなければNone
+def resolve_schedule(schedule, sun=None):
+    if schedule.start_anchor is None and schedule.end_anchor is None:
+        return schedule.start, schedule.end
+    start = anchored_minute(schedule.start_anchor, schedule.start, sun)
+    end   = anchored_minute(schedule.end_anchor,   schedule.end,   sun, end=True)
+    if start is None or end is None:
+        return None
+    return start, end
+
+def schedules_from_data(loaded_data):
+    schedules = []
+    for i, item in enumerate(loaded_data):
+        schedule = schedule_from_data(i + 1, item)
+        if schedule:
+            schedules.append(schedule)
+    return schedules
+
+# タイマー時刻のチェック（画面の入力と一括取り込みで共通）
+# 時・分は文字列（画面の" 0"等）でも数値でもよい。問題がなければNone、あればエラーメッセージを返す
+def check_hour_minute(start_hour, start_minute, end_hour, end_minute):
+    try:
+        start_hour, start_minute, end_hour, end_minute = int(start_hour), int(start_minute), int(end_hour), int(end_minute)
+    except (TypeError, ValueError):
+        return 'タイマー時刻にあり得ない数値が設定されています。'
+    if start_hour == 0 and start_minute == 0 and end_hour == 0 and end_minute == 0:
+        return 'タイマー時刻が設定されていません。'
+    elif start_hour == end_hour and start_minute == end_minute:
+        return 'タイマー開始と終了に同じ時刻は設定できません。'
+    elif (0 <= start_hour < 24) and (0 <= start_minute < 60) and (0 <= end_hour < 24) and (0 <= end_minute < 60):
+        return None
+    else:
+        return 'タイマー時刻にあり得ない数値が設定されています。'
+
+# タイマーの判定
+# minute（0時0分からの経過分）がタイマーのＯＮの時間帯に入っているかを返す
+# 終了時分が開始時分より前の場合は、日付をまたぐ時間帯とみなす
+def timer_active(start, end, minute):
+    if start <= end:
+        return start <= minute < end
+    return minute >= start or minute < end
+
+# タイマー設定のリストから、minute 時点のあるべきマスクと、タイマーで制御するリレーのマスクを返す
+# sun はその日の (日の出, 日の入り)。日の出・日の入り基準のタイマーは sun が無ければ制御しない
+def desired_mask(schedules, minute, sun=None):
+    desired = 0
+    care    = 0
+    for schedule in schedules:
+        window = resolve_schedule(schedule, sun)
+        if window is None:
+            continue
+        bit   = 1 << (schedule.relay_number - 1)
+        care |= bit
+        if timer_active(window[0], window[1], minute):
+            desired |= bit
+    return desired, care
+
+class ScheduleEngine:
+    # ボード１枚分のタイマー設定から、あるべきＯＮ/ＯＦＦを計算してボードに反映するクラス
+    # 開始・終了の分だけでなく毎回あるべき状態と実際の状態を比べるので、判定の取りこぼしや
+    # 時間帯の途中での再起動、手動での切り替えがあっても次の判定で正しい状態に戻る。
+    # read_back=False の場合は、ボードから読まずに前回反映したマスクを実際の状態とみなす。
+    # solar（relay_solar.SolarCalendar）を渡すと、日の出・日の入り基準のタイマーを表から引いて判定する。
+    def __init__(self, board, schedules, clock=datetime.now, read_back=True, solar=None):
+        self.board     = board
+        self.clock     = clock
+        self.read_back = read_back
+        self.solar     = solar
+        self.actual    = None   # 前回反映したマスク（不明の場合はNone）
+        self.schedules = []
+        self.set_schedules(schedules)
+
+    # タイマー設定を入れ替え、開始・終了の分の索引を作り直す
+    # 日の出・日の入り基準のタイマーは日によって時刻が変わるので、索引には入れずに別に持つ
+    def set_schedules(self, schedules):
+        self.schedules = list(schedules)
+        self.anchored  = [s for s in self.schedules if s.start_anchor or s.end_anchor]
+        minutes = set()
+        for schedule in self.schedules:
+            if schedule.start_anchor is None:
+                minutes.add(schedule.start)
+            if schedule.end_anchor is None:
+                minutes.add(schedule.end)
+        self.event_minutes = sorted(minutes)
+
+    def sun(self, day):
+        return self.solar.day(day) if self.solar else None
+
+    # day の開始・終了の分の索引（日の出・日の入り基準のタイマーがなければ固定の索引そのもの）
+    def event_minutes_for(self, day):
+        if not self.anchored:
+            return self.event_minutes
+        sun     = self.sun(day)
+        minutes = set(self.event_minutes)
+        for schedule in self.anchored:
+            window = resolve_schedule(schedule, sun)
+            if window:
+                minutes.update(window)
+        return sorted(minutes)
+
+    # 手動での切り替え等で実際の状態が変わった可能性がある時に呼ぶ
+    def invalidate(self):
+        self.actual = None
+
+    # 現在時刻のあるべき状態を反映し、切り替えたリレーを [(時刻, リレー番号, ＯＮ/ＯＦＦ), ...] で返す
+    def tick(self):
+        now, before, desired, care = self.target()
+        after, _ = apply_difference(self.board, before, desired, care)
+        return self.commit(now, before, after)
+
+    # 現在時刻と、現在のマスク・あるべきマスク・タイマーで制御するリレーのマスクを返す
+    # （ボードへの反映を別に行う場合（relay_stagger等）は、反映後に commit を呼ぶ）
+    def target(self):
+        now           = self.clock()
+        desired, care = desired_mask(self.schedules, now.hour * 60 + now.minute,
+                                     self.sun(now) if self.anchored else None)
+        if self.read_back or self.actual is None:
+            self.actual = self.board.get_mask()
+        return now, self.actual, desired, care
+
+    # 反映後のマスクを記録し、切り替えたリレーを返す
+    def commit(self, now, before, after):
+        self.actual      = after
+        changed          = before ^ self.actual
+        transitions      = []
+        for n in range(self.board.quantity_relay):
+            if changed & (1 << n):
+                transitions.append((now, n + 1, bool(self.actual & (1 << n))))
+        return transitions
+
+    # now の次に状態が変わりうる時刻（開始・終了のいずれかの分）を返す。設定がなければNone
+    def next_event(self, now):
+        base   = now.replace(second=0, microsecond=0)
+        minute = now.hour * 60 + now.minute
+        today  = self.event_minutes_for(now)
+        index  = bisect_right(today, minute)
+        if index < len(today):
+            return base + timedelta(minutes=today[index] - minute)
+        tomorrow = self.event_minutes_for(now + timedelta(days=1))
+        if not tomorrow:
+            return None
+        return base + timedelta(minutes=MINUTES_PER_DAY - minute + tomorrow[0])
@@ -0,0 +1,237 @@
+# シリアル（CH340等）接続のリレーボード
+# 「A0 <チャンネル> <状態> <チェックサム>」の4バイトのフレームで操作するUSBリレーモジュールを、
+# HIDリレーボードと同じメソッドで操作する。このボードは状態を返さないので、送信できた状態を記録しておく。
+# ポートは開いたままにし、送信はバックグラウンドで行う。同じチャンネルへの命令が送信前に
+# 溜まった場合は最後の状態だけを送る。
+# Linuxでは疑似端末（pty）を使ったシミュレーターでハードウェア無しに試験できる。
+#   python relay_serial.py --bench 10000
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+from relay_device import full_mask
+from relay_codec  import FRAME_HEAD, ResponseBuffer, encode_frame   # フレームは作っておいた表から引く
+from relay_log    import audit_mask
+
+logger = logging.getLogger("usb_relay.serial")
+
+class PosixSerialPort:
+    # pyserialが無い環境（Linux等）で termios を使ってポートを開くクラス
+    def __init__(self, port, baudrate):
+        import termios
+        import tty
+        self.fd = os.open(port, os.O_RDWR | os.O_NOCTTY)
+        tty.setraw(self.fd)
+        attrs = termios.tcgetattr(self.fd)
+        speed = getattr(termios, f"B{baudrate}")
+        attrs[4] = attrs[5] = speed
+        termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view):]
+
+    def close(self):
+        os.close(self.fd)
+
+def open_port(port, baudrate):
+    try:
+        import serial
+    except ImportError:
+        return PosixSerialPort(port, baudrate)
+    return serial.Serial(port, baudrate, timeout=1)
+
+class SerialRelayBoard:
+    # シリアル接続のリレーボードを操作するクラス
+    def __init__(self, port, quantity_relay=8, baudrate=9600):
+        self.port           = port
+        self.baudrate       = baudrate
+        self.quantity_relay = quantity_relay
+        self.mask           = 0         # ボードへの送信が終わった状態（送信に失敗したフレームは含まない）
+        self.serial         = None
+        self.pending        = {}        # 送信待ちの {チャンネル: 状態}（dictの順番が送信順）
+        self.frames_sent    = 0
+        self.frames_merged  = 0         # 送信前に上書きされて送らなかったフレーム数
+        self.condition      = threading.Condition()
+        self.thread         = None
+        self.stopped        = False
+        self.writing        = False
+
+    def open(self):
+        try:
+            self.serial = open_port(self.port, self.baudrate)
+        except (OSError, ValueError) as e:
+            logger.error("シリアルポート %s を開けません: %s", self.port, e)
+            return False
+        self.stopped = False
+        self.thread  = threading.Thread(target=self.run, name=f"SerialRelayBoard-{self.port}", daemon=True)
+        self.thread.start()
+        return True
+
+    def close(self):
+        if self.thread:
+            self.flush()
+            with self.condition:
+                self.stopped = True
+                self.condition.notify()
+            self.thread.join()
+            self.thread = None
+        if self.serial:
+            self.serial.close()
+            self.serial = None
+
+    # 送信待ちのフレームがすべて送信されるまで待つ
+    def flush(self, timeout=5.0):
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending and not self.writing, timeout)
+
+    def queue_state(self, channel, state):
+        with self.condition:
+            if channel in self.pending:
+                del self.pending[channel]      # 後の命令の順番で送る
+                self.frames_merged += 1
+            self.pending[channel] = state
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or self.stopped)
+                if not self.pending:
+                    return
+                states       = self.pending
+                frames       = b"".join(encode_frame(ch, st) for ch, st in states.items())
+                self.pending = {}
+                self.writing = True
+            started = time.perf_counter()
+            try:
+                self.serial.write(frames)
+                self.frames_sent += len(states)
+            except (OSError, ValueError) as e:
+                logger.error("シリアルポート %s への送信に失敗しました: %s", self.port, e)
+                for channel in states:
+                    audit_mask("serial", self.port, channel, self.mask, None, time.perf_counter() - started, error=str(e))
+            else:
+                latency = time.perf_counter() - started
+                for channel, state in states.items():
+                    old = self.mask
+                    if state:
+                        self.mask |= 1 << (channel - 1)
+                    else:
+                        self.mask &= ~(1 << (channel - 1))
+                    audit_mask("serial", self.port, channel, old, self.mask, latency, frames=len(states))
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+    def relay_on(self, relay_number):
+        self.queue_state(relay_number, 1)
+
+    def relay_off(self, relay_number):
+        self.queue_state(relay_number, 0)
+
+    def on_all(self):
+        for n in range(1, self.quantity_relay + 1):
+            self.queue_state(n, 1)
+
+    def off_all(self):
+        for n in range(1, self.quantity_relay + 1):
+            self.queue_state(n, 0)
+
+    # ボードは状態を返さないので、送信待ちのフレームを送り終えてから、送信できた状態を返す
+    def get_mask(self):
+        self.flush()
+        return self.mask & full_mask(self.quantity_relay)
+
+class PtyRelaySimulator:
+    # 疑似端末でシリアルリレーボードを再現するクラス（Linux等のPOSIX環境のみ）
+    # port_name のポートを SerialRelayBoard で開くと、このシミュレーターにフレームが届く
+    def __init__(self, quantity_relay=8):
+        import tty
+        self.quantity_relay = quantity_relay
+        self.mask           = 0
+        self.frames         = 0     # 受信した正しいフレーム数
+        self.errors         = 0     # チェックサム不正等で捨てたバイト数
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port_name      = os.ttyname(self.slave)
+        self.lock           = threading.Lock()
+        self.received       = threading.Condition(self.lock)
+        self.thread         = threading.Thread(target=self.run, name="PtyRelaySimulator", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        os.close(self.slave)
+        os.close(self.master)
+
+    def run(self):
+        buffer  = bytearray()
+        receive = ResponseBuffer()      # 受信のたびに bytes を作らず、同じバッファに読み込む
+        while True:
+            try:
+                data = receive.read_fd(self.master)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+            with self.lock:
+                while len(buffer) >= 4:
+                    if buffer[0] != FRAME_HEAD or (buffer[0] + buffer[1] + buffer[2]) & 0xFF != buffer[3]:
+                        del buffer[0]      # 次のフレームの先頭まで読み飛ばす
+                        self.errors += 1
+                        continue
+                    channel, state = buffer[1], buffer[2]
+                    if 1 <= channel <= self.quantity_relay:
+                        if state:
+                            self.mask |= 1 << (channel - 1)
+                        else:
+                            self.mask &= ~(1 << (channel - 1))
+                    self.frames += 1
+                    del buffer[:4]
+                self.received.notify_all()
+
+    # 受信したフレーム数が count になるまで待つ
+    def wait_frames(self, count, timeout=5.0):
+        with self.received:
+            return self.received.wait_for(lambda: self.frames >= count, timeout)
+
+#========メイン処理=========#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="シリアルリレーボード")
+    parser.add_argument("--port",     default=None, help="シリアルポート（省略時は疑似端末のシミュレーター）")
+    parser.add_argument("--quantity", type=int, default=8, help="リレー個数")
+    parser.add_argument("--bench",    type=int, default=1000, help="ＯＮ/ＯＦＦを切り替える回数")
+    args = parser.parse_args()
+
+    simulator = None
+    port      = args.port
+    if port is None:
+        simulator = PtyRelaySimulator(args.quantity)
+        port      = simulator.port_name
+    board = SerialRelayBoard(port, args.quantity)
+    if not board.open():
+        sys.exit(1)
+
+    started = time.perf_counter()
+    for i in range(args.bench):
+        n = i % args.quantity + 1
+        if (i // args.quantity) % 2 == 0:
+            board.relay_on(n)
+        else:
+            board.relay_off(n)
+    board.flush()
+    if simulator:
+        simulator.wait_frames(board.frames_sent)
+    elapsed = time.perf_counter() - started
+    print(f"命令 {args.bench}回  送信フレーム {board.frames_sent}  統合 {board.frames_merged}  "
+          f"処理時間 {elapsed:.3f}秒  ({args.bench / elapsed:,.0f} 命令/秒)")
+    if simulator:
+        print(f"シミュレーター  受信フレーム {simulator.frames}  不正 {simulator.errors}  "
+              f"状態 {simulator.mask:08b}  ボードの記録 {board.get_mask():08b}")
+    board.close()
+    if simulator:
+        simulator.close()
@@ -0,0 +1,114 @@
+# 共有メモリのステータスボード
+# コントローラーが各ボードの現在のマスク・あるべきマスク・更新番号・更新時刻をメモリマップファイルに書き出し、
+# 他のプロセス（画面、スクリプト、監視等）はデバイスを開かずにファイルを読むだけで状態を得られる。
+# 書き込み中かどうかは更新番号（奇数：書き込み中）で判定する（シーケンスロック）ので、
+# 読む側はロックもシステムコールも使わない（書き込み中に当たった場合だけ書き込み側に実行を譲って待つ）。
+#
+# ファイルの形式（リトルエンディアン）
+#   ヘッダー 16バイト : "RLYS" バージョン(uint16) ボード数(uint16) 予約(8バイト)
+#   ボードごと 32バイト: 更新番号(uint32) 現在のマスク(uint8) あるべきマスク(uint8) リレー個数(uint8) 予約(1バイト)
+#                        更新時刻(double UNIX時間) ボード名(16バイト UTF-8)
+import mmap
+import time
+import struct
+import threading
+
+MAGIC   = b"RLYS"
+VERSION = 1
+HEADER  = struct.Struct("<4sHH8x")
+SLOT    = struct.Struct("<IBBBxd16s")
+SEQ     = struct.Struct("<I")
+
+READ_TIMEOUT = 0.1   # 書き込み中のまま変わらない場合に待つ秒数（書き込んだプロセスが途中で止まった場合）
+
+def slot_offset(index):
+    return HEADER.size + index * SLOT.size
+
+# ボード名を 16バイトに収まるよう文字の区切りで切り詰める（書き込みと読み出しで同じ名前になる）
+def slot_name(name):
+    return name.encode("utf-8")[:16].decode("utf-8", "ignore")
+
+class StatusBoardWriter:
+    # ステータスボードに書き込むクラス（書き込むのはコントローラーの１プロセスだけ）
+    # boards は [(ボード名, リレー個数), ...]
+    def __init__(self, path, boards):
+        self.path  = path
+        self.names = {}
+        self.lock  = threading.Lock()
+        size = slot_offset(len(boards))
+        with open(path, "wb") as f:
+            f.write(b"\0" * size)
+        self.file  = open(path, "r+b")
+        self.map   = mmap.mmap(self.file.fileno(), size)
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, len(boards))
+        for index, (name, quantity_relay) in enumerate(boards):
+            self.names[name] = index
+            SLOT.pack_into(self.map, slot_offset(index), 0, 0, 0, quantity_relay, 0.0, slot_name(name).encode("utf-8"))
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    # ボードの状態を書き込む。省略したマスクは前の値のまま
+    def publish(self, name, current=None, desired=None):
+        offset = slot_offset(self.names[name])
+        with self.lock:
+            seq, old_current, old_desired, quantity_relay, _, raw_name = SLOT.unpack_from(self.map, offset)
+            SEQ.pack_into(self.map, offset, (seq + 1) & 0xFFFFFFFF)          # 奇数：書き込み中
+            SLOT.pack_into(self.map, offset, (seq + 1) & 0xFFFFFFFF,
+                           old_current if current is None else current & 0xFF,
+                           old_desired if desired is None else desired & 0xFF,
+                           quantity_relay, time.time(), raw_name)
+            SEQ.pack_into(self.map, offset, (seq + 2) & 0xFFFFFFFF)          # 偶数：書き込み完了
+
+    # StatusHubの変化イベントで現在のマスクを更新する
+    def attach(self, hub):
+        def on_change(event):
+            mask, _ = hub.pollers[event.board].snapshot()
+            if mask is not None and event.board in self.names:
+                self.publish(event.board, current=mask)
+        for name, poller in hub.pollers.items():
+            mask, _ = poller.snapshot()
+            if mask is not None and name in self.names:
+                self.publish(name, current=mask)
+        return hub.bus.subscribe(on_change)
+
+class StatusBoardReader:
+    # ステータスボードを読むクラス（何プロセスからでも読める）
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map  = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} はステータスボードのファイルではありません")
+        self.count = count
+        self.names = {}
+        for index in range(count):
+            raw_name = SLOT.unpack_from(self.map, slot_offset(index))[5]
+            self.names[raw_name.rstrip(b"\0").decode("utf-8", "ignore")] = index
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    # ボードの状態を一貫した値で読む
+    # 戻り値 {"seq", "current", "desired", "quantity_relay", "updated"}
+    # timeout 秒たっても読めない（書き込み中のまま）場合はNoneを返す
+    def read(self, name, timeout=READ_TIMEOUT):
+        offset   = slot_offset(self.names[slot_name(name)])
+        deadline = None
+        while True:
+            seq = SEQ.unpack_from(self.map, offset)[0]
+            if not seq & 1:         # 奇数は書き込み中なので読み直す
+                _, current, desired, quantity_relay, updated, _ = SLOT.unpack_from(self.map, offset)
+                if SEQ.unpack_from(self.map, offset)[0] == seq:     # 読んでいる間に書き込まれていなければ確定
+                    return {"seq": seq // 2, "current": current, "desired": desired,
+                            "quantity_relay": quantity_relay, "updated": updated}
+            if deadline is None:
+                deadline = time.monotonic() + timeout
+            elif time.monotonic() > deadline:
+                return None
+            time.sleep(0)           # 書き込み側に実行を譲る
+
+    def read_all(self):
+        return {name: self.read(name) for name in self.names}
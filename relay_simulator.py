@@ -0,0 +1,117 @@
+# タイマーのシミュレーター
+# 実際のスケジュールエンジン（relay_schedule.ScheduleEngine）を仮想の時計とシミュレーションボードで動かし、
+# １日～１年分のリレーの切り替えを数秒で確認する。
+# 判定が必要な時刻（開始・終了の分）だけに時計を進めるので、待ち時間は発生しない。
+import sys
+import csv
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+from relay_device import SimulatedRelayBoard
+from relay_schedule import ScheduleEngine, schedules_from_data
+from relay_solar import SolarCalendar
+
+class SimulatedClock:
+    # 差し替え用の仮想の時計　clock() で現在の仮想時刻を返す
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def set(self, now):
+        self.now = now
+
+    def advance(self, minutes=1):
+        self.now += timedelta(minutes=minutes)
+
+class ScheduleSimulator:
+    # 複数ボードのタイマー設定を仮想の時計で動かすクラス
+    # solar（relay_solar.SolarCalendar）は日の出・日の入り基準のタイマーに使う
+    def __init__(self, start, solar=None):
+        self.clock   = SimulatedClock(start.replace(second=0, microsecond=0))
+        self.solar   = solar
+        self.engines = []   # [(ボード名, エンジン), ...]
+
+    # ボードを追加する　loaded_data は AutoLoadData.load_data() の形式
+    def add_board(self, name, loaded_data, board=None):
+        board  = board or SimulatedRelayBoard(len(loaded_data))
+        engine = ScheduleEngine(board, schedules_from_data(loaded_data), clock=self.clock, solar=self.solar)
+        self.engines.append((name, engine))
+        return engine
+
+    # 仮想時刻を minutes 分進めながらタイマー判定を行い、切り替えの一覧と実行結果を返す
+    # every_minute=True の場合は、判定のない分も含めて1分ずつ進める
+    def run(self, minutes, every_minute=False):
+        start    = self.clock.now
+        end      = start + timedelta(minutes=minutes)
+        timeline = []
+        ticks    = 0
+        began    = time.perf_counter()
+        now      = start
+        while now < end:
+            self.clock.set(now)
+            for name, engine in self.engines:
+                for when, relay_number, on in engine.tick():
+                    timeline.append((when, name, relay_number, on))
+            ticks += 1
+            if every_minute:
+                now += timedelta(minutes=1)
+            else:
+                following = [engine.next_event(now) for _, engine in self.engines]
+                following = [t for t in following if t is not None]
+                if not following:
+                    break
+                now = min(following)
+        elapsed = time.perf_counter() - began
+        self.clock.set(end)
+        result = {
+            "simulated_minutes": minutes,
+            "ticks":             ticks,
+            "transitions":       len(timeline),
+            "elapsed":           elapsed,
+            "minutes_per_second": minutes / elapsed if elapsed > 0 else float("inf"),
+        }
+        return timeline, result
+
+#========メイン処理=========#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="タイマー設定のシミュレーター")
+    parser.add_argument("data_files", nargs="+",  help="リレーデータのjson（ボードごとに1ファイル）")
+    parser.add_argument("--start",   default=None, help="開始日時 例: 2026-01-01T00:00（省略時は現在時刻）")
+    parser.add_argument("--days",    type=float, default=1, help="シミュレーションする日数")
+    parser.add_argument("--every-minute", action="store_true", help="1分ずつ判定する")
+    parser.add_argument("--csv",     default=None, help="切り替えの一覧を保存するCSVファイル")
+    parser.add_argument("--quiet",   action="store_true", help="切り替えの一覧を表示しない")
+    parser.add_argument("--latitude",   type=float, default=None, help="日の出・日の入りを計算する場所の緯度")
+    parser.add_argument("--longitude",  type=float, default=None, help="日の出・日の入りを計算する場所の経度")
+    parser.add_argument("--utc-offset", type=float, default=None, help="UTCとの時差（時間）。省略時はこのPCの設定")
+    args = parser.parse_args()
+
+    solar = None
+    if args.latitude is not None and args.longitude is not None:
+        solar = SolarCalendar(args.latitude, args.longitude, args.utc_offset)
+    start     = datetime.fromisoformat(args.start) if args.start else datetime.now()
+    simulator = ScheduleSimulator(start, solar)
+    for data_file in args.data_files:
+        try:
+            with open(data_file, "r") as f:
+                simulator.add_board(data_file, json.load(f))
+        except (OSError, json.JSONDecodeError, KeyError, ValueError) as e:
+            print(f"ファイル '{data_file}' を読み込めませんでした: {e}")
+            sys.exit(1)
+
+    timeline, result = simulator.run(int(args.days * 24 * 60), every_minute=args.every_minute)
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["time", "board", "relay", "state"])
+            for when, name, relay_number, on in timeline:
+                writer.writerow([when.isoformat(), name, relay_number, "on" if on else "off"])
+    if not args.quiet:
+        for when, name, relay_number, on in timeline:
+            print(f"{when:%Y-%m-%d %H:%M}  {name}  リレー{relay_number}  {'ＯＮ' if on else 'ＯＦＦ'}")
+    print(f"仮想時間 {result['simulated_minutes']}分  判定 {result['ticks']}回  切り替え {result['transitions']}回  "
+          f"処理時間 {result['elapsed']:.3f}秒  ({result['minutes_per_second']:,.0f} 仮想分/秒)")
@@ -0,0 +1,117 @@
+# 日の出・日の入りの時刻表
+# 照明のリレーを日の出・日の入りを基準（前後のずらし付き）にＯＮ/ＯＦＦするために、
+# 設定した場所の１年分の日の出・日の入りの時刻（0時0分からの経過分）を一度だけ計算して表にしておく。
+# タイマー判定のたびに天文計算をせず、表から日付で引くだけで済む。
+# 計算はNOAAの近似式（誤差は数分程度）で、大気差を含む太陽高度 -0.833度で判定する。
+#   python relay_solar.py --latitude 35.68 --longitude 139.77
+import math
+import argparse
+from array import array
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+SUNRISE = "sunrise"
+SUNSET  = "sunset"
+ANCHORS = (SUNRISE, SUNSET)
+
+# 1日中日が沈まない（白夜）・昇らない（極夜）日の扱い
+# 白夜は 0時～24時、極夜は正午に日の出と日の入りが重なる（ＯＮの時間帯なし）とみなす
+POLAR_DAY   = (0, 24 * 60)
+POLAR_NIGHT = (12 * 60, 12 * 60)
+
+# UTCの0時からの経過分で日の出・日の入りを返す
+def solar_times_utc(day_of_year, latitude, longitude):
+    gamma    = 2 * math.pi / 365 * (day_of_year - 1)
+    eqtime   = 229.18 * (0.000075 + 0.001868 * math.cos(gamma) - 0.032077 * math.sin(gamma)
+                         - 0.014615 * math.cos(2 * gamma) - 0.040849 * math.sin(2 * gamma))
+    decl     = (0.006918 - 0.399912 * math.cos(gamma) + 0.070257 * math.sin(gamma)
+                - 0.006758 * math.cos(2 * gamma) + 0.000907 * math.sin(2 * gamma)
+                - 0.002697 * math.cos(3 * gamma) + 0.00148  * math.sin(3 * gamma))
+    lat      = math.radians(latitude)
+    cos_ha   = (math.cos(math.radians(90.833)) / (math.cos(lat) * math.cos(decl))
+                - math.tan(lat) * math.tan(decl))
+    if cos_ha < -1:
+        return None, POLAR_DAY
+    if cos_ha > 1:
+        return None, POLAR_NIGHT
+    ha       = math.degrees(math.acos(cos_ha))
+    return (720 - 4 * (longitude + ha) - eqtime, 720 - 4 * (longitude - ha) - eqtime), None
+
+# その日のUTCとの時差（分）。utc_offset（時間）を省略した場合はこのPCの地域設定（夏時間を含む）に従う
+def offset_minutes(day, utc_offset):
+    if utc_offset is not None:
+        return round(utc_offset * 60)
+    noon = datetime(day.year, day.month, day.day, 12).astimezone()
+    return round(noon.utcoffset().total_seconds() / 60)
+
+class SolarTable:
+    # １年分の日の出・日の入りの表
+    # times には日付順に 日の出, 日の入り, 日の出, 日の入り, ... を0時0分からの経過分で入れる（366日分）
+    def __init__(self, latitude, longitude, year, utc_offset=None):
+        self.latitude   = latitude
+        self.longitude  = longitude
+        self.year       = year
+        self.utc_offset = utc_offset
+        self.times      = array("H")
+        first = date(year, 1, 1)
+        days  = (date(year + 1, 1, 1) - first).days
+        for n in range(days):
+            day   = first + timedelta(days=n)
+            utc, polar = solar_times_utc(n + 1, latitude, longitude)
+            if polar:
+                sunrise, sunset = polar
+            else:
+                offset  = offset_minutes(day, utc_offset)
+                sunrise = min(max(round(utc[0] + offset), 0), 24 * 60)
+                sunset  = min(max(round(utc[1] + offset), 0), 24 * 60)
+            self.times.append(sunrise)
+            self.times.append(sunset)
+
+    # day（date または datetime）の (日の出, 日の入り) を返す
+    def day(self, day):
+        index = (day.timetuple().tm_yday - 1) * 2
+        return self.times[index], self.times[index + 1]
+
+class SolarCalendar:
+    # 年をまたいでも使えるように、年ごとの表を必要になった時に作って返すクラス
+    def __init__(self, latitude, longitude, utc_offset=None):
+        self.latitude   = latitude
+        self.longitude  = longitude
+        self.utc_offset = utc_offset
+
+    def day(self, day):
+        return solar_table(self.latitude, self.longitude, day.year, self.utc_offset).day(day)
+
+# 同じ場所・同じ年の表は１回だけ作る
+@lru_cache(maxsize=8)
+def solar_table(latitude, longitude, year, utc_offset=None):
+    return SolarTable(latitude, longitude, year, utc_offset)
+
+# 設定ファイル（settings.json）の "latitude", "longitude", "utc_offset"（省略可）から作る
+# 場所が設定されていなければNoneを返す
+def calendar_from_settings(settings):
+    try:
+        latitude  = float(settings["latitude"])
+        longitude = float(settings["longitude"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    utc_offset = settings.get("utc_offset")
+    if utc_offset in (None, ""):
+        utc_offset = None
+    else:
+        utc_offset = float(utc_offset)
+    return SolarCalendar(latitude, longitude, utc_offset)
+
+#========メイン処理=========#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="日の出・日の入りの時刻表")
+    parser.add_argument("--latitude",   type=float, required=True, help="緯度（北緯が正）")
+    parser.add_argument("--longitude",  type=float, required=True, help="経度（東経が正）")
+    parser.add_argument("--utc-offset", type=float, default=None,  help="UTCとの時差（時間）。省略時はこのPCの設定")
+    parser.add_argument("--year",       type=int,   default=date.today().year)
+    args = parser.parse_args()
+
+    table = solar_table(args.latitude, args.longitude, args.year, args.utc_offset)
+    for month in range(1, 13):
+        sunrise, sunset = table.day(date(args.year, month, 1))
+        print(f"{args.year}-{month:02d}-01  日の出 {sunrise // 60:2d}:{sunrise % 60:02d}  日の入り {sunset // 60:2d}:{sunset % 60:02d}")
@@ -0,0 +1,130 @@
+# リレーＯＮの時差実行（突入電流の抑制）
+# 全ＯＮや、同じ分に開始するタイマーで多数のリレーが同時にＯＮになると、共通の電源に突入電流が重なる。
+# 同時にＯＮにするリレーを、ボード内・ボード間で順番に stagger 秒ずつずらしてＯＮにする。
+# 全体が deadline 秒を超える場合は間隔を詰めて、必ず deadline 秒以内に終わらせる。
+# ＯＦＦは突入電流が無いので、ずらさずにすぐ行う。
+# HIDリレーボードには複数リレーを指定するレポートが無いので、ずらしても1リレー1レポートのまま
+# （ずらさない場合と同じ数）で、ボードの残りをまとめてＯＮにすると全ＯＮになる場合は全ＯＮの1レポートにまとめる。
+#   python relay_stagger.py --boards 4 --stagger 0.05 --deadline 1.0
+import math
+import time
+import argparse
+from relay_device import SimulatedRelayBoard, apply_difference, full_mask
+
+# count 個のＯＮを何秒後に行うかのリストを返す
+# 同時に simultaneous 個までＯＮにしてよい。間隔は stagger 秒、全体が deadline 秒を超える場合は詰める
+def stagger_offsets(count, stagger, deadline=None, simultaneous=1):
+    steps = math.ceil(count / simultaneous) if count else 0
+    if steps > 1 and deadline is not None:
+        stagger = min(stagger, deadline / (steps - 1))
+    return [(n // simultaneous) * stagger for n in range(count)]
+
+# {ボード名: ＯＮにするリレー番号のリスト} をボードが交互になるように並べ、[(ボード名, リレー番号), ...] にする
+def interleave(switch_on):
+    order  = []
+    queues = [(name, list(relays)) for name, relays in switch_on.items() if relays]
+    while queues:
+        for name, relays in queues:
+            order.append((name, relays.pop(0)))
+        queues = [(name, relays) for name, relays in queues if relays]
+    return order
+
+class StaggeredSequencer:
+    # 複数ボードのあるべき状態への切り替えを、ＯＮをずらしながら行うクラス
+    # boards は {ボード名: ボード}。sleep と clock は試験用に差し替えられる
+    def __init__(self, boards, stagger=0.2, deadline=2.0, simultaneous=1, sleep=time.sleep, clock=time.monotonic):
+        self.boards       = boards
+        self.stagger      = stagger
+        self.deadline     = deadline
+        self.simultaneous = simultaneous
+        self.sleep        = sleep
+        self.clock        = clock
+
+    # 切り替えの予定を作る
+    # changes は {ボード名: (現在のマスク, あるべきマスク, 対象のマスク)}（対象のマスクはNoneで全リレー）
+    # 戻り値は ({ボード名: ＯＦＦだけ反映したマスク}, {ボード名: 切り替え後のマスク}, [(秒, ボード名, [リレー番号, ...]), ...],
+    #           {ボード名: 送信に使うボード})
+    # インターロック付きのボードは切り替え後のマスク全体を１回だけ確認し、必要とされるリレーを先にＯＮにする
+    def plan(self, changes):
+        after_off = {}
+        targets   = {}
+        switch_on = {}
+        writers   = {}
+        for name, (actual, desired, care) in changes.items():
+            board  = self.boards[name]
+            order  = range(board.quantity_relay)
+            full   = full_mask(board.quantity_relay)
+            care   = full if care is None else care & full
+            target = (actual & ~care | desired & care) & full
+            if target != actual and hasattr(board, "plan"):
+                target, board, order = board.plan(actual, target, actual ^ target)
+            writers[name]   = board
+            targets[name]   = target
+            after_off[name] = actual & target
+            turn_on         = target & ~actual
+            switch_on[name] = [n + 1 for n in order if turn_on & (1 << n)]
+        order   = interleave(switch_on)
+        offsets = stagger_offsets(len(order), self.stagger, self.deadline, self.simultaneous)
+        grouped = {}       # 同じ時刻に同じボードでＯＮにするリレーは１つの手順にまとめる
+        for offset, (name, relay_number) in zip(offsets, order):
+            grouped.setdefault((offset, name), []).append(relay_number)
+        steps   = [(offset, name, relays) for (offset, name), relays in grouped.items()]
+        return after_off, targets, steps, writers
+
+    # 切り替えを実行し、{ボード名: 切り替え後のマスク} と送信したレポート数を返す
+    def apply(self, changes):
+        after_off, targets, steps, writers = self.plan(changes)
+        reports = 0
+        masks   = {}
+        for name, (actual, _, _) in changes.items():
+            masks[name], sent = apply_difference(writers[name], actual, after_off[name])
+            reports += sent
+        started = self.clock()
+        for offset, name, relays in steps:
+            wait = started + offset - self.clock()
+            if wait > 0:
+                self.sleep(wait)
+            board = writers[name]
+            full  = full_mask(board.quantity_relay)
+            bits  = sum(1 << (n - 1) for n in relays)
+            if len(relays) > 1 and masks[name] | bits == full:
+                board.on_all()       # 残りをまとめてＯＮにすると全ＯＮになる場合は１レポートにまとめる
+                reports += 1
+            else:
+                for relay_number in relays:
+                    board.relay_on(relay_number)
+                    reports += 1
+            masks[name] |= bits
+        return masks, reports
+
+# 複数のスケジュールエンジン（relay_schedule.ScheduleEngine）のタイマー判定をまとめて行い、
+# 同じ分に重なったＯＮをボード間でずらす。engines は {ボード名: エンジン}（sequencer.boards と同じボード名）
+# 戻り値は [(時刻, ボード名, リレー番号, ＯＮ/ＯＦＦ), ...]
+def tick_all(engines, sequencer):
+    pending = {name: engine.target() for name, engine in engines.items()}
+    masks, _ = sequencer.apply({name: (before, desired, care) for name, (_, before, desired, care) in pending.items()})
+    timeline = []
+    for name, (now, before, _, _) in pending.items():
+        for when, relay_number, on in engines[name].commit(now, before, masks[name]):
+            timeline.append((when, name, relay_number, on))
+    return timeline
+
+#========メイン処理=========#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="リレーＯＮの時差実行")
+    parser.add_argument("--boards",       type=int,   default=4,   help="シミュレーションボードの枚数")
+    parser.add_argument("--quantity",     type=int,   default=8,   help="ボードごとのリレー個数")
+    parser.add_argument("--stagger",      type=float, default=0.1, help="ＯＮの間隔（秒）")
+    parser.add_argument("--deadline",     type=float, default=2.0, help="全部ＯＮにし終えるまでの上限（秒）")
+    parser.add_argument("--simultaneous", type=int,   default=1,   help="同時にＯＮにしてよいリレー数")
+    args = parser.parse_args()
+
+    boards    = {f"board{n + 1}": SimulatedRelayBoard(args.quantity) for n in range(args.boards)}
+    sequencer = StaggeredSequencer(boards, args.stagger, args.deadline, args.simultaneous)
+    _, _, steps, _ = sequencer.plan({name: (0, full_mask(args.quantity), None) for name in boards})
+    for offset, name, relays in steps:
+        print(f"{offset:7.3f}秒  {name}  リレー{','.join(map(str, relays))}")
+    started = time.perf_counter()
+    masks, reports = sequencer.apply({name: (0, full_mask(args.quantity), None) for name in boards})
+    print(f"所要時間 {time.perf_counter() - started:.3f}秒  レポート {reports}  "
+          f"状態 {'  '.join(f'{name}:{mask:0{args.quantity}b}' for name, mask in masks.items())}")
@@ -0,0 +1,157 @@
+# リレーの状態のライブ配信（Server-Sent Events）
+# 接続したクライアントには最初に全ボードのスナップショットを送り、その後は変化イベントだけを送る。
+# 配信はStatusHubのイベントを使うので、閲覧者が増えてもデバイスの読み込み回数は増えない。
+# 受け取りの遅いクライアントはバッファが一杯になった時点で切断する。
+#   GET /events  : イベントストリーム（text/event-stream）
+#   GET /status  : 現在のスナップショット（json）
+import sys
+import json
+import threading
+from collections import deque
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from relay_device import SimulatedRelayBoard
+from relay_events import StatusHub
+
+HEARTBEAT_INTERVAL = 15     # 無通信時に接続維持のコメントを送る間隔（秒）
+CLIENT_BUFFER      = 256    # クライアントごとに溜めておけるイベント数
+
+# StatusHubのスナップショットをjsonで送れる形にする
+def snapshot_json(hub):
+    boards = {}
+    for name, (mask, updated) in hub.snapshot().items():
+        quantity_relay = hub.pollers[name].board.quantity_relay
+        boards[name] = {
+            "mask":      mask,
+            "relays":    None if mask is None else [bool(mask & (1 << n)) for n in range(quantity_relay)],
+            "timestamp": updated,
+        }
+    return boards
+
+def event_json(event):
+    return {"board": event.board, "relay": event.relay, "old": event.old, "new": event.new,
+            "source": event.source, "timestamp": event.timestamp}
+
+class StreamClient:
+    # クライアント１つ分の送信待ちバッファ
+    def __init__(self, size=CLIENT_BUFFER):
+        self.size      = size
+        self.events    = deque()
+        self.evicted   = False
+        self.condition = threading.Condition()
+
+    # EventBusから呼ばれる。バッファが一杯なら遅いクライアントとして切断扱いにする
+    def push(self, event):
+        with self.condition:
+            if len(self.events) >= self.size:
+                self.evicted = True
+                self.events.clear()
+            elif not self.evicted:
+                self.events.append(event)
+            self.condition.notify()
+
+    # 溜まっているイベントをすべて取り出す。timeout 秒待っても無ければ空のリストを返す
+    def take(self, timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: self.events or self.evicted, timeout)
+            events = list(self.events)
+            self.events.clear()
+            return events
+
+class StreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass   # アクセスごとの標準エラー出力はしない
+
+    def do_GET(self):
+        if self.path == "/events":
+            self.stream_events()
+        elif self.path == "/status":
+            body = json.dumps(snapshot_json(self.server.hub), ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_error(404)
+
+    def send_event(self, name, data):
+        self.wfile.write(f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    def stream_events(self):
+        hub    = self.server.hub
+        client = StreamClient(self.server.client_buffer)
+        # スナップショットの前に購読して、その間の変化を取りこぼさないようにする
+        token  = hub.bus.subscribe(client.push)
+        self.server.clients.add(client)
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.send_event("snapshot", snapshot_json(hub))
+            self.wfile.flush()
+            while not self.server.closing:
+                events = client.take(HEARTBEAT_INTERVAL)
+                if client.evicted:
+                    break   # 遅いクライアントとして切断
+                if not events:
+                    self.wfile.write(b": keepalive\n\n")
+                for event in events:
+                    self.send_event("change", event_json(event))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            hub.bus.unsubscribe(token)
+            self.server.clients.discard(client)
+            self.close_connection = True
+
+class StreamServer(ThreadingHTTPServer):
+    # StatusHubのイベントを配信するHTTPサーバー
+    daemon_threads = True
+
+    def __init__(self, address, hub, client_buffer=CLIENT_BUFFER):
+        super().__init__(address, StreamHandler)
+        self.hub           = hub
+        self.client_buffer = client_buffer
+        self.clients       = set()
+        self.closing       = False
+
+    def server_close(self):
+        self.closing = True
+        super().server_close()
+
+#========メイン処理=========#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="リレーの状態のライブ配信")
+    parser.add_argument("--host",     default="127.0.0.1")
+    parser.add_argument("--port",     type=int, default=8080)
+    parser.add_argument("--broker",   default=None, help="ブローカーのソケット（指定しない場合はシミュレーションボード）")
+    parser.add_argument("--quantity", type=int, default=8, help="リレー個数")
+    args = parser.parse_args()
+
+    hub = StatusHub()
+    if args.broker:
+        from relay_broker import RelayBrokerClient
+        try:
+            board = RelayBrokerClient(args.broker, args.quantity)
+        except OSError as e:
+            print(f"ブローカーに接続できません: {e}")
+            sys.exit(1)
+    else:
+        board = SimulatedRelayBoard(args.quantity)
+    hub.add_board("board1", board)
+
+    server = StreamServer((args.host, args.port), hub)
+    print(f"配信を開始しました: http://{args.host}:{args.port}/events")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        hub.stop()
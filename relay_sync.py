@@ -0,0 +1,227 @@
+# 複数ボードの同時切り替え（同期実行）と時差の計測
+# 照明の演出や試験の手順では、別々のボードのリレーをできるだけ同じ瞬間に切り替えたい。
+# ボードを順番に操作すると、ボードごとの送信時間の分だけ切り替えが数十ミリ秒ばらける。
+# SyncGroup はボードごとに送信専用のスレッドを持ち、各スレッドに送信する操作を先に渡しておき（段取り）、
+# 全スレッドの準備ができたところで同じ時刻に一斉に送信させる。
+# 操作のたびに、ボード間の送信開始・切り替え（最初のレポートの送信完了）の時差を計測して記録する。
+#   python relay_sync.py --boards 4 --latency 0.002 --rounds 50
+import time
+import logging
+import argparse
+import threading
+from collections import deque, namedtuple
+from relay_device import SimulatedRelayBoard, difference_steps
+
+logger = logging.getLogger("usb_relay.sync")
+
+# 同期実行１回の結果
+#   masks       : {ボード名: 切り替え後のマスク}
+#   reports     : 送信したレポート数の合計
+#   start_skew  : ボード間の送信開始の時差（秒）
+#   switch_skew : ボード間の切り替え（最初のレポートの送信完了）の時差（秒）
+#   duration    : 一斉送信の開始から全ボードの送信完了まで（秒）
+#   errors      : {ボード名: エラー}（待ち合わせが時間切れの場合はどのボードも送信しない）
+SyncResult = namedtuple("SyncResult", "masks reports start_skew switch_skew duration errors")
+
+# 指定した時刻まで待つ。最後の spin 秒は sleep せずに時計を見続けて、起床の遅れを無くす
+def wait_until(deadline, spin=0.001, clock=time.perf_counter):
+    remaining = deadline - clock()
+    if remaining > spin:
+        time.sleep(remaining - spin)
+    while clock() < deadline:
+        pass
+
+class SyncOperation:
+    # 複数のボードで一斉に実行する１回分の操作
+    # steps は {ボード名: [(ボードのメソッド, 引数), ...]}
+    def __init__(self, steps, lead=0.002, timeout=1.0, clock=time.perf_counter):
+        self.steps      = steps
+        self.lead       = lead
+        self.clock      = clock
+        self.release_at = None
+        self.times      = {}       # {ボード名: (送信開始, 最初の送信完了, 送信完了)}
+        self.errors     = {}
+        self.lock       = threading.Lock()
+        self.remaining  = len(steps)
+        self.done       = threading.Event()
+        # 全ボードのスレッドがそろったら、少し先（lead 秒後）の同じ時刻を送信開始にする
+        self.barrier    = threading.Barrier(len(steps), action=self.release, timeout=timeout)
+        if not steps:
+            self.done.set()
+
+    def release(self):
+        self.release_at = self.clock() + self.lead
+
+    # ボードのスレッドから呼ばれる
+    def run(self, name):
+        try:
+            self.barrier.wait()
+        except threading.BrokenBarrierError:
+            self.finish(name, error="同期の待ち合わせが時間切れになりました")
+            return
+        wait_until(self.release_at, clock=self.clock)
+        started = first = self.clock()
+        try:
+            for index, (method, args) in enumerate(self.steps[name]):
+                method(*args)
+                if index == 0:
+                    first = self.clock()
+        except Exception as e:
+            self.finish(name, (started, first, self.clock()), str(e))
+            return
+        self.finish(name, (started, first, self.clock()))
+
+    def finish(self, name, times=None, error=None):
+        with self.lock:
+            if times:
+                self.times[name] = times
+            if error:
+                self.errors[name] = error
+            self.remaining -= 1
+            if not self.remaining:
+                self.done.set()
+
+class SyncWorker:
+    # ボード１枚を専有し、渡された操作を順番に実行するスレッド
+    def __init__(self, name, board):
+        self.name      = name
+        self.board     = board
+        self.jobs      = deque()
+        self.condition = threading.Condition()
+        self.stopped   = False
+        self.thread    = threading.Thread(target=self.run, name=f"SyncWorker-{name}", daemon=True)
+        self.thread.start()
+
+    def stage(self, operation):
+        with self.condition:
+            self.jobs.append(operation)
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.jobs or self.stopped)
+                if not self.jobs:
+                    return
+                operation = self.jobs.popleft()
+            operation.run(self.name)
+
+class SyncGroup:
+    # 複数ボードを同期して切り替えるクラス
+    # boards は {ボード名: ボード}。lead は全ボードの準備がそろってから送信を始めるまでの秒数、
+    # timeout は全ボードの準備がそろうのを待つ上限（どれかのボードが前の送信で止まっている場合）
+    # send_timeout は一斉送信を始めてから全ボードの送信が終わるのを待つ上限
+    # apply() は StaggeredSequencer.apply() と同じ引数・戻り値なので、relay_stagger.tick_all にも渡せる
+    def __init__(self, boards, lead=0.002, timeout=1.0, send_timeout=1.0, window=1000, clock=time.perf_counter):
+        self.boards       = boards
+        self.lead         = lead
+        self.timeout      = timeout
+        self.send_timeout = send_timeout
+        self.clock        = clock
+        self.workers      = {name: SyncWorker(name, board) for name, board in boards.items()}
+        self.skews        = deque(maxlen=window)    # 最近の切り替えの時差
+        self.worst        = 0.0
+        self.count        = 0
+        self.last         = None                    # 最後の SyncResult
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.close()
+
+    # changes は {ボード名: (現在のマスク, あるべきマスク, 対象のマスク)}（対象のマスクはNoneで全リレー）
+    # 戻り値は ({ボード名: 切り替え後のマスク}, 送信したレポート数)。時差等は self.last に残す
+    def apply(self, changes):
+        masks = {}
+        steps = {}
+        for name, (actual, desired, care) in changes.items():
+            masks[name], board_steps = difference_steps(self.boards[name], actual, desired, care)
+            if board_steps:
+                steps[name] = board_steps
+        operation = SyncOperation(steps, self.lead, self.timeout, self.clock)
+        for name in steps:
+            self.workers[name].stage(operation)
+        if not operation.done.wait(self.timeout + self.lead + self.send_timeout):
+            # 止まったままのボードは待たずに、終わっていないボードを失敗として扱う
+            with operation.lock:
+                for name in steps:
+                    if name not in operation.times and name not in operation.errors:
+                        operation.errors[name] = "送信が時間内に終わりませんでした"
+        if operation.errors:
+            # 送信できなかったボードは元のマスクのままとする
+            for name in operation.errors:
+                masks[name] = changes[name][0]
+            logger.error("同期切り替えに失敗したボードがあります: %s", operation.errors)
+        return masks, self.measure(operation, masks).reports
+
+    def measure(self, operation, masks):
+        with operation.lock:
+            times  = list(operation.times.values())
+            errors = dict(operation.errors)
+        if times:
+            starts      = [t[0] for t in times]
+            firsts      = [t[1] for t in times]
+            start_skew  = max(starts) - min(starts)
+            switch_skew = max(firsts) - min(firsts)
+            duration    = max(t[2] for t in times) - min(starts)
+        else:
+            start_skew = switch_skew = duration = 0.0
+        reports = sum(len(operation.steps[name]) for name in operation.times if name not in errors)
+        self.last = SyncResult(dict(masks), reports, start_skew, switch_skew, duration, errors)
+        if len(times) > 1:
+            self.count += 1
+            self.worst  = max(self.worst, switch_skew)
+            self.skews.append(switch_skew)
+            logger.debug("同期切り替え  ボード %d枚  開始の時差 %.3fms  切り替えの時差 %.3fms",
+                         len(times), start_skew * 1000, switch_skew * 1000)
+        return self.last
+
+    # 最近の切り替えの時差（秒）の統計
+    def metrics(self):
+        recent = sorted(self.skews)
+        def pick(p):
+            return recent[min(len(recent) - 1, int(len(recent) * p / 100))] if recent else 0.0
+        return {"count": self.count, "p50": pick(50), "p99": pick(99), "worst": self.worst}
+
+# 比較用：ボードを順番に操作した場合の切り替えの時差（秒）
+def sequential_skew(boards, changes, clock=time.perf_counter):
+    firsts = []
+    for name, (actual, desired, care) in changes.items():
+        _, steps = difference_steps(boards[name], actual, desired, care)
+        for index, (method, args) in enumerate(steps):
+            method(*args)
+            if index == 0:
+                firsts.append(clock())
+    return max(firsts) - min(firsts) if len(firsts) > 1 else 0.0
+
+#========メイン処理=========#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="複数ボードの同時切り替え（シミュレーションボードで時差を計測）")
+    parser.add_argument("--boards",   type=int,   default=4,     help="シミュレーションボードの枚数")
+    parser.add_argument("--quantity", type=int,   default=8,     help="ボードごとのリレー個数")
+    parser.add_argument("--latency",  type=float, default=0.002, help="シミュレーションボードの送信時間（秒）")
+    parser.add_argument("--rounds",   type=int,   default=50,    help="切り替えの回数")
+    parser.add_argument("--lead",     type=float, default=0.002, help="準備がそろってから送信するまで（秒）")
+    args = parser.parse_args()
+
+    boards = {f"board{n + 1}": SimulatedRelayBoard(args.quantity, latency=args.latency) for n in range(args.boards)}
+
+    # 全ボードでリレー1を交互に切り替える
+    def changes_for(round_number):
+        desired = 1 if round_number % 2 == 0 else 0
+        return {name: (board.mask, desired, 1) for name, board in boards.items()}
+
+    sequential = sorted(sequential_skew(boards, changes_for(n)) for n in range(args.rounds))
+    group      = SyncGroup(boards, args.lead)
+    for n in range(args.rounds):
+        group.apply(changes_for(n))
+    group.close()
+    metrics = group.metrics()
+    print(f"順番に操作  切り替えの時差 p50 {sequential[len(sequential) // 2] * 1000:7.3f}ms  最大 {sequential[-1] * 1000:7.3f}ms")
+    print(f"同期実行    切り替えの時差 p50 {metrics['p50'] * 1000:7.3f}ms  p99 {metrics['p99'] * 1000:7.3f}ms  "
+          f"最大 {metrics['worst'] * 1000:7.3f}ms  （{metrics['count']}回）")
@@ -0,0 +1,95 @@
+# 画面（tkinter）のイベントループの遅延監視と、時計に合わせた定期処理
+# root.after(1000, ...) で毎回1秒後に呼び直すと、処理時間の分だけ少しずつ遅れていく。
+# AlignedTicker は毎回「次の区切り（毎秒0ミリ秒・毎分0秒）」までの時間を計算して呼び直すので遅れが溜まらない。
+# 予定の時刻と実際に呼ばれた時刻の差（遅延）を LagMonitor に記録し、HID通信等の長い処理で
+# 画面が止まっていたことを数値と画面の表示で分かるようにする。
+# tkinter には依存せず、after に root.after を渡して使う。
+import math
+import time
+import logging
+from collections import deque
+
+logger = logging.getLogger("usb_relay.tk")
+
+class LagMonitor:
+    # 定期処理の遅延（秒）を記録するクラス
+    # threshold 秒を超えた遅延は警告としてログに記録する
+    def __init__(self, window=300, threshold=0.25):
+        self.samples   = deque(maxlen=window)   # 最近の遅延
+        self.threshold = threshold
+        self.last      = 0.0
+        self.worst     = 0.0                    # 起動してからの最大
+        self.late      = 0                      # threshold を超えた回数
+        self.count     = 0
+
+    def record(self, name, lag):
+        lag        = max(lag, 0.0)
+        self.last  = lag
+        self.worst = max(self.worst, lag)
+        self.count += 1
+        self.samples.append(lag)
+        if lag > self.threshold:
+            self.late += 1
+            logger.warning("画面の処理が %.0fms 遅れました（%s）", lag * 1000, name)
+
+    # 最近の遅延の統計 {"last", "average", "p95", "max", "worst", "late", "count"}（ミリ秒は呼び出し側で換算）
+    def metrics(self):
+        recent = sorted(self.samples)
+        p95    = recent[min(len(recent) - 1, int(len(recent) * 0.95))] if recent else 0.0
+        return {
+            "last":    self.last,
+            "average": sum(recent) / len(recent) if recent else 0.0,
+            "p95":     p95,
+            "max":     recent[-1] if recent else 0.0,
+            "worst":   self.worst,
+            "late":    self.late,
+            "count":   self.count,
+        }
+
+    # 状態表示用の文字列と、遅延が大きいかどうかを返す
+    def status_text(self):
+        metrics = self.metrics()
+        text    = f"遅延 {metrics['last'] * 1000:.0f}ms（最大 {metrics['max'] * 1000:.0f}ms）"
+        return text, metrics["max"] > self.threshold
+
+class AlignedTicker:
+    # interval 秒の区切り（時計の時刻が interval の倍数になる時）ごとに callback を呼ぶクラス
+    # offset を指定すると区切りから offset 秒後に呼ぶ。after は root.after と同じ引数（ミリ秒, 関数）の関数
+    def __init__(self, after, interval, callback, monitor=None, name=None, offset=0.0, clock=time.time):
+        self.after    = after
+        self.interval = interval
+        self.callback = callback
+        self.monitor  = monitor
+        self.name     = name or getattr(callback, "__name__", "ticker")
+        self.offset   = offset
+        self.clock    = clock
+        self.due      = None
+
+    # 次の区切りの時刻
+    def next_due(self, now):
+        return (math.floor((now - self.offset) / self.interval) + 1) * self.interval + self.offset
+
+    def start(self, immediately=True):
+        if immediately:
+            self.callback()
+        self.arm(self.next_due(self.clock()))
+
+    def arm(self, due):
+        self.due = due
+        delay    = max(0, math.ceil((due - self.clock()) * 1000))
+        self.after(delay, self.fire)
+
+    def fire(self):
+        now = self.clock()
+        if self.due - now > self.interval:
+            self.arm(self.next_due(now))    # 時計が戻された（NTP・手動の変更）場合は、戻った時刻の区切りに合わせ直す
+            return
+        if now < self.due:
+            self.arm(self.due)          # ミリ秒の切り上げ誤差等で早く呼ばれた場合は待ち直す
+            return
+        if self.monitor:
+            self.monitor.record(self.name, now - self.due)
+        try:
+            self.callback()
+        finally:
+            self.arm(self.next_due(self.clock()))   # 遅れても次の区切りに合わせ直す（遅れは溜まらない）
@@ -0,0 +1,193 @@
+# HID通信の記録（トレース）と再生
+# 現場でボードの動作がおかしい時に、実際に送ったレポートと get() が返した応答を、
+# 単調増加の時刻付きで小さなバイナリファイルに記録する。記録したファイルはシミュレーションボードに
+# 元の速度または早送りで再生でき、不具合の再現や性能の回帰試験に使える。
+#
+# ファイルの形式（リトルエンディアン）
+#   ヘッダー 24バイト : "RLYT" バージョン(uint16) 予約(2バイト) 記録開始のUNIX時間(double) 予約(8バイト)
+#   記録ごと 6バイト＋データ : 種類(uint8 1:送信 2:応答) 前の記録からの経過(uint32 マイクロ秒) データ長(uint8) データ
+#   経過が uint32 に収まらない場合は、データ長0の「経過のみ」の記録（種類 0）をはさむ
+#   python relay_trace.py dump usb_relay.trace
+#   python relay_trace.py replay usb_relay.trace --speed 10
+import sys
+import time
+import struct
+import argparse
+import threading
+from relay_device import SimulatedRelayBoard, RELAY_ON, RELAY_OFF, ALL_ON, ALL_OFF
+
+MAGIC   = b"RLYT"
+VERSION = 1
+HEADER  = struct.Struct("<4sH2xd8x")
+RECORD  = struct.Struct("<BIB")
+
+KIND_GAP      = 0   # 経過時間のみ
+KIND_SEND     = 1   # 送信したレポート
+KIND_RESPONSE = 2   # get() が返した応答
+KIND_NAMES    = {KIND_GAP: "gap", KIND_SEND: "send", KIND_RESPONSE: "recv"}
+
+MAX_DELTA = 0xFFFFFFFF
+
+class TraceWriter:
+    # トレースファイルに書き込むクラス（複数スレッドから呼んでもよい）
+    # 書き込みはバッファにためて行い、close() か flush() でファイルに書き出す
+    def __init__(self, path, clock=time.monotonic):
+        self.path  = path
+        self.clock = clock
+        self.lock  = threading.Lock()
+        self.file  = open(path, "wb", buffering=65536)
+        self.file.write(HEADER.pack(MAGIC, VERSION, time.time()))
+        self.last  = clock()
+        self.count = 0
+
+    def record(self, kind, data):
+        data = bytes(data)
+        with self.lock:
+            now   = self.clock()
+            delta = max(0, round((now - self.last) * 1000000))
+            self.last = now
+            while delta > MAX_DELTA:
+                self.file.write(RECORD.pack(KIND_GAP, MAX_DELTA, 0))
+                delta -= MAX_DELTA
+            self.file.write(RECORD.pack(kind, delta, len(data)))
+            self.file.write(data)
+            self.count += 1
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class TracingReport:
+    # pywinusbのレポート（Usb_relay_device、HidRelayBoard.report）を包み、送受信を記録するクラス
+    # 元のレポートと同じ send(raw_data=...) と get() で使える
+    def __init__(self, report, writer):
+        self.report = report
+        self.writer = writer
+
+    def send(self, raw_data):
+        self.writer.record(KIND_SEND, raw_data)
+        return self.report.send(raw_data=raw_data)
+
+    def get(self):
+        response = self.report.get()
+        self.writer.record(KIND_RESPONSE, response)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.report, name)
+
+# トレースファイルを読み、(記録開始からの秒数, 種類, データ) を順番に返す
+def read_trace(path):
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"{path} はトレースファイルではありません")
+        magic, version, _ = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} はトレースファイルではありません")
+        elapsed = 0
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return      # 途中で書き込みが止まった場合も、そこまでを返す
+            kind, delta, length = RECORD.unpack(head)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            elapsed += delta
+            if kind != KIND_GAP:
+                yield elapsed / 1000000, kind, data
+
+def trace_started(path):
+    with open(path, "rb") as f:
+        return HEADER.unpack(f.read(HEADER.size))[2]
+
+class TraceReplayer:
+    # トレースをボード（SimulatedRelayBoard 等、send(命令, リレー番号) を持つもの）に再生するクラス
+    # speed=1 で記録と同じ間隔、2 で2倍速、0 で待たずに再生する
+    # 応答の記録とボードの状態を比べ、違っていた回数を mismatches に数える
+    def __init__(self, board, speed=1.0, sleep=time.sleep, clock=time.monotonic):
+        self.board      = board
+        self.speed      = speed
+        self.sleep      = sleep
+        self.clock      = clock
+        self.sent       = 0
+        self.responses  = 0
+        self.mismatches = []     # [(記録開始からの秒数, 記録のマスク, 再生時のマスク), ...]
+
+    def replay(self, records):
+        started = self.clock()
+        for elapsed, kind, data in records:
+            if self.speed:
+                wait = started + elapsed / self.speed - self.clock()
+                if wait > 0:
+                    self.sleep(wait)
+            if kind == KIND_SEND:
+                # [0, 命令, リレー番号, 0, 0, 0, 0, 0, 1]
+                if len(data) >= 3 and data[1] in (RELAY_ON, RELAY_OFF, ALL_ON, ALL_OFF):
+                    self.board.send(data[1], data[2])
+                self.sent += 1
+            elif kind == KIND_RESPONSE and len(data) > 8:
+                self.responses += 1
+                mask = self.board.get_mask()
+                if mask != data[8]:
+                    self.mismatches.append((elapsed, data[8], mask))
+        return self.clock() - started
+
+def describe(kind, data):
+    if kind == KIND_SEND and len(data) >= 3:
+        names = {RELAY_ON: "ON", RELAY_OFF: "OFF", ALL_ON: "ALL_ON", ALL_OFF: "ALL_OFF"}
+        return f"{names.get(data[1], hex(data[1]))} {data[2] if data[1] in (RELAY_ON, RELAY_OFF) else ''}".rstrip()
+    if kind == KIND_RESPONSE and len(data) > 8:
+        return f"状態 {data[8]:08b}"
+    return data.hex()
+
+#========メイン処理=========#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HID通信のトレース")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_dump = sub.add_parser("dump", help="トレースの内容を表示する")
+    p_dump.add_argument("trace_file")
+    p_replay = sub.add_parser("replay", help="トレースをシミュレーションボードに再生する")
+    p_replay.add_argument("trace_file")
+    p_replay.add_argument("--speed",    type=float, default=1.0, help="再生速度（0:待たずに再生）")
+    p_replay.add_argument("--quantity", type=int,   default=8,   help="リレー個数")
+    p_replay.add_argument("--latency",  type=float, default=0.0, help="シミュレーションボードの応答時間（秒）")
+    p_replay.add_argument("--initial",  default=None, help="再生開始時のマスク（省略時は最初の応答から）")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "dump":
+            started = trace_started(args.trace_file)
+            print(f"記録開始 {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))}")
+            for elapsed, kind, data in read_trace(args.trace_file):
+                print(f"{elapsed:12.6f}  {KIND_NAMES[kind]}  {data.hex(' ')}  {describe(kind, data)}")
+        else:
+            records = list(read_trace(args.trace_file))
+            if args.initial is not None:
+                initial = int(args.initial, 0)
+            else:
+                # 最初の送信より前の応答があれば、その状態から始める
+                initial = 0
+                for _, kind, data in records:
+                    if kind == KIND_SEND:
+                        break
+                    if kind == KIND_RESPONSE and len(data) > 8:
+                        initial = data[8]
+                        break
+            board    = SimulatedRelayBoard(args.quantity, mask=initial, latency=args.latency)
+            replayer = TraceReplayer(board, args.speed)
+            elapsed  = replayer.replay(records)
+            length   = records[-1][0] if records else 0.0
+            print(f"記録 {len(records)}件（{length:.3f}秒）  送信 {replayer.sent}  応答 {replayer.responses}  "
+                  f"再生時間 {elapsed:.3f}秒  不一致 {len(replayer.mismatches)}件")
+            for elapsed, recorded, actual in replayer.mismatches[:20]:
+                print(f"  {elapsed:12.6f}  記録 {recorded:08b}  再生 {actual:08b}")
+            sys.exit(1 if replayer.mismatches else 0)
+    except (OSError, ValueError) as e:
+        print(f"エラーが発生しました: {e}")
+        sys.exit(1)
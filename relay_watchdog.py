@@ -0,0 +1,137 @@
+# フェイルセーフのウォッチドッグ
+# 画面のイベントループが止まったり、HIDへの送信から戻ってこなくなったりすると、
+# リレーはその時の状態のまま放置される。ウォッチドッグは独立したスレッドで各処理の生存通知（ハートビート）を監視し、
+# 期限までに通知が来なかった場合は、リレーを設定した安全な状態（safe_mask）にしてから警告する。
+# 安全な状態にする送信は別のスレッドで行うので、送信が止まってもウォッチドッグ自体は止まらない。
+# 生存通知は時刻を１つ書くだけなので、処理の邪魔にならない。
+#   python relay_watchdog.py --timeout 1.0 --stall 3.0
+import sys
+import time
+import logging
+import argparse
+import threading
+from relay_device import SimulatedRelayBoard, apply_difference, full_mask
+
+logger = logging.getLogger("usb_relay.watchdog")
+
+# "0"、"0x03"、"0b00000011" 等の文字列をマスクにする
+def parse_mask(text):
+    return int(str(text).strip() or "0", 0)
+
+class Heartbeat:
+    # 生存通知　監視される処理は定期的に beat() を呼ぶ
+    def __init__(self, name, timeout, clock=time.monotonic):
+        self.name    = name
+        self.timeout = timeout
+        self.clock   = clock
+        self.last    = clock()
+        self.tripped = False
+
+    def beat(self):
+        self.last = self.clock()
+
+class Watchdog:
+    # boards は {ボード名: ボード}、safe_masks は {ボード名: 安全な状態のマスク}（省略したボードは全ＯＦＦ）
+    # 安全な状態にする送信には、監視される処理と別に開いたボードを渡すのが望ましい
+    # on_trip(生存通知の名前, 遅れた秒数) を指定すると、安全な状態にした後に呼ぶ
+    def __init__(self, boards, safe_masks=None, interval=0.1, send_timeout=2.0, on_trip=None, clock=time.monotonic):
+        self.boards       = boards
+        self.safe_masks   = dict(safe_masks or {})
+        self.interval     = interval
+        self.send_timeout = send_timeout
+        self.on_trip      = on_trip
+        self.clock        = clock
+        self.heartbeats   = []
+        self.trips        = 0
+        self.stopped      = threading.Event()
+        self.thread       = None
+
+    # 監視する処理を登録し、その処理が呼ぶ生存通知を返す
+    def register(self, name, timeout):
+        heartbeat = Heartbeat(name, timeout, self.clock)
+        self.heartbeats.append(heartbeat)
+        return heartbeat
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="Watchdog", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    # 期限切れの生存通知を調べる。一度止まった処理は、通知が再開するまで繰り返し作動させない
+    def check(self):
+        now = self.clock()
+        for heartbeat in self.heartbeats:
+            overdue = now - heartbeat.last - heartbeat.timeout
+            if overdue > 0 and not heartbeat.tripped:
+                heartbeat.tripped = True
+                self.trip(heartbeat.name, now - heartbeat.last)
+            elif overdue <= 0 and heartbeat.tripped:
+                heartbeat.tripped = False
+                logger.warning("%s の生存通知が再開しました", heartbeat.name)
+
+    # 全ボードを安全な状態にしてから警告する
+    def trip(self, name, stalled):
+        self.trips += 1
+        logger.critical("%s が %.1f秒応答しないため、リレーを安全な状態にします", name, stalled)
+        done   = threading.Event()
+        worker = threading.Thread(target=self.apply_safe_state, args=(done,), name="WatchdogSafeState", daemon=True)
+        worker.start()
+        if not done.wait(self.send_timeout):
+            logger.critical("リレーを安全な状態にできませんでした（送信が %.1f秒以内に終わりません）", self.send_timeout)
+        if self.on_trip:
+            self.on_trip(name, stalled)
+
+    # 現在の状態は読まずに（読み出しも止まっている可能性があるので）安全な状態を書き込む
+    # 全ＯＦＦ・全ＯＮは1レポート、それ以外はリレーごとにＯＮ/ＯＦＦを送る
+    def apply_safe_state(self, done):
+        for name, board in self.boards.items():
+            full = full_mask(board.quantity_relay)
+            safe = self.safe_masks.get(name, 0) & full
+            try:
+                apply_difference(board, safe ^ full, safe)
+            except Exception as e:
+                logger.critical("ボード %s を安全な状態にできませんでした: %s", name, e)
+        done.set()
+
+#========メイン処理=========#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="フェイルセーフのウォッチドッグ（シミュレーションボードで動作確認）")
+    parser.add_argument("--quantity",  type=int,   default=8,   help="リレー個数")
+    parser.add_argument("--safe-mask", default="0",             help="安全な状態のマスク 例: 0b00000011")
+    parser.add_argument("--timeout",   type=float, default=1.0, help="生存通知の期限（秒）")
+    parser.add_argument("--stall",     type=float, default=3.0, help="処理を止めるまでの秒数")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    board     = SimulatedRelayBoard(args.quantity, mask=full_mask(args.quantity))
+    watchdog  = Watchdog({"board1": board}, {"board1": parse_mask(args.safe_mask)})
+    heartbeat = watchdog.register("scheduler", args.timeout)
+    watchdog.start()
+
+    # 生存通知の処理時間を計る
+    count   = 1000000
+    started = time.perf_counter()
+    for _ in range(count):
+        heartbeat.beat()
+    print(f"生存通知 1回 {(time.perf_counter() - started) / count * 1e9:.0f}ns")
+
+    # 一定時間通知を送ってから止まる処理
+    until = time.monotonic() + args.stall
+    while time.monotonic() < until:
+        heartbeat.beat()
+        time.sleep(0.05)
+    print(f"処理を止めました  状態 {board.get_mask():0{args.quantity}b}")
+    time.sleep(args.timeout + 0.5)
+    watchdog.stop()
+    print(f"作動 {watchdog.trips}回  状態 {board.get_mask():0{args.quantity}b}  送信レポート {board.reports_sent}")
+    sys.exit(0 if watchdog.trips == 1 else 1)
@@ -0,0 +1,53 @@
+# 画面無しのデーモン（relay_daemon）の待ち時間と systemd への生存通知
+import socket
+from types    import SimpleNamespace
+from datetime import datetime, timedelta
+from relay_daemon import RelayDaemon, SystemdNotifier
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def make_daemon(tmp_path, clock):
+    path     = str(tmp_path / "notify.sock")
+    receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    receiver.bind(path)
+    receiver.setblocking(False)
+    notifier = SystemdNotifier({"NOTIFY_SOCKET": path, "WATCHDOG_USEC": "2000000"}, clock)
+    return RelayDaemon(str(tmp_path / "settings.json"), notifier=notifier), receiver
+
+def received(receiver):
+    messages = []
+    while True:
+        try:
+            messages.append(receiver.recv(4096).decode("utf-8"))
+        except BlockingIOError:
+            return messages
+
+def test_watchdog_ping_is_sent_under_broker_backlog(tmp_path):
+    clock = FakeClock()
+    daemon, receiver = make_daemon(tmp_path, clock)
+    daemon.brokers = {"board1": SimpleNamespace(queue=[object()])}
+    pings = 0
+    for _ in range(5):
+        assert daemon.timeout(datetime.now()) == 0
+        pings += received(receiver).count("WATCHDOG=1")
+        clock.now += 1.0
+    assert pings == 5
+    daemon.notifier.close()
+    receiver.close()
+
+def test_timeout_is_bounded_by_the_next_ping_and_the_due_time(tmp_path):
+    clock = FakeClock()
+    daemon, receiver = make_daemon(tmp_path, clock)
+    now = datetime.now()
+    daemon.recheck = float("inf")
+    daemon.due     = now + timedelta(seconds=30)
+    assert 0 < daemon.timeout(now) <= 1.0
+    daemon.notifier.interval = None
+    assert 30 <= daemon.timeout(now) <= 31
+    daemon.notifier.close()
+    receiver.close()
@@ -0,0 +1,99 @@
+# 一括取り込み（relay_import）と登録簿（relay_registry）の読み出しの往復
+import json
+import time
+import pytest
+from relay_registry import RelayRegistry
+from relay_import   import import_csv, import_file
+
+def make_registry(tmp_path):
+    relays = [{"classifying": f"r{n}", "timer_onoff": False, "start_hour": " 0", "start_minute": " 0",
+               "end_hour": " 0", "end_minute": " 0"} for n in range(1, 9)]
+    (tmp_path / "relays.json").write_text(json.dumps(relays))
+    (tmp_path / "board1.json").write_text(json.dumps({"vender_id": "5824", "device_id": "1503",
+                                                      "quantity_relay": "8", "auto_load": "relays.json"}))
+    registry = RelayRegistry(str(tmp_path / "reg.db"))
+    board_id = registry.import_settings(str(tmp_path / "board1.json"), "board1")
+    return registry, board_id
+
+def write_csv(tmp_path, *rows):
+    path = tmp_path / "schedules.csv"
+    path.write_text("board,relay,start,end,timer_onoff\n" + "".join(f"{row}\n" for row in rows))
+    return str(path)
+
+def test_imported_schedule_is_loaded(tmp_path):
+    registry, board_id = make_registry(tmp_path)
+    result = import_csv(registry, write_csv(tmp_path, "board1,3,08:00,17:30,1"))
+    assert result.imported == 1 and not result.errors
+    relay = registry.load_board_data(board_id)[2]
+    assert relay["timer_onoff"] is True
+    assert (relay["start_hour"], relay["start_minute"], relay["end_hour"], relay["end_minute"]) == (" 8", " 0", "17", "30")
+    registry.close()
+
+def test_reimport_replaces_schedules(tmp_path):
+    registry, board_id = make_registry(tmp_path)
+    path = write_csv(tmp_path, "board1,3,08:00,17:30,1")
+    import_csv(registry, path)
+    import_csv(registry, path)
+    rows = [(row["relay_number"], row["timer_onoff"], row["start_hour"], row["end_hour"])
+            for row in registry.schedules_for_board(board_id) if row["relay_number"] == 3]
+    assert rows == [(3, 1, 8, 17)]
+    registry.close()
+
+def test_rows_in_one_file_are_kept_across_batches(tmp_path):
+    registry, board_id = make_registry(tmp_path)
+    path = write_csv(tmp_path, "board1,3,06:00,07:00,1", "board1,4,01:00,02:00,1", "board1,3,18:00,19:00,1")
+    import_csv(registry, path, batch_size=1)
+    rows = [(row["start_hour"], row["end_hour"])
+            for row in registry.schedules_for_board(board_id) if row["relay_number"] == 3]
+    assert rows == [(6, 7), (18, 19)]
+    assert registry.load_board_data(board_id)[2]["start_hour"] == "18"
+    registry.close()
+
+def test_errors_leave_schedules_untouched(tmp_path):
+    registry, board_id = make_registry(tmp_path)
+    result = import_csv(registry, write_csv(tmp_path, "board1,3,25:00,17:30,1", "board2,1,08:00,09:00,1"))
+    assert result.imported == 0 and [line for line, _ in result.errors] == [2, 3]
+    assert registry.load_board_data(board_id)[2]["timer_onoff"] is False
+    registry.close()
+
+def write_ical(tmp_path, *events):
+    lines = ["BEGIN:VCALENDAR"]
+    for event in events:
+        lines += ["BEGIN:VEVENT", "X-RELAY-BOARD:board1", "X-RELAY:3", "RRULE:FREQ=DAILY", *event, "END:VEVENT"]
+    path = tmp_path / "schedules.ics"
+    path.write_text("\r\n".join(lines + ["END:VCALENDAR", ""]))
+    return str(path)
+
+def relay3_schedules(registry, board_id):
+    return [(row["start_hour"], row["start_minute"], row["end_hour"], row["end_minute"])
+            for row in registry.schedules_for_board(board_id) if row["relay_number"] == 3]
+
+@pytest.fixture
+def tokyo(monkeypatch):
+    monkeypatch.setenv("TZ", "Asia/Tokyo")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+def test_ical_utc_and_tzid_are_converted_to_local_time(tmp_path, tokyo):
+    registry, board_id = make_registry(tmp_path)
+    result = import_file(registry, write_ical(tmp_path,
+        ["DTSTART:20260101T230000Z", "DURATION:PT1H30M"],
+        ["DTSTART;TZID=America/New_York:20260115T080000", "DTEND;TZID=America/New_York:20260115T090000"],
+        ["DTSTART:20260101T060000", "DTEND:20260101T070000"]))
+    assert not result.errors
+    assert relay3_schedules(registry, board_id) == [(8, 0, 9, 30), (22, 0, 23, 0), (6, 0, 7, 0)]
+    registry.close()
+
+def test_ical_rejects_bad_spans_and_unknown_zones(tmp_path, tokyo):
+    registry, board_id = make_registry(tmp_path)
+    result = import_file(registry, write_ical(tmp_path,
+        ["DTSTART:20260101T080000", "DTEND:20260102T090000"],
+        ["DTSTART:20260101T080000", "DURATION:P1D"],
+        ["DTSTART:20260101T080000", "DTEND:20260101T070000"],
+        ["DTSTART;TZID=Mars/Olympus:20260101T080000", "DURATION:PT1H"],
+        ["DTSTART;VALUE=DATE:20260101", "DURATION:PT1H"]))
+    assert result.imported == 0 and len(result.errors) == 5
+    assert "Mars/Olympus" in result.errors[3][1]
+    registry.close()
@@ -0,0 +1,53 @@
+# インターロック（relay_interlock）の規則の確認
+import pytest
+from relay_device    import SimulatedRelayBoard
+from relay_interlock import Interlock, InterlockedBoard, InterlockError, REJECT, RESOLVE
+
+def test_empty_requires_is_rejected_with_a_clear_message():
+    with pytest.raises(ValueError, match="requires"):
+        Interlock(8, [{"relay": 3, "requires": []}])
+
+def test_exclusive_rejects_a_second_relay():
+    interlock = Interlock(8, [{"exclusive": [1, 2]}])
+    assert interlock.check(0b01, 0b01, 0b01) == 0b01
+    with pytest.raises(InterlockError):
+        interlock.check(0b01, 0b11, 0b10)
+    assert interlock.rejected == 1
+
+def test_relays_can_be_turned_off_one_at_a_time_while_violating():
+    interlock = Interlock(8, [{"exclusive": [1, 2, 3]}])
+    assert interlock.check(0b111, 0b011, 0b100) == 0b011
+    assert interlock.check(0b011, 0b001, 0b010) == 0b001
+    with pytest.raises(InterlockError):
+        interlock.check(0b011, 0b111, 0b100)          # ＯＮを増やす書き込みは認めない
+
+def test_turning_off_must_not_add_a_new_violation():
+    interlock = Interlock(8, [{"exclusive": [1, 2]}, {"relay": 3, "requires": [4]}])
+    with pytest.raises(InterlockError):
+        interlock.check(0b1111, 0b0111, 0b1000)       # リレー4をＯＦＦにするとリレー3の規則に反する
+    assert interlock.check(0b1111, 0b1110, 0b0001) == 0b1110
+
+def test_requires_orders_required_relays_first():
+    interlock = Interlock(8, [{"relay": 1, "requires": [2]}, {"relay": 2, "requires": [3]}])
+    order = interlock.on_order
+    assert order.index(2) < order.index(1) < order.index(0)
+
+def test_resolve_turns_off_the_other_relay():
+    interlock = Interlock(8, [{"exclusive": [1, 2]}], RESOLVE)
+    assert interlock.check(0b01, 0b11, 0b10) == 0b10
+    assert interlock.resolved == 1
+
+def test_max_on_without_table():
+    interlock = Interlock(20, [{"max_on": 2, "relays": [17, 18, 19]}], REJECT)
+    assert interlock.table is None
+    assert interlock.check(0, 0b11 << 16, 0b11 << 16) == 0b11 << 16
+    with pytest.raises(InterlockError):
+        interlock.check(0b11 << 16, 0b111 << 16, 0b100 << 16)
+
+def test_interlocked_board_rejects_and_keeps_the_board_unchanged():
+    board = SimulatedRelayBoard(8)
+    wrapped = InterlockedBoard(board, Interlock(8, [{"exclusive": [1, 2]}]))
+    wrapped.relay_on(1)
+    with pytest.raises(InterlockError):
+        wrapped.relay_on(2)
+    assert board.get_mask() == 0b01
@@ -0,0 +1,71 @@
+# 優先順位付きキュー（relay_priority.CommandQueue）の実行順
+from relay_device   import SimulatedRelayBoard, RELAY_ON, RELAY_OFF, ALL_ON, ALL_OFF
+from relay_priority import CommandQueue, execute, INTERACTIVE, SCHEDULED, BULK, STATUS
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def drain(queue):
+    order = []
+    while True:
+        command = queue.get()
+        if command is None:
+            return order
+        order.append((command.opcode, command.relay_number))
+
+def test_commands_keep_the_order_they_were_sent():
+    queue = CommandQueue()
+    for opcode, relay in [(RELAY_ON, 1), (RELAY_OFF, 2), (RELAY_ON, 2), (RELAY_OFF, 1)]:
+        queue.put(INTERACTIVE, opcode, relay)
+    # 続けて入った OFF 2 と ON 2 だけが統合され、リレー1の命令との前後は変わらない
+    assert drain(queue) == [(RELAY_ON, 1), (RELAY_ON, 2), (RELAY_OFF, 1)]
+
+def test_consecutive_commands_to_one_relay_are_merged():
+    queue   = CommandQueue()
+    results = []
+    done    = lambda command, mask, error: results.append(mask)
+    for opcode in (RELAY_ON, RELAY_OFF, RELAY_ON):
+        queue.put(INTERACTIVE, opcode, 3, done=done)
+    assert len(queue) == 1
+    board = SimulatedRelayBoard(8)
+    command = queue.get()
+    command.finish(execute(board, command))
+    assert results == [4, 4, 4]        # 統合された命令にも実行後のマスクを返す
+
+def test_status_read_is_a_merge_barrier():
+    queue = CommandQueue()
+    queue.put(INTERACTIVE, RELAY_ON, 1)
+    queue.put(INTERACTIVE, STATUS)
+    queue.put(INTERACTIVE, RELAY_OFF, 1)
+    assert drain(queue) == [(RELAY_ON, 1), (STATUS, 0), (RELAY_OFF, 1)]
+
+def test_all_off_supersedes_earlier_writes_of_the_same_class():
+    queue = CommandQueue()
+    queue.put(BULK, RELAY_ON, 1)
+    queue.put(BULK, RELAY_ON, 2)
+    queue.put(BULK, ALL_OFF)
+    assert drain(queue) == [(ALL_OFF, 0)]
+
+def test_higher_class_runs_first_and_cancels_lower_writes_to_the_same_relay():
+    queue = CommandQueue()
+    queue.put(BULK, RELAY_ON, 1)
+    queue.put(SCHEDULED, RELAY_ON, 2)
+    queue.put(BULK, ALL_ON)
+    queue.put(INTERACTIVE, RELAY_OFF, 1)
+    all_on = [command for command in queue.pending[BULK]][-1]
+    assert all_on.except_mask == 1
+    assert drain(queue) == [(RELAY_OFF, 1), (RELAY_ON, 2), (ALL_ON, 0)]
+
+def test_expired_commands_are_dropped_with_an_error():
+    clock   = FakeClock()
+    queue   = CommandQueue(clock)
+    errors  = []
+    queue.put(INTERACTIVE, RELAY_ON, 1, deadline=1.0, done=lambda command, mask, error: errors.append(error))
+    queue.put(INTERACTIVE, RELAY_ON, 2)
+    clock.now = 2.0
+    assert drain(queue) == [(RELAY_ON, 2)]
+    assert errors == ["期限切れ"] and queue.metrics()["interactive"]["expired"] == 1
@@ -0,0 +1,22 @@
+# タイマー設定（relay_schedule）の日の出・日の入り基準
+import pytest
+from relay_schedule import schedule_from_data, resolve_schedule, timer_active
+
+def item(**fields):
+    return dict({"timer_onoff": True, "start_hour": " 0", "start_minute": " 0", "end_hour": " 0", "end_minute": " 0"},
+                **fields)
+
+def test_anchored_schedule_resolves_against_the_day():
+    schedule = schedule_from_data(1, item(start_anchor="sunset", start_offset=-30, end_anchor="sunrise", end_offset=15))
+    assert resolve_schedule(schedule, (360, 1080)) == (1050, 375)
+    assert resolve_schedule(schedule, None) is None
+
+def test_unknown_anchor_is_an_error():
+    with pytest.raises(ValueError, match="sunrse"):
+        schedule_from_data(1, item(start_anchor="sunrse"))
+
+def test_sunset_at_midnight_keeps_the_whole_day():
+    schedule = schedule_from_data(1, item(start_anchor="sunrise", end_anchor="sunset"))
+    start, end = resolve_schedule(schedule, (0, 1440))
+    assert (start, end) == (0, 1440)
+    assert timer_active(start, end, 0) and timer_active(start, end, 1439)
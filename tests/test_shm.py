@@ -0,0 +1,25 @@
+# 共有メモリのステータスボード（relay_shm）
+import time
+from relay_shm import StatusBoardWriter, StatusBoardReader, SEQ, slot_offset
+
+def test_published_masks_are_read_back(tmp_path):
+    path   = str(tmp_path / "status.shm")
+    writer = StatusBoardWriter(path, [("第一温室の換気ファン", 8), ("board1", 4)])
+    writer.publish("第一温室の換気ファン", current=5, desired=7)
+    reader = StatusBoardReader(path)
+    assert set(reader.names) == {"第一温室の", "board1"}      # 16バイトに収まるよう文字の区切りで切り詰める
+    status = reader.read("第一温室の換気ファン")
+    assert (status["seq"], status["current"], status["desired"], status["quantity_relay"]) == (1, 5, 7, 8)
+    reader.close()
+    writer.close()
+
+def test_slot_left_mid_update_times_out(tmp_path):
+    path   = str(tmp_path / "status.shm")
+    writer = StatusBoardWriter(path, [("board1", 8)])
+    SEQ.pack_into(writer.map, slot_offset(0), 1)                 # 書き込み中のまま止まった
+    reader  = StatusBoardReader(path)
+    started = time.monotonic()
+    assert reader.read("board1", timeout=0.05) is None
+    assert time.monotonic() - started < 1.0
+    reader.close()
+    writer.close()
@@ -0,0 +1,61 @@
+# 時計に合わせた定期処理（relay_tklag.AlignedTicker）と時計の変更
+from relay_tklag import AlignedTicker, LagMonitor
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class FakeAfter:
+    # root.after の代わり。予約された (ミリ秒, 関数) を記録する
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, delay, func):
+        self.calls.append((delay, func))
+
+    # 最後に予約された関数を、その時間だけ時計を進めて呼ぶ
+    def run_next(self, clock):
+        delay, func = self.calls.pop()
+        clock.now  += delay / 1000
+        func()
+        return delay
+
+def make_ticker(interval=1.0, now=1000.25):
+    clock  = FakeClock(now)
+    after  = FakeAfter()
+    ticks  = []
+    ticker = AlignedTicker(after, interval, lambda: ticks.append(clock.now), LagMonitor(), clock=clock)
+    ticker.start(immediately=False)
+    return ticker, clock, after, ticks
+
+def test_ticks_stay_on_the_interval_boundary():
+    ticker, clock, after, ticks = make_ticker()
+    assert after.calls[-1][0] == 750
+    for _ in range(3):
+        after.run_next(clock)
+    assert ticks == [1001.0, 1002.0, 1003.0]
+
+def test_backward_clock_step_realigns_instead_of_waiting():
+    ticker, clock, after, ticks = make_ticker()
+    clock.now -= 3600                  # 予約した直後に時計が１時間戻された
+    after.run_next(clock)
+    assert ticks == []
+    assert after.calls[-1][0] <= 1000  # 戻った時刻の次の区切りで呼ぶ
+    after.run_next(clock)
+    assert ticks == [clock.now]
+
+def test_early_call_waits_for_the_same_boundary():
+    ticker, clock, after, ticks = make_ticker()
+    clock.now -= 0.002                 # ミリ秒の誤差で少し早く呼ばれる
+    after.run_next(clock)
+    assert ticks == [] and after.calls[-1][0] == 2
+
+def test_forward_clock_step_records_the_lag_once():
+    ticker, clock, after, ticks = make_ticker(interval=60.0, now=1000.0)
+    clock.now += 3600
+    after.run_next(clock)
+    assert len(ticks) == 1 and ticker.monitor.worst >= 3600
+    assert after.calls[-1][0] <= 60000
@@ -4,8 +4,21 @@ from   tkinter import messagebox, font, filedialog
 import os
 import sys
 import json
+import time
 import pywinusb.hid as hid
 from   datetime import datetime
+from   relay_schedule import timer_active, check_hour_minute, anchors_from_data, schedule_from_data, resolve_schedule
+from   relay_solar    import calendar_from_settings
+from   relay_stagger  import stagger_offsets
+from   relay_tklag    import LagMonitor, AlignedTicker
+from   relay_watchdog import Watchdog, parse_mask
+from   relay_device   import HidRelayBoard, full_mask
+from   relay_interlock import InterlockError, interlock_from_settings
+from   relay_trace    import TraceWriter, TracingReport
+from   relay_history  import HistoryStore
+from   relay_codec    import ON_REPORTS, OFF_REPORTS, ALL_ON_REPORT, ALL_OFF_REPORT, STATUS_INDEX, decode_status
+from   relay_log      import logger, audit, setup_logging, stop_logging
+from   relay_autosave import AutoSaver, atomic_write_json
 
 class PreSetting():
     # 設定ファイルを取得するクラス
@@ -16,17 +29,17 @@ class PreSetting():
     def read_settings(self):
         try:
             with open(self.setting, "r") as file:
-                print("設定ファイルを読み込みました")
+                logger.info("設定ファイルを読み込みました")
                 return json.load(file)
         except FileNotFoundError:
-            print("設定ファイルが見つかりません")
+            logger.warning("設定ファイルが見つかりません")
             return {"vender_id": "", "device_id": "", "quantity_relay": 0, "auto_load": ""}  # 初期値
         
     def check_settings(self):
         settings = self.read_settings()
         #print(f"settings = {settings}")
         if not all(key in settings for key in ["vender_id", "device_id", "quantity_relay", "auto_load"]):
-            print("設定ファイルに必要なキーが不足しています")
+            logger.error("設定ファイルに必要なキーが不足しています")
             return False
     
         # 設定ファイルデータのチェックと設定
@@ -56,16 +69,16 @@ class PreSetting():
 
         if settings["quantity_relay"] == "" :
             settings["quantity_relay"] = 8  # デフォルト値を設定
-            print("リレーの個数は8にデフォルト設定しました。") 
+            logger.warning("リレーの個数は8にデフォルト設定しました。") 
         else:
             try:
                 settings["quantity_relay"] = int(settings["quantity_relay"])
                 if settings["quantity_relay"] < 1 or settings["quantity_relay"] > 8:
                     settings["quantity_relay"] = 8  # デフォルト値を設定
-                    print("リレーの個数を8にデフォルト設定しました。")
+                    logger.warning("リレーの個数を8にデフォルト設定しました。")
             except ValueError:
                 settings["quantity_relay"] = 8  # デフォルト値を設定
-                print("リレーの個数が8にデフォルト設定されました。") 
+                logger.warning("リレーの個数が8にデフォルト設定されました。") 
                 
         return settings
 
@@ -80,13 +93,13 @@ class AutoLoadData():
                 loaded_data = json.load(f)
                 return loaded_data
         except FileNotFoundError:
-            print('ファイルが見つかりません')
+            logger.warning('ファイルが見つかりません')
             return None  # ファイルが見つからない場合はNoneを返す
         except json.JSONDecodeError:
-            print('ファイルの読み込みに失敗しました。ファイルが破損しているか、json形式で保存されていません。')
+            logger.error('ファイルの読み込みに失敗しました。ファイルが破損しているか、json形式で保存されていません。')
             return None
         except Exception as e:
-            print(f'予期せぬエラーが発生しました: {e}')
+            logger.error("予期せぬエラーが発生しました: %s", e)
             return None
         
     def load_data(self):
@@ -95,14 +108,14 @@ class AutoLoadData():
             filepath = os.path.join(os.getcwd(), self.load_file)
             loaded_data = self.read_data()
             if loaded_data:
-                print(f"デフォルトファイル '{self.load_file}' を読み込みました。")
+                logger.info("デフォルトファイル '%s' を読み込みました。", self.load_file)
                 return loaded_data
         
         # ファイルが存在しない場合のデフォルトデータを作成
         loaded_data = []
         for i in range(self.quantity_relay):
             loaded_data.append({"classifying": "名称", "timer_onoff": False, "start_hour": " 0","start_minute": " 0",  "end_hour": " 0","end_minute": " 0"})
-        print(f"デフォルトファイル '{self.load_file}' は存在しません。")
+        logger.warning("デフォルトファイル '%s' は存在しません。", self.load_file)
         return loaded_data  # ファイルが存在しない場合はデフォルト値を返す
     
 class USBRelayInterface:
@@ -121,15 +134,15 @@ class USBRelayInterface:
             hid_device = filter.get_devices()
             # デバイスが見つからない場合のチェック
             if not hid_device:
-                print("エラー: デバイスが見つかりません")
+                logger.error("エラー: デバイスが見つかりません")
                 return False
             # 取得したデバイスリストの最初のデバイスを選択
             self.USB_device = hid_device[0]
-            print("デバイスが正常に取得されました:", self.USB_device)
+            logger.info("デバイスが正常に取得されました: %s", self.USB_device)
             return self.USB_device
         except Exception as e:
             # 例外をキャッチしてエラーメッセージを出力
-            print("エラーが発生しました:", str(e))
+            logger.error("エラーが発生しました: %s", e)
             return False 
    
     #デバイスを開く
@@ -142,12 +155,12 @@ class USBRelayInterface:
                 else:
                     for dev in self.USB_device.find_output_reports() + self.USB_device.find_feature_reports():
                         Usb_relay_device = dev
-                    print("デバイスが正常にオープンされました。")
+                    logger.info("デバイスが正常にオープンされました。")
                     return Usb_relay_device
             else:
-                print("既に開かれているデバイスを開こうとしました")
+                logger.warning("既に開かれているデバイスを開こうとしました")
         else:
-            print("アクティブではないデバイスを開こうとしました")
+            logger.warning("アクティブではないデバイスを開こうとしました")
         return False
 
     #デバイスを閉じる
@@ -158,12 +171,12 @@ class USBRelayInterface:
                     self.USB_device.close()
                     return True
                 else:
-                    print("既に閉じられているデバイスを閉じようとしました")
+                    logger.warning("既に閉じられているデバイスを閉じようとしました")
             else:
-                print("アクティブではないデバイスを閉じようとしました")
+                logger.warning("アクティブではないデバイスを閉じようとしました")
             return True
         else:
-            print("デバイスが取得されていないため、クローズ処理をスキップしました")
+            logger.warning("デバイスが取得されていないため、クローズ処理をスキップしました")
             return False  
 
     # デバイスのステータスを参照して、全リレーのＯＮＯＦＦを8バイトのフラグにして返す
@@ -171,23 +184,26 @@ class USBRelayInterface:
         try:
             # デバイスの状態を確認
             if not self.USB_device:  # USB_deviceが未定義またはNoneの場合をチェック
-                print("デバイスが正常にオープンされていません。")
+                logger.warning("デバイスが正常にオープンされていません。")
                 return False
             # 全リレーのステータスを取得
             last_row_status = Usb_relay_device.get()
-            byte_value = last_row_status[8]  # 8番目がリレーの状態ステータス
-            # 各ビットをチェックしてリストに格納　ビット(0)はリレー1(0)のステータス
-            status_string = [(byte_value >> i) & 1 for i in range(8)]
+            byte_value = last_row_status[STATUS_INDEX]  # 8番目がリレーの状態ステータス
+            # 各ビットのＯＮＯＦＦを表から引く　ビット(0)はリレー1(0)のステータス
+            status_string = decode_status(byte_value)
             #print(f'get_all_status  status_string= {status_string}')
             return status_string
         except Exception as e:
             # エラー発生時はログを出力し、Falseを返す
-            print(f"デバイスの状態確認でエラーが発生しました: {e}")
+            logger.error("デバイスの状態確認でエラーが発生しました: %s", e)
             return False
 
 # リレーボードのクラス
 class RelayBoard:
-    def __init__(self,relay_number, On_off, timer_begin, classifying, timer_onoff, start_hour, start_minute, end_hour, end_minute):
+    pending = {}     # 時差実行で待っているＯＮ {リレーのindex: after のID}
+    epoch   = 0      # ウォッチドッグが作動するたびに増やす（待っているＯＮを無効にする）
+
+    def __init__(self,relay_number, On_off, timer_begin, classifying, timer_onoff, start_hour, start_minute, end_hour, end_minute, anchors=None):
         self.relay_number = relay_number                      # リレー番号 １～
         self.on_off       = On_off                            # リレーのＯＮ／ＯＦＦ状態　True:ＯＮ False:ＯＦＦ
         self.timer_begin  = timer_begin                       # タイマーの開始状態 True:タイマーが開始した False:タイマーが開始していない
@@ -197,6 +213,7 @@ class RelayBoard:
         self.start_minute = tk.StringVar( value=start_minute) # タイマー開始分
         self.end_hour     = tk.StringVar( value=end_hour)     # タイマー終了時刻
         self.end_minute   = tk.StringVar( value=end_minute)   # タイマー終了分
+        self.anchors      = dict(anchors or {})               # 日の出・日の入り基準のタイマー（リレーデータのjsonで設定）
 
     def clear_all(self):
         self.on_off       = False
@@ -207,66 +224,115 @@ class RelayBoard:
         self.start_minute.set(" 0")
         self.end_hour.set(" 0")
         self.end_minute.set(" 0")
+        self.anchors      = {}
         
     def check_hour_minute(self):
         global err_message
         #print(f"&&check_hour_minute {self.relay_number} : {self.start_hour.get()}:{self.start_minute.get()} ~ {self.end_hour.get()}:{self.end_minute.get()}")
-        if self.start_hour.get() == ' 0' and self.start_minute.get() == ' 0' and self.end_hour.get() == ' 0' and self.end_minute.get() == ' 0':
-            return 'タイマー時刻が設定されていません。'
-        elif self.start_hour.get() == self.end_hour.get() and self.start_minute.get() == self.end_minute.get():
-            return 'タイマー開始と終了に同じ時刻は設定できません。'
-        elif (0 <= int(self.start_hour.get()) < 24 ) and (0 <= int(self.start_minute.get()) < 60 ) and \
-             (0 <= int(self.end_hour.get())   < 24 ) and (0 <= int(self.end_minute.get())   < 60 ):
+        # 日の出・日の入り基準のタイマーは画面の時分を使わないのでチェックしない
+        if self.anchors.get("start_anchor") or self.anchors.get("end_anchor"):
             return None
-        else:
-            return 'タイマー時刻にあり得ない数値が設定されています。'
+        # 一括取り込み（relay_import）と同じ規則でチェックする
+        return check_hour_minute(self.start_hour.get(), self.start_minute.get(), self.end_hour.get(), self.end_minute.get())
 
-    def relay_on(self,i):
-        # 個別リレーのＯＮ
+    def relay_on(self,i,source="gui"):
+        # 個別リレーのＯＮ（インターロックで拒否した場合はFalseを返す）
+        if INTERLOCK and source != "interlock" and not RelayBoard.interlocked(1 << i, 0, source):
+            return False
+        old_on_off = Each_Relay[i].on_off
+        started    = time.perf_counter()
         if Usb_relay_device:
-            instructions=[0, 0xFF, self.relay_number, 0, 0, 0, 0, 0, 1]
+            instructions=ON_REPORTS[self.relay_number]
             Usb_relay_device.send(raw_data=instructions)
+        latency    = time.perf_counter() - started
         Each_Relay[i].on_off = True
+        audit(source, BOARD_NAME, self.relay_number, old_on_off, True, latency)  # 操作履歴に記録
         root.show_relay_status(i)
         root.each_timer_status_update(i)        
+        return True
         #print(f'relay {self.relay_number} on')
 
-    def relay_off(self,i):
-        #個別リレーのＯＦＦ
+    def relay_off(self,i,source="gui"):
+        #個別リレーのＯＦＦ（インターロックで拒否した場合はFalseを返す）
+        if INTERLOCK and source != "interlock" and not RelayBoard.interlocked(0, 1 << i, source):
+            return False
+        RelayBoard.cancel_pending([i])          # 時差実行で待っているＯＮを取り消す
+        old_on_off = Each_Relay[i].on_off
+        started    = time.perf_counter()
         if Usb_relay_device:
-            instructions=[0, 0xFD, self.relay_number, 0, 0, 0, 0, 0, 1]
+            instructions=OFF_REPORTS[self.relay_number]
             Usb_relay_device.send(raw_data=instructions)
+        latency    = time.perf_counter() - started
         Each_Relay[i].on_off = False
+        audit(source, BOARD_NAME, self.relay_number, old_on_off, False, latency)  # 操作履歴に記録
         root.show_relay_status(i)
         root.each_timer_status_update(i)
+        return True
         #print(f'relay {self.relay_number} off')
         
     # タイマー処理(リレーのTIMERがONの時の処理)
+    # 開始・終了の時分だけでなく毎回あるべきＯＮ/ＯＦＦを計算し、実際の状態と違う場合だけ切り替える
     def relay_timer_decision(self,i):
         now = datetime.now()
-        #print(f'##relay_timer<on> relay_id={i} relay_number={Each_Relay[i].relay_number}: {now.hour}:{now.minute} begin={Each_Relay[i].timer_begin} ')
-        start_hour_int   = int(Each_Relay[i].start_hour.get())
-        start_minute_int = int(Each_Relay[i].start_minute.get())
-        end_hour_int     = int(Each_Relay[i].end_hour.get())
-        end_minute_int   = int(Each_Relay[i].end_minute.get())
-        #タイマーが開始されていないとき：０
-        if (Each_Relay[i].timer_begin == False and 
-            #開始時と開始分がカレント時、カレント分と等しい場合
-            start_hour_int   == now.hour and 
-            start_minute_int == now.minute):  
-                Each_Relay[i].relay_on(i)
-                USBRelayInterface.get_all_status()
-                root.each_timer_status_update(i) 
-                        
-        #タイマーＯＦＦ時刻未到来のとき　：１ 
-            #タイマーが開始していた場合(timer_beginがTrueの場合)         
-        elif (Each_Relay[i].timer_begin and 
-            #終了時と終了分がカレント時、カレント分と等しい場合
-            end_hour_int   == now.hour and 
-            end_minute_int == now.minute):
-                Each_Relay[i].relay_off(i)
-                USBRelayInterface.get_all_status()
-                root.each_timer_status_update(i) 
+        #print(f'##relay_timer<on> relay_id={i} relay_number={Each_Relay[i].relay_number}: {now.hour}:{now.minute} on_off={Each_Relay[i].on_off} ')
+        item      = dict(Each_Relay[i].anchors, timer_onoff=True,
+                         start_hour=Each_Relay[i].start_hour.get(), start_minute=Each_Relay[i].start_minute.get(),
+                         end_hour=Each_Relay[i].end_hour.get(),     end_minute=Each_Relay[i].end_minute.get())
+        # 日の出・日の入り基準の時刻は、起動時に作った１年分の表から今日の時刻を引く
+        try:
+            window = resolve_schedule(schedule_from_data(Each_Relay[i].relay_number, item),
+                                      SOLAR.day(now) if SOLAR else None)
+        except ValueError as e:
+            logger.error("タイマーを判定できません: %s", e)
+            return False
+        if window is None:
+            return      # 場所（緯度・経度）が設定されていないので判定できない
+        # 判定はシミュレーターと共通のスケジュールエンジンで行う
+        desired   = timer_active(window[0], window[1], now.hour * 60 + now.minute)
+        #ＯＮの時間帯なのにリレーがＯＦＦの場合（ＯＮは呼び出し元でずらして行う）
+        if desired and not Each_Relay[i].on_off:
+                return True
+        #ＯＦＦの時間帯なのにリレーがＯＮの場合
+        elif not desired and Each_Relay[i].on_off:
+                Each_Relay[i].relay_off(i, "timer")
+        return False
+
+    @staticmethod
+    # 複数のリレーを STAGGER 秒ずつずらしてＯＮにする（突入電流の抑制）
+    # 全体は STAGGER_DEADLINE 秒以内に終わる。ずらしている間も画面は止まらない
+    # 待っているＯＮは、全ＯＦＦ・そのリレーのＯＦＦ・ウォッチドッグの作動と停止で取り消す
+    # 操作履歴は各リレーのＯＮ（relay_on）で記録する
+    def staggered_on(indexes, source="gui"):
+        if not indexes:
+            return
+        for offset, i in zip(stagger_offsets(len(indexes), STAGGER, STAGGER_DEADLINE), indexes):
+            if offset == 0:
+                Each_Relay[i].relay_on(i, source)
+            else:
+                RelayBoard.cancel_pending([i])
+                RelayBoard.pending[i] = root.root.after(round(offset * 1000), RelayBoard.delayed_on,
+                                                        i, source, RelayBoard.epoch)
+
+    @staticmethod
+    def delayed_on(i, source, epoch):
+        RelayBoard.pending.pop(i, None)
+        if epoch != RelayBoard.epoch:        # 待っている間にウォッチドッグが作動していれば送らない
+            return
+        if not Each_Relay[i].on_off:         # 待っている間に手動でＯＮにされていれば送らない
+            Each_Relay[i].relay_on(i, source)
+
+    @staticmethod
+    # 時差実行で待っているＯＮを取り消す（indexes がNoneなら全リレー）
+    def cancel_pending(indexes=None):
+        for i in list(RelayBoard.pending) if indexes is None else indexes:
+            after_id = RelayBoard.pending.pop(i, None)
+            if after_id is not None:
+                root.root.after_cancel(after_id)
+
+    @staticmethod
+    # ウォッチドッグのスレッドから呼ばれる（画面は止まっているので after_cancel は使えない）
+    def cancel_pending_on_trip(name, stalled):
+        RelayBoard.epoch += 1
     
     @staticmethod
     # デバイスのステータスを参照して、個別リレーのＯＮＯＦＦ状況をEach_Relay[i].on_offに反映する。
@@ -282,29 +348,92 @@ class RelayBoard:
             return False
 
     @staticmethod
-    def on_all():
+    # 画面上の全リレーのＯＮＯＦＦ状況をビットマスク（リレー1がビット0）にして返す
+    def current_mask():
+        return sum(1 << i for i in range(QUANTITY_RELAY) if Each_Relay[i].on_off)
+
+    @staticmethod
+    # インターロックの規則で current（現在の状態）から set_bits をＯＮ、clear_bits をＯＦＦにする書き込みを確認し、
+    # 書き込んでよい状態のマスクを返す。拒否した場合は画面の操作ならメッセージを出してNoneを返す
+    def interlock_target(set_bits, clear_bits, source):
+        current = RelayBoard.current_mask()
+        try:
+            return INTERLOCK.check(current, (current | set_bits) & ~clear_bits, set_bits | clear_bits, source)
+        except InterlockError as e:
+            if source == "gui":
+                root.show_error(f"インターロックのため操作できません\n{e}")
+            return None
+
+    @staticmethod
+    # 個別のＯＮ/ＯＦＦの前にインターロックを確認する。規則で他のリレーも切り替える場合は先に切り替え（ＯＦＦが先）、
+    # 操作してよければTrueを返す
+    def interlocked(set_bits, clear_bits, source):
+        target = RelayBoard.interlock_target(set_bits, clear_bits, source)
+        if target is None or target & (set_bits | clear_bits) != set_bits:
+            return False
+        RelayBoard.switch_to(target, ~(set_bits | clear_bits))
+        return True
+
+    @staticmethod
+    # care のリレーを target の状態にする（インターロックで確認済みの切り替え。ＯＦＦを先に行い、
+    # ＯＮは規則で必要とされるリレーから行う）
+    def switch_to(target, care):
+        current = RelayBoard.current_mask()
+        for i in range(QUANTITY_RELAY):
+            if care & (current & ~target) & (1 << i):
+                Each_Relay[i].relay_off(i, "interlock")
+        for i in INTERLOCK.on_order:
+            if care & (target & ~current) & (1 << i):
+                Each_Relay[i].relay_on(i, "interlock")
+
+    @staticmethod
+    def on_all(source="gui"):
         # 全リレーをONにする
+        # 全ＯＮがインターロックの規則に反する場合は、規則で直した状態にする（拒否の設定なら何もしない）
+        if INTERLOCK and source != "interlock" and not INTERLOCK.allowed(full_mask(QUANTITY_RELAY)):
+            target = RelayBoard.interlock_target(full_mask(QUANTITY_RELAY), 0, source)
+            if target is not None:
+                RelayBoard.switch_to(target, target ^ full_mask(QUANTITY_RELAY))
+                RelayBoard.staggered_on([i for i in range(QUANTITY_RELAY)
+                                         if target & (1 << i) and not Each_Relay[i].on_off], source)
+            return
+        # 時差実行が設定されている場合は、ＯＦＦのリレーをずらしてＯＮにする
+        off_relays = [i for i in range(QUANTITY_RELAY) if not Each_Relay[i].on_off]
+        if STAGGER > 0 and len(off_relays) > 1:
+            RelayBoard.staggered_on(off_relays, source)
+            return
+        old_mask = RelayBoard.current_mask()
+        started  = time.perf_counter()
         if Usb_relay_device:
-            instructions=[0, 0xFE, 0, 0, 0, 0, 0, 0, 1]
+            instructions=ALL_ON_REPORT
             Usb_relay_device.send(raw_data=instructions)
+            latency = time.perf_counter() - started
             RelayBoard.set_all_status()
         else:
+            latency = time.perf_counter() - started
             for i in range(QUANTITY_RELAY):
                 Each_Relay[i].on_off = True
+        audit(source, BOARD_NAME, "all", old_mask, RelayBoard.current_mask(), latency)  # 操作履歴に記録
         root.show_all_relay_status()
         root.all_timer_status_update()
         #print('relay all on')
         
     @staticmethod
-    def off_all():
-        # 全リレーをOFFにする
+    def off_all(source="gui"):
+        # 全リレーをOFFにする（全ＯＦＦはどのインターロックの規則にも反しない）
+        RelayBoard.cancel_pending()             # 時差実行で待っているＯＮを取り消す
+        old_mask = RelayBoard.current_mask()
+        started  = time.perf_counter()
         if Usb_relay_device:
-            instructions=[0, 0xFC, 0, 0, 0, 0, 0, 0, 1]
+            instructions=ALL_OFF_REPORT
             Usb_relay_device.send(raw_data=instructions)
+            latency = time.perf_counter() - started
             RelayBoard.set_all_status()
         else:
+            latency = time.perf_counter() - started
             for i in range(QUANTITY_RELAY):
                 Each_Relay[i].on_off = False
+        audit(source, BOARD_NAME, "all", old_mask, RelayBoard.current_mask(), latency)  # 操作履歴に記録
         root.show_all_relay_status()
         root.all_timer_status_update()
         #print('relay all off')
@@ -327,6 +456,11 @@ class RelayControll:
         self.spinbox_end_minutes   = []
         self.relay_datas           = []
         self.y_offset              = 0
+        self.lag_monitor           = LagMonitor()   # イベントループの遅延の記録
+        self.tickers               = []
+        self.watchdog              = None           # フェイルセーフのウォッチドッグ
+        self.heartbeat             = None
+        self.autosaver             = None
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)  # ウィンドウが閉じられたときの処理
         
             
@@ -347,10 +481,11 @@ class RelayControll:
                     Each_Relay[i].start_minute.set(loaded_data[i]["start_minute"])
                     Each_Relay[i].end_hour.set(    loaded_data[i]["end_hour"])
                     Each_Relay[i].end_minute.set(  loaded_data[i]["end_minute"])
-                print(f"{file_path} からデータを読み込みました")
+                    Each_Relay[i].anchors = anchors_from_data(loaded_data[i])
+                logger.info("%s からデータを読み込みました", file_path)
                 self.Initial_display()
             except Exception as e:
-                print(f"エラーが発生しました: {e}")
+                logger.error("エラーが発生しました: %s", e)
                 #show_error("エラーが発生しました。ファイルが正しく読み込まれない可能性があります。")
         
     # メニューのイベントハンドラ
@@ -360,19 +495,36 @@ class RelayControll:
             filetypes=[("JSONファイル", "*.json"), ("すべてのファイル", "*.*")]
         )
         if file_path:  # ユーザーがファイルを選択した場合
-            data_to_save = []
-            for i in range(QUANTITY_RELAY):
-                data_to_save.append({
-                    "classifying":  Each_Relay[i].classifying.get(),
-                    "timer_onoff":  Each_Relay[i].timer_onoff.get(),
-                    "start_hour":   Each_Relay[i].start_hour.get(),
-                    "start_minute": Each_Relay[i].start_minute.get(),
-                    "end_hour":     Each_Relay[i].end_hour.get(),
-                    "end_minute":   Each_Relay[i].end_minute.get(),
-                })
-            with open(file_path, 'w') as f:
-                json.dump(data_to_save, f, ensure_ascii=False, indent=4)
-            print(f"データを {file_path} に保存しました")
+            atomic_write_json(file_path, self.relay_data())  # 書き込み中に異常終了しても元のファイルは壊れない
+            logger.info("データを %s に保存しました", file_path)
+
+    # 全リレーの名称とタイマー設定を保存用のリストにする
+    def relay_data(self):
+        data_to_save = []
+        for i in range(QUANTITY_RELAY):
+            data_to_save.append({
+                "classifying":  Each_Relay[i].classifying.get(),
+                "timer_onoff":  Each_Relay[i].timer_onoff.get(),
+                "start_hour":   Each_Relay[i].start_hour.get(),
+                "start_minute": Each_Relay[i].start_minute.get(),
+                "end_hour":     Each_Relay[i].end_hour.get(),
+                "end_minute":   Each_Relay[i].end_minute.get(),
+                **Each_Relay[i].anchors,
+            })
+        return data_to_save
+
+    # 名称・タイマー設定の変更を監視し、デフォルトファイルに自動保存する
+    def start_autosave(self, file_path):
+        self.autosaver = AutoSaver(file_path)
+        for relay in Each_Relay:
+            for var in (relay.classifying, relay.timer_onoff, relay.start_hour,
+                        relay.start_minute, relay.end_hour, relay.end_minute):
+                var.trace_add("write", lambda *args: self.request_autosave())
+
+    # 保存はバックグラウンドで行うので、画面の処理は待たされない
+    def request_autosave(self):
+        if self.autosaver:
+            self.autosaver.submit(self.relay_data())
 
     # 設定メニューのイベントハンドラ
     def open_settings(self, settings):
@@ -413,9 +565,11 @@ class RelayControll:
             device_id      = device_id_entry.get()
             quantity_relay = quantity_relay_entry.get()
             auto_load      = auto_load_entry.get()
-            data = {"vender_id": vender_id, "device_id": device_id, "quantity_relay": quantity_relay, "auto_load": auto_load }
+            # 画面に無い項目（場所・時差実行・ウォッチドッグ・インターロック等）は設定ファイルの内容のまま残す
+            data = dict(preset_file.read_settings(),
+                        vender_id=vender_id, device_id=device_id, quantity_relay=quantity_relay, auto_load=auto_load)
             self.save_settings(data)
-            print(f"ベンダーID: {vender_id}, デバイスID: {device_id}, リレー個数: {quantity_relay}, デフォルトファイル: {auto_load}")
+            logger.info("ベンダーID: %s, デバイスID: %s, リレー個数: %s, デフォルトファイル: %s", vender_id, device_id, quantity_relay, auto_load)
             self.settings_window.destroy()
 
         save_button = tk.Button(self.settings_window, text="保存", command=lambda: set_settings())
@@ -425,6 +579,14 @@ class RelayControll:
         #プログラムの再起動を行う関数
         # Pythonインタプリタの場合
         python = sys.executable
+        self.stop_watchdog()
+        if self.autosaver:
+            self.autosaver.stop()   # 保存待ちの変更を書き出してから再起動する
+        if TRACE_WRITER:
+            TRACE_WRITER.close()    # 通信の記録を書き出してから再起動する
+        if HISTORY:
+            HISTORY.stop()          # 状態の履歴を保存してから再起動する
+        stop_logging()    # 残っているログを書き出してから再起動する
         os.execl(python, python, *sys.argv)
         # EXEの場合
         #executable = sys.executable  
@@ -432,9 +594,8 @@ class RelayControll:
 
     # 設定データ（ベンダーＩＤ，デバイスＩＤ，リレー個数、デフォルトデータファイル名）を保存する関数
     def save_settings(self,data):
-        print("設定ファイルを保存しました : ", data)
-        with open(SETTING_FILE, "w") as file:
-            json.dump(data, file)
+        atomic_write_json(preset_file.setting, data)    # 書き込み中に異常終了しても設定ファイルが壊れないように保存する
+        logger.info("設定ファイルを保存しました : %s", data)
 
         response = messagebox.askquestion(
             title="変更内容を反映",
@@ -480,8 +641,40 @@ class RelayControll:
         now = datetime.now()
         formatted_time = now.strftime("%Y-%m-%d %H:%M:%S")
         self.label_current_time.config(text=formatted_time)
-        # 1秒後に再度この関数を呼び出す
-        self.root.after(1000, self.update_time)
+        # イベントループの遅延を表示（大きい時は赤）
+        lag_text, lagging = self.lag_monitor.status_text()
+        self.label_lag.config(text=lag_text, fg="red" if lagging else "navy")
+        if self.heartbeat:
+            self.heartbeat.beat()           # 画面が動いていることをウォッチドッグに通知する
+
+    # 画面が timeout 秒止まったら、リレーを safe_mask の状態にするウォッチドッグを開始する
+    # 安全な状態への送信は、止まった送信に巻き込まれないよう別に開いたデバイスで行う
+    def start_watchdog(self, timeout, safe_mask):
+        if INTERLOCK and not INTERLOCK.allowed(safe_mask):
+            logger.error("安全な状態 %s がインターロックの規則に反しています", format(safe_mask, f"0{QUANTITY_RELAY}b"))
+        safe_board = HidRelayBoard(USB_CFG_VENDOR_ID, USB_CFG_DEVICE_ID, QUANTITY_RELAY)
+        if not safe_board.open():
+            logger.error("ウォッチドッグ用にデバイスをＯＰＥＮできないため、ウォッチドッグは動作しません")
+            return
+        self.watchdog  = Watchdog({BOARD_NAME: safe_board}, {BOARD_NAME: safe_mask},
+                                  on_trip=RelayBoard.cancel_pending_on_trip)
+        self.heartbeat = self.watchdog.register("画面", timeout)
+        self.watchdog.start()
+
+    def stop_watchdog(self):
+        RelayBoard.cancel_pending()
+        if self.watchdog:
+            self.watchdog.stop()
+            for board in self.watchdog.boards.values():
+                board.close()
+            self.watchdog = None
+
+    # callback を interval 秒の区切り（毎秒0ミリ秒・毎分0秒）ごとに呼び出す
+    # 毎回次の区切りまでの時間で呼び直すので遅れが溜まらず、遅延は lag_monitor に記録する
+    def start_ticker(self, interval, callback):
+        ticker = AlignedTicker(self.root.after, interval, callback, self.lag_monitor)
+        self.tickers.append(ticker)
+        ticker.start()
     #========ヘッダーの作成終わり=========#
     
     #========ＢＯＤＹの作成=========# 
@@ -553,6 +746,8 @@ class RelayControll:
             
         label10_1 = tk.Label(self.root, text=f"ベンダーID：{USB_CFG_VENDOR_ID}  デバイスID：{USB_CFG_DEVICE_ID}  {program_message}",bg="lightblue" ,fg=program_message_color)
         label10_1.place(x=6, y=self.y_offset + 60)
+        self.label_lag = tk.Label(self.root, text="", bg="lightblue", fg="navy")   # イベントループの遅延
+        self.label_lag.place(x=455, y=self.y_offset + 32)
     #========下行の作成終わり=========# 
 
     #========画面イベントハンドラ=========# 
@@ -568,6 +763,8 @@ class RelayControll:
 
     # 個別リレーのＯＮ/ＯＦＦ状況を画面に表示する関数
     def show_relay_status(self,i):
+        if HISTORY:
+            HISTORY.record(BOARD_NAME, i + 1, Each_Relay[i].on_off)  # 状態の履歴に記録する（同じ状態なら記録しない）
         if Each_Relay[i].on_off:
             root.onoff_indicators[i].config(bg="yellow", fg="red")  # リレーがＯＮの時の表示
         else:
@@ -627,13 +824,13 @@ class RelayControll:
     def toggle_switch(self,i):
         # 即時スイッチONOFFの切り替え
         if Each_Relay[i].on_off:                           # リレーがＯＮの時
-            Each_Relay[i].relay_off(i)                     # 即時ＯＦＦの処理メソッド実行
-            if RelayBoard.set_all_status() == False:       # 全リレーのＯＮＯＦＦ状況を設定(デバイスが有効の場合機械的にステータスを全部設定)
-                Each_Relay[i].on_off = False               # デバイスが有効でない場合、ＯＮＯＦＦフラグをＯＦＦにする
+            if Each_Relay[i].relay_off(i):                 # 即時ＯＦＦの処理メソッド実行（インターロックで拒否されたら何もしない）
+                if RelayBoard.set_all_status() == False:   # 全リレーのＯＮＯＦＦ状況を設定(デバイスが有効の場合機械的にステータスを全部設定)
+                    Each_Relay[i].on_off = False           # デバイスが有効でない場合、ＯＮＯＦＦフラグをＯＦＦにする
         else:                                              # リレーがＯＦＦの時
-            Each_Relay[i].relay_on(i)                      # 即時ＯＮの処理メソッド実行
-            if RelayBoard.set_all_status() == False:       # 全リレーのＯＮＯＦＦ状況を設定(デバイスが有効の場合機械的にステータスを全部設定)
-                Each_Relay[i].on_off = True                # デバイスが有効でない場合、ＯＮＯＦＦフラグをＯＮにする
+            if Each_Relay[i].relay_on(i):                  # 即時ＯＮの処理メソッド実行（インターロックで拒否されたら何もしない）
+                if RelayBoard.set_all_status() == False:   # 全リレーのＯＮＯＦＦ状況を設定(デバイスが有効の場合機械的にステータスを全部設定)
+                    Each_Relay[i].on_off = True            # デバイスが有効でない場合、ＯＮＯＦＦフラグをＯＮにする
         self.each_timer_status_update(i)                   # 各リレーの状況を画面に表示する 
 
     def all_clear(self):
@@ -649,16 +846,19 @@ class RelayControll:
             self.show_timer_status(i, "未設定", "green")
             
     def relay_timer_process(self):
+        # 実際のＯＮＯＦＦ状況をデバイスから読み込む(デバイスが有効でない場合は画面上の状況を使う)
+        if Usb_relay_device:
+            RelayBoard.set_all_status()
+        switch_on = []                                 # 同じ分にＯＮになるリレー
         for i in range(QUANTITY_RELAY):
             # 各リレーのタイマーがＯＮの場合、時分のチェックを行う
             if Each_Relay[i].timer_onoff.get():  
                 #print(f">>>>{i}.timer_onoff=", Each_Relay[i].timer_onoff.get())
-                Each_Relay[i].relay_timer_decision(i)  # 各リレーの処理を実行
-
-        # タイマー時刻の監視を60秒ごとに行う
-        self.root.after(60000, self.relay_timer_process)
-        # タイマー時刻の監視を6秒ごとに行う
-        #root.after(6000, relay_timer_process)
+                if Each_Relay[i].relay_timer_decision(i):  # 各リレーの処理を実行
+                    switch_on.append(i)
+        RelayBoard.staggered_on(switch_on, "timer")    # 同時にＯＮにならないようずらす
+        self.show_all_relay_status()                   # 手動で切り替えられた状況も画面に反映する
+        # 次の呼び出しは start_ticker で毎分0秒に合わせて行う
 
     def Initial_display(self):
         self.show_all_relay_status()             # 全リレーの状況を画面に表示 
@@ -674,8 +874,16 @@ class RelayControll:
 
     def on_closing(self):
         # ウィンドウ終了時に実行する処理
+        self.stop_watchdog()              # 終了処理中に作動しないよう先に止める
         USBRelayInterface.close_device()  # デバイスクローズ関数を呼び出す
         self.root.destroy()               # ウィンドウを閉じる
+        if self.autosaver:
+            self.autosaver.stop()         # 保存待ちの変更を書き出す
+        if TRACE_WRITER:
+            TRACE_WRITER.close()          # 通信の記録を書き出す
+        if HISTORY:
+            HISTORY.stop()                # 状態の履歴を保存する
+        stop_logging()                    # 残っているログを書き出す
         
     # ポップアップを表示する関数
     def show_error(self,message):
@@ -685,6 +893,9 @@ class RelayControll:
 #========メイン処理=========#    
 if __name__ == "__main__":
     
+    # ログの書き込みスレッドを開始
+    setup_logging()
+    
     # 外部設定ファイル名の定義
     SETTING_FILE = "settings.json"
     
@@ -697,6 +908,17 @@ if __name__ == "__main__":
     USB_CFG_DEVICE_ID = settings["device_id"]
     QUANTITY_RELAY    = settings["quantity_relay"]
     AUTO_LOAD         = settings["auto_load"]
+    BOARD_NAME        = f"{USB_CFG_VENDOR_ID}:{USB_CFG_DEVICE_ID}"  # 操作履歴に記録するボード名
+    SOLAR             = calendar_from_settings(settings)           # 日の出・日の入りの表（緯度・経度が設定されている場合）
+    STAGGER           = float(settings.get("stagger", 0) or 0)               # ＯＮをずらす間隔（秒）0:ずらさない
+    STAGGER_DEADLINE  = float(settings.get("stagger_deadline", 2.0) or 2.0)  # ずらしたＯＮを終えるまでの上限（秒）
+    WATCHDOG_TIMEOUT  = float(settings.get("watchdog_timeout", 0) or 0)      # 画面が止まったとみなす秒数 0:監視しない
+    SAFE_MASK         = parse_mask(settings.get("safe_mask", "0"))           # 画面が止まった時のリレーの状態
+    try:
+        INTERLOCK     = interlock_from_settings(settings, QUANTITY_RELAY)     # 同時ＯＮの禁止等の規則（"interlocks"）
+    except (ValueError, KeyError, TypeError) as e:
+        logger.error("インターロックの規則が正しくありません: %s", e)
+        INTERLOCK     = None
     
     # オートロード・データファイルの読み込み
     auto_loaded       = AutoLoadData(AUTO_LOAD,QUANTITY_RELAY)
@@ -717,6 +939,22 @@ if __name__ == "__main__":
     else:
         program_message       = "デバイスが不明のため、コントロール不可"
         Usb_relay_device      = None
+    
+    # 設定ファイルに "trace_file" があれば、送受信したレポートを記録する（relay_trace.py で表示・再生できる）
+    TRACE_WRITER = None
+    if Usb_relay_device and settings.get("trace_file"):
+        TRACE_WRITER     = TraceWriter(os.path.join(os.path.dirname(__file__), settings["trace_file"]))
+        Usb_relay_device = TracingReport(Usb_relay_device, TRACE_WRITER)
+
+    # 設定ファイルに "history_file" があれば、リレーの状態の履歴を記録する（relay_history.py で集計できる）
+    HISTORY = None
+    if settings.get("history_file"):
+        try:
+            HISTORY = HistoryStore(os.path.join(os.path.dirname(__file__), settings["history_file"]))
+            HISTORY.start()
+        except (OSError, ValueError) as e:
+            logger.error("状態の履歴を読み込めませんでした: %s", e)
+            HISTORY = None
         
     # tkオブジェクトの作成
     root = RelayControll()
@@ -731,7 +969,8 @@ if __name__ == "__main__":
                                     loaded_data[i]['start_hour'], 
                                     loaded_data[i]['start_minute'], 
                                     loaded_data[i]['end_hour'], 
-                                    loaded_data[i]['end_minute']
+                                    loaded_data[i]['end_minute'],
+                                    anchors_from_data(loaded_data[i])
                                     )
                         )
         
@@ -744,11 +983,19 @@ if __name__ == "__main__":
     # 初期画面表示処理
     root.Initial_display()
     
-    # カレント日時分秒の表示
-    root.update_time()
+    # デフォルトファイルが設定されていれば、変更を自動保存する
+    if AUTO_LOAD:
+        root.start_autosave(auto_loaded.load_file)
+    
+    # カレント日時分秒の表示（毎秒0ミリ秒に合わせて更新）
+    root.start_ticker(1, root.update_time)
+    
+    # タイマー処理の呼び出し（毎分0秒に合わせて実行）
+    root.start_ticker(60, root.relay_timer_process)
     
-    # タイマー処理の呼び出し
-    root.relay_timer_process()
+    # 画面が止まった時にリレーを安全な状態にするウォッチドッグ
+    if Usb_relay_device and WATCHDOG_TIMEOUT > 0:
+        root.start_watchdog(WATCHDOG_TIMEOUT, SAFE_MASK)
     
     # イベントループ開始
     root.run()
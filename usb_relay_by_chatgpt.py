@@ -5,6 +5,7 @@ import json
 import os
 from datetime import datetime
 from pywinusb import hid
+from relay_codec import mask_report
 
 SETTINGS_FILE = "settings.json"
 
@@ -45,9 +46,8 @@ class USBRelayController:
     def _send_state(self):
         try:
             out_report = self.device.find_output_reports()[0]
-            buffer = [0x00] * out_report.report_length
-            buffer[1] = self.relay_state
-            out_report.set_raw_data(buffer)
+            # 状態ごとのレポートは relay_codec で一度だけ作って使い回す
+            out_report.set_raw_data(mask_report(out_report.report_length, self.relay_state))
             out_report.send()
         except Exception as e:
             print(f"リレー送信エラー: {e}")